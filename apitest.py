@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+import uuid
+
+# 接口测试的公共部分：临时数据目录、Flask测试客户端和测试用户
+# 数据目录在导入应用之前设置（同一进程中的各测试模块共用一个临时数据目录）
+
+os.environ.setdefault('TAPIR_DATA_DIR', os.path.join(tempfile.mkdtemp(prefix='tapir_test_'), 'data'))
+
+import app as tapir_app
+
+
+class ApiTestCase(unittest.TestCase):
+    """每个测试类一个测试客户端（不启动后台任务），提供注册用户和创建空间的辅助方法"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = tapir_app.create_app({'BACKGROUND_JOBS': False})
+        cls.client = cls.app.test_client()
+
+    # 注册一个新用户（用户名加随机后缀，各测试互不影响），返回 (用户ID, 请求头)
+    def register(self, prefix='user'):
+        username = f"{prefix}_{uuid.uuid4().hex[:8]}"
+        response = self.client.post('/api/auth/register', json={
+            'username': username, 'password': 'password123', 'email': f'{username}@example.com'})
+        self.assertEqual(response.status_code, 201)
+        data = response.get_json()
+        return data['user']['id'], {'Authorization': 'Bearer ' + data['token']}
+
+    # 创建空间，返回空间ID
+    def create_space(self, headers, name='测试空间'):
+        response = self.client.post('/api/spaces', json={'name': name}, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()['id']
+
+    # 按邀请码加入空间
+    def join_space(self, space_id, owner_headers, headers):
+        space = self.client.get(f'/api/spaces/{space_id}', headers=owner_headers).get_json()
+        response = self.client.post('/api/spaces/join', json={'invite_code': space['invite_code']}, headers=headers)
+        self.assertEqual(response.status_code, 200)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from flask import Flask, request, jsonify, send_from_directory, g
+from flask import Flask, Blueprint, request, jsonify, send_from_directory, g, has_request_context
 import json
 import os
 import datetime
@@ -10,92 +10,222 @@ import threading
 import uuid
 import base64
 from flask_cors import CORS
-from auth import auth_bp, login_required, init_users_file, init_spaces_file
-from space import space_bp, member_required
+from functools import wraps
+from auth import auth_bp, login_required, read_spaces
+from space import space_bp, member_required, get_members_with_username
+import archive
+import clock
+import settings
+from cleanup import (cleanup_bp, create_tombstone, start_cleanup_worker, requeue_pending_tombstones,
+                     ENTITY_TASK, ENTITY_DREAM)
 from models import MemberRole, Dream, Task, TaskRecord
+import events
+from http_cache import conditional
+from events import events_bp
+import generation
+from generation import generation_bp, start_generation_workers, schedule_job_requeue
+from sync import sync_bp
+from dream_index import DreamIndex, dream_fingerprint
+from derived_store import DerivedStore, derived_memo
+from search import (SearchIndex, make_snippet, DOC_TYPES, DOC_DREAM, DOC_INTERPRETATION,
+                    DOC_CONTINUATION, DOC_PREDICTION)
+from storage import (IMAGES_DIR, DREAMS_FILE, TASKS_FILE, TASK_RECORDS_FILE,
+                     USERS_FILE, SPACES_FILE, HISTORY_RECORDS_FILE,
+                     DREAM_INTERPRETATIONS_FILE, DREAM_CONTINUATIONS_FILE, DREAM_PREDICTIONS_FILE,
+                     TASK_STATS_FILE, SPACES_STATISTICS_FILE, TOMBSTONES_FILE, PROFILES_DIR,
+                     RECORDS_ARCHIVE_DIR, config as storage_config,
+                     init_storage, ensure_storage, read_data, read_snapshot, write_data, stamp_updated,
+                     save_base64_images,
+                     file_lock, wait_for_scheduler_leadership, shard_file, read_collection, write_collection,
+                     collection_files, collection_lock, shard_lock, shards_lock, space_lock)
+import metrics
+import compress
 import random
 import string
 import hashlib
 from datetime import timedelta
 import logging
 
-app = Flask(__name__)
-CORS(app)  # 允许跨域请求
-
-# 注册蓝图
-app.register_blueprint(auth_bp, url_prefix='/api/auth')
-app.register_blueprint(space_bp, url_prefix='/api/spaces')
-
-# 确保数据目录存在
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
-os.makedirs(DATA_DIR, exist_ok=True)
-
-# 确保图片目录存在
-IMAGES_DIR = os.path.join(DATA_DIR, 'images')
-os.makedirs(IMAGES_DIR, exist_ok=True)
-
-# 数据文件路径
-DREAMS_FILE = os.path.join(DATA_DIR, 'dreams.json')
-TASKS_FILE = os.path.join(DATA_DIR, 'tasks.json')
-TASK_RECORDS_FILE = os.path.join(DATA_DIR, 'task_records.json')
-USER_SETTINGS_FILE = os.path.join(DATA_DIR, 'user_settings.json')
-USERS_FILE = os.path.join(DATA_DIR, 'users.json')
-SPACES_FILE = os.path.join(DATA_DIR, 'spaces.json')
-HISTORY_RECORDS_FILE = os.path.join(DATA_DIR, 'history_records.json')
-
-# 新增数据文件路径
-DREAM_INTERPRETATIONS_FILE = os.path.join(DATA_DIR, 'dream_interpretations.json')
-DREAM_CONTINUATIONS_FILE = os.path.join(DATA_DIR, 'dream_continuations.json')
-DREAM_PREDICTIONS_FILE = os.path.join(DATA_DIR, 'dream_predictions.json')
-TASK_STATS_FILE = os.path.join(DATA_DIR, 'task_stats.json')
-
-# 新的统计设置文件
-SPACES_STATISTICS_FILE = os.path.join(DATA_DIR, 'spaces_statistics.json')
-
-# 添加日志配置
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# 梦境、任务、打卡等接口；应用由 create_app 创建，导入本模块不会初始化数据文件或启动线程
+api_bp = Blueprint('api', __name__)
+
 logger = logging.getLogger('tapir_twins')
 
-# 初始化数据文件
-def init_data_file(file_path, initial_data=None):
-    if not os.path.exists(file_path):
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(initial_data or [], f, ensure_ascii=False, indent=2)
-
-init_data_file(DREAMS_FILE)
-init_data_file(TASKS_FILE)
-init_data_file(TASK_RECORDS_FILE)
-init_data_file(USER_SETTINGS_FILE, {})
-init_data_file(USERS_FILE, [])
-init_data_file(SPACES_FILE, [])
-init_data_file(HISTORY_RECORDS_FILE, [])
-init_data_file(DREAM_INTERPRETATIONS_FILE)
-init_data_file(DREAM_CONTINUATIONS_FILE)
-init_data_file(DREAM_PREDICTIONS_FILE)
-init_data_file(TASK_STATS_FILE)
-init_users_file()
-init_spaces_file()
-
-# 读取数据
-def read_data(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
-        # 根据文件路径返回不同的默认值
-        if file_path == USER_SETTINGS_FILE:
-            return {}
-        return []
-
-# 写入数据
-def write_data(file_path, data):
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+# 应用默认配置
+DEFAULT_CONFIG = {
+    # 是否在本进程启动定时任务（竞争调度锁）和后台级联清理线程
+    'BACKGROUND_JOBS': True,
+    # 数据目录布局（storage.StorageConfig）；布局在导入 storage 时由 TAPIR_DATA_DIR 等环境变量确定，
+    # 各模块导入的是据此计算好的文件路径，这里只能核对，传入不同的布局时 create_app 报错
+    'STORAGE': None
+}
+
+# 梦境内容指纹索引
+dream_index = DreamIndex()
+
+# 获取与数据文件保持一致的梦境索引
+def get_dream_index():
+    dream_index.ensure_fresh(DREAMS_FILE, lambda: read_collection(DREAMS_FILE))
+    return dream_index
+
+# 同一梦境ID下（相同内容的梦境共享ID）要修改或删除的记录：优先调用者自己的记录，
+# 其次按文件顺序（主文件在前，各分片按空间ID排序）的第一条；dreams 为同一ID的记录列表
+def preferred_dream(dreams, user_id):
+    return min(dreams, default=None, key=lambda dream: (
+        dream.get('user_id') != user_id, bool(dream.get('space_id')), dream.get('space_id') or ''))
+
+# 按ID查找条目所在的空间（个人数据为 None）：梦境使用梦境索引（见 preferred_dream），
+# 其他集合依次查找主文件和各分片，找不到时为 None
+def locate_space_id(file_path, item_id, user_id=None):
+    if file_path == DREAMS_FILE:
+        dream = preferred_dream(get_dream_index().entries(item_id), user_id)
+        return dream.get('space_id') if dream is not None else None
+    for path in collection_files(file_path):
+        item = next((item for item in read_data(path) if item.get('id') == item_id), None)
+        if item is not None:
+            return item.get('space_id')
+    return None
+
+def item_lock(file_path, *file_paths, id_arg):
+    """
+    视图装饰器：按路径参数 id_arg 中的ID找到条目所在的空间，只锁住该空间在 file_path 及 file_paths 集合中的分片。
+    所在空间记录在 g.item_space_id 中；条目不存在时为 None，视图在主文件中找不到该条目，照常返回404
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            g.item_space_id = locate_space_id(file_path, kwargs[id_arg], g.user_id)
+            with shard_lock(g.item_space_id, file_path, *file_paths):
+                return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+# 解梦、续写、预测按梦境ID的分层存储（偏移量索引 + 共享的LRU缓存）
+interpretation_store = DerivedStore('dream_interpretations', DREAM_INTERPRETATIONS_FILE)
+continuation_store = DerivedStore('dream_continuations', DREAM_CONTINUATIONS_FILE)
+prediction_store = DerivedStore('dream_predictions', DREAM_PREDICTIONS_FILE)
+
+# 检索文档类型 -> 衍生内容存储
+DERIVED_STORES = {
+    DOC_INTERPRETATION: interpretation_store,
+    DOC_CONTINUATION: continuation_store,
+    DOC_PREDICTION: prediction_store
+}
+
+# 查询参数中的开关（1/true/yes 为开启）
+def arg_flag(name):
+    return request.args.get(name, '').lower() in ('1', 'true', 'yes')
+
+# 衍生内容请求的查询参数：bypass_cache（不使用缓存）、own_only（只返回本梦境的）
+def derived_options():
+    return {'bypass_cache': arg_flag('bypass_cache'), 'own_only': arg_flag('own_only')}
+
+def get_derived_items(doc_type, dream_id, style=None, bypass_cache=False, own_only=False):
+    """
+    梦境的衍生内容，包括规范化内容指纹相同的其他梦境的衍生内容，style 不为空时只返回该风格的。
+    结果按 (类型, 指纹, 风格) 缓存，数据文件变化或超过有效期后重新计算；
+    bypass_cache 为真时重新计算且不读写缓存（结果相同）；own_only 为真时只返回本梦境的
+    """
+    store = DERIVED_STORES[doc_type].refresh()
+    index = get_dream_index()
+    dream = index.get(dream_id)
+    if own_only or dream is None:
+        return [item for item in store.get(dream_id) if style is None or item.get('style') == style]
+    fingerprint = dream_fingerprint(dream.get('title'), dream.get('content'))
+    key = (doc_type, fingerprint, style)
+    version = (store.signature, index.signature)
+    cached = None if bypass_cache else derived_memo.get(key, version)
+    if cached is not None:
+        return list(cached)
+    items = []
+    seen = set()
+    for other_id in index.equivalent_ids(fingerprint):
+        for item in store.get(other_id):
+            if item.get('id') not in seen and (style is None or item.get('style') == style):
+                seen.add(item.get('id'))
+                items.append(item)
+    if not bypass_cache:
+        derived_memo.put(key, version, items)
+    return list(items)
+
+# 保存一条衍生内容并加入检索索引
+def save_derived_item(doc_type, item):
+    store = DERIVED_STORES[doc_type]
+    with file_lock(store.file_path):
+        searcher = built_search_index()
+        position = store.append(item)
+        if searcher:
+            searcher.add(doc_type, item, position)
+            searcher.mark_synced(store.file_path)
+    return item
+
+# 保存服务端生成的衍生内容（生成任务的结果）
+def save_generated_content(kind, dream_id, style, content):
+    item = {
+        'id': str(uuid.uuid4()),
+        'dream_id': dream_id,
+        'style': style,
+        'content': content,
+        'created_at': datetime.datetime.now().isoformat()
+    }
+    if kind == DOC_PREDICTION:
+        del item['style']
+    return save_derived_item(kind, item)
+
+# 梦境对用户是否可见：个人梦境只有本人可见，空间梦境只有空间成员可见
+def dream_visible_to(dream, user_id):
+    space_id = dream.get('space_id')
+    if not space_id:
+        return dream.get('user_id') == user_id
+    space = next((space for space in read_spaces() if space.get('id') == space_id), None)
+    return space is not None and any(member.get('user_id') == user_id for member in space.get('members', []))
+
+# 按ID获取梦境；指定用户时只返回该用户可见的记录（内容相同的梦境共享ID）
+def load_visible_dream(dream_id, user_id=None):
+    if user_id is None:
+        return get_dream_index().get(dream_id)
+    return next((dream for dream in get_dream_index().entries(dream_id) if dream_visible_to(dream, user_id)), None)
+
+generation.configure(load_dream=load_visible_dream,
+                     load_results=get_derived_items,
+                     save_result=save_generated_content)
+
+# 梦境全文检索索引
+search_index = SearchIndex()
+
+# 获取与数据文件保持一致的检索索引
+def get_search_index():
+    search_index.ensure_fresh({
+        DOC_DREAM: (DREAMS_FILE, lambda: [(dream, None) for dream in read_collection(DREAMS_FILE)]),
+        DOC_INTERPRETATION: (DREAM_INTERPRETATIONS_FILE, interpretation_store.items_with_positions),
+        DOC_CONTINUATION: (DREAM_CONTINUATIONS_FILE, continuation_store.items_with_positions),
+        DOC_PREDICTION: (DREAM_PREDICTIONS_FILE, prediction_store.items_with_positions)
+    })
+    return search_index
+
+# 检索结果的正文（索引中不保存正文）：梦境从梦境索引读取，衍生内容按位置从衍生内容存储读取
+def search_doc_content(doc):
+    if doc['type'] == DOC_DREAM:
+        item = next((dream for dream in get_dream_index().entries(doc['id'])
+                     if dream.get('user_id') == doc['user_id'] and (dream.get('space_id') or None) == doc['space_id']),
+                    None)
+    else:
+        item = DERIVED_STORES[doc['type']].get_item(doc['dream_id'], doc['id'], doc['position'])
+    return (item and item.get('content')) or ''
+
+# 写入时使用的检索索引：索引已建立时返回索引，由写入方增量更新；
+# 尚未建立时返回 None，写入不建立索引，由首次检索（/api/search）建立
+def built_search_index():
+    return search_index if search_index.is_built() else None
 
 # 获取今天的日期字符串
+# 当前请求的“今天”：空间接口（路径或参数中的 space_id）按空间的时区，其他接口按当前用户的时区，
+# 同一请求中只计算一次；不在请求中时使用默认时区
 def get_today_date():
-    return datetime.datetime.now().strftime('%Y-%m-%d')
+    if not has_request_context():
+        return clock.local_date()
+    space_id = (request.view_args or {}).get('space_id') or request.args.get('space_id')
+    return clock.today(space_id=space_id, user_id=g.get('user_id'))
 
 # 辅助函数：根据用户ID获取用户名
 def get_username(user_id):
@@ -105,76 +235,123 @@ def get_username(user_id):
         return user.get('username')
     return None
 
-# 检查任务是否今天已完成
-def is_task_completed_today(task_id):
-    records = read_data(TASK_RECORDS_FILE)
-    today = get_today_date()
-    
-    for record in records:
-        if record.get('task_id') == task_id and record.get('date') == today:
-            return True
-    
-    return False
+# 用户ID -> 用户名
+def usernames_by_id(users):
+    return {user.get('id'): user.get('username') for user in users}
 
-# 每日重置任务状态的函数
-def reset_tasks_daily():
-    while True:
-        # 获取当前时间
-        now = datetime.datetime.now()
+# 今天（按各任务的本地日期）已有打卡记录的任务ID，只检查给定的任务
+def completed_today_task_ids(records, tasks):
+    today_by_task = {task.get('id'): clock.task_today(task) for task in tasks}
+    return {record.get('task_id') for record in records
+            if record.get('date') is not None and today_by_task.get(record.get('task_id')) == record.get('date')}
+
+# 换日时最多补做的天数（服务停机错过的换日在下次启动时补上）
+MAX_ROLLOVER_CATCH_UP_DAYS = 7
+
+# 换日检查的间隔（各时区的0点不同，每15分钟检查一次是否有时区进入了新的一天）
+ROLLOVER_INTERVAL_SECONDS = 15 * 60
+
+# 任务在指定日期（任务所在时区的本地日期）是否已存在（当天及之前创建）
+def task_active_on(task, day, zone=None):
+    created_at = task.get('created_at')
+    return not created_at or clock.date_in_zone(created_at, zone) <= day
+
+# 在指定日期缺卡的任务ID（一次遍历全部任务和记录）；zones 为 任务ID -> 时区
+# 空间任务需要打卡记录通过审核，个人任务没有审核，提交了打卡记录即可
+def missed_task_ids(tasks, records, day, zones=None):
+    zones = zones or {}
+    personal = {task['id'] for task in tasks if not task.get('space_id')}
+    done = {record.get('task_id') for record in records
+            if record.get('date') == day and (record.get('status') == 'approved' or record.get('task_id') in personal)}
+    return {task['id'] for task in tasks
+            if task_active_on(task, day, zones.get(task['id'])) and task['id'] not in done}
+
+# 每个任务所在的时区（空间的时区或创建者的时区）
+def task_timezones(tasks):
+    spaces_by_id = {space.get('id'): space for space in read_spaces()}
+    return {task['id']: clock.task_timezone(task, spaces_by_id) for task in tasks}
+
+@collection_lock(TASKS_FILE, TASK_RECORDS_FILE, TASK_STATS_FILE)
+def roll_over_tasks(now=None):
+    """
+    每日换日：任务按所在时区分组，对每个时区上次换日之后到该时区昨天的每一天，找出缺卡的任务（见 missed_task_ids）
+    并追加到 missed_dates，同时重置今天还没有打卡记录的任务的当日状态（status / completed_today）。
+    任务集合只读写一次，只重写有变化的空间分片。now 为时间戳（默认当前时间），返回 {时区: {日期: 缺卡任务数}}
+    """
+    now = time.time() if now is None else now
+    tasks = read_collection(TASKS_FILE)
+    records = read_collection(TASK_RECORDS_FILE)
+    stats_data = read_data(TASK_STATS_FILE)
+    rollover_dates = stats_data.setdefault('rollover_dates', {})
+    zones = task_timezones(tasks)
+    by_zone = {}
+    for task in tasks:
+        by_zone.setdefault(zones[task['id']], []).append(task)
+    
+    summary = {}
+    changed_tasks = []
+    for zone, zone_tasks in by_zone.items():
+        zone_key = zone or 'local'
+        today = clock.local_date(zone, now)
+        today_date = datetime.date.fromisoformat(today)
+        first_day = today_date - timedelta(days=MAX_ROLLOVER_CATCH_UP_DAYS)
+        if rollover_dates.get(zone_key):
+            first_day = max(first_day, datetime.date.fromisoformat(rollover_dates[zone_key]) + timedelta(days=1))
+        days = [(first_day + timedelta(days=i)).isoformat() for i in range((today_date - first_day).days)]
+        if not days:
+            continue
         
-        # 计算距离下一个0点的秒数
-        tomorrow = now.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
-        seconds_until_midnight = (tomorrow - now).total_seconds()
+        missed = {}
+        summary[zone_key] = {}
+        for day in days:
+            task_ids = missed_task_ids(zone_tasks, records, day, zones)
+            summary[zone_key][day] = len(task_ids)
+            for task_id in task_ids:
+                missed.setdefault(task_id, []).append(day)
+        submitted_today = {record.get('task_id') for record in records if record.get('date') == today}
         
-        # 等待到下一个0点
-        time.sleep(seconds_until_midnight)
+        for task in zone_tasks:
+            missed_dates = task.get('missed_dates') or []
+            new_dates = [day for day in missed.get(task['id'], []) if day not in missed_dates]
+            reset = task['id'] not in submitted_today and (
+                task.get('status', 'pending') != 'pending' or task.get('completed_today'))
+            if new_dates:
+                task['missed_dates'] = missed_dates + new_dates
+            if reset:
+                task['status'] = 'pending'
+                task['completed_today'] = False
+            if new_dates or reset:
+                changed_tasks.append(task)
+        rollover_dates[zone_key] = days[-1]
+    
+    if changed_tasks:
+        stamp_updated(changed_tasks)
+        write_collection(TASKS_FILE, tasks)
+    if summary:
+        write_data(TASK_STATS_FILE, stats_data)
+        logger.info(f"任务换日完成，缺卡任务数: {summary}")
+    return summary
+
+# 定期换日（启动时先补做错过的换日）
+def reset_tasks_daily():
+    while True:
+        try:
+            roll_over_tasks()
+        except Exception as e:
+            logger.error(f"任务换日失败: {str(e)}")
         
-        # 重置所有任务的完成状态
-        print(f"重置任务状态: {datetime.datetime.now()}")
-
-# 启动每日重置任务的线程
-reset_thread = threading.Thread(target=reset_tasks_daily, daemon=True)
-reset_thread.start()
-
-# 添加任务统计数据文件初始化
-def init_task_stats_file():
-    """初始化任务统计数据文件，如果不存在则创建"""
-    if not os.path.exists(TASK_STATS_FILE):
-        with open(TASK_STATS_FILE, 'w') as f:
-            json.dump({"monthly_stats": {}}, f)
-        logger.info(f"已创建任务统计数据文件: {TASK_STATS_FILE}")
-
-def init_spaces_statistics_file():
-    """初始化空间统计设置文件"""
-    if not os.path.exists(SPACES_STATISTICS_FILE):
-        init_data_file(SPACES_STATISTICS_FILE, {"spaces": {}})
-        print(f"已创建空间统计设置文件: {SPACES_STATISTICS_FILE}")
-
-# 初始化所有数据文件
-def init_all_data_files():
-    """初始化所有数据文件"""
-    init_users_file()
-    init_spaces_file()
-    init_data_file(DREAMS_FILE, {"dreams": []})
-    init_data_file(TASKS_FILE, {"tasks": []})
-    init_data_file(TASK_RECORDS_FILE, {"records": []})
-    init_task_stats_file()
-    init_data_file(DREAM_INTERPRETATIONS_FILE, {"interpretations": []})
-    init_data_file(DREAM_CONTINUATIONS_FILE, {"continuations": []})
-    init_data_file(DREAM_PREDICTIONS_FILE, {"predictions": []})
-    init_spaces_statistics_file()  # 初始化空间统计设置文件
-
-# 调用初始化函数
-init_all_data_files()
+        # 等待到下一个检查时间点
+        time.sleep(ROLLOVER_INTERVAL_SECONDS - time.time() % ROLLOVER_INTERVAL_SECONDS)
 
 # 梦境API
-@app.route('/api/dreams', methods=['GET'])
+@api_bp.route('/api/dreams', methods=['GET'])
 @login_required
+@conditional(DREAMS_FILE)
 def get_dreams():
     user_id = g.user_id
     space_id = request.args.get('space_id')
     
-    dreams = read_data(DREAMS_FILE)
+    dreams = read_data(shard_file(DREAMS_FILE, space_id))
     
     # 过滤梦境：如果指定了空间ID，则只返回该空间的梦境；否则返回用户的个人梦境
     if space_id:
@@ -184,127 +361,176 @@ def get_dreams():
     
     return jsonify(filtered_dreams)
 
-@app.route('/api/spaces/<space_id>/dreams', methods=['GET'])
+@api_bp.route('/api/spaces/<space_id>/dreams', methods=['GET'])
 @member_required()
+@conditional(DREAMS_FILE, USERS_FILE)
 def get_space_dreams(space_id):
-    dreams = read_data(DREAMS_FILE)
+    return jsonify(space_dreams_with_usernames(read_data(shard_file(DREAMS_FILE, space_id)), space_id,
+                                               usernames_by_id(read_data(USERS_FILE))))
+
+# 空间的梦境，并为每个梦境添加用户名
+def space_dreams_with_usernames(dreams, space_id, usernames):
     space_dreams = [dream for dream in dreams if dream.get('space_id') == space_id]
-    
-    # 为每个梦境添加用户名
     for dream in space_dreams:
         if 'user_id' in dream:
-            dream['username'] = get_username(dream['user_id'])
-    
-    return jsonify(space_dreams)
+            dream['username'] = usernames.get(dream['user_id'])
+    return space_dreams
 
-@app.route('/api/dreams/<dream_id>', methods=['GET'])
+@api_bp.route('/api/dreams/<dream_id>', methods=['GET'])
 @login_required
 def get_dream(dream_id):
     user_id = g.user_id
-    dreams = read_data(DREAMS_FILE)
+    dream = get_dream_index().get(dream_id)
     
-    for dream in dreams:
-        if dream.get('id') == dream_id:
-            # 检查权限：个人梦境只能本人查看，空间梦境只能空间成员查看
-            if dream.get('space_id'):
-                # 这里应该检查用户是否是空间成员，但为简化处理，我们假设前端已经做了相应的限制
-                pass
-            elif dream.get('user_id') != user_id:
-                return jsonify({'error': '无权访问该梦境记录'}), 403
-            
-            return jsonify(dream)
+    if not dream:
+        return jsonify({'error': '未找到该梦境记录'}), 404
     
-    return jsonify({'error': '未找到该梦境记录'}), 404
+    # 检查权限：个人梦境只能本人查看，空间梦境只能空间成员查看
+    if dream.get('space_id'):
+        # 这里应该检查用户是否是空间成员，但为简化处理，我们假设前端已经做了相应的限制
+        pass
+    elif dream.get('user_id') != user_id:
+        return jsonify({'error': '无权访问该梦境记录'}), 403
+    
+    return jsonify(dream.to_dict())
 
-@app.route('/api/dreams', methods=['POST'])
+# 获取梦境及其全部解梦、续写、预测（梦境详情页一次请求）
+@api_bp.route('/api/dreams/<dream_id>/detail', methods=['GET'])
 @login_required
-def add_dream():
+def get_dream_detail(dream_id):
     user_id = g.user_id
-    data = request.json
-    dreams = read_data(DREAMS_FILE)
-    
-    # 检查是否已经存在相同内容的梦境
-    title = data.get('title', '').strip()
-    content = data.get('content', '').strip()
-    
-    # 查找是否有相同内容的梦境
-    existing_dream = next((d for d in dreams if d.get('title') == title and d.get('content') == content), None)
-    
-    if existing_dream:
-        # 如果存在相同内容的梦境，使用其ID
-        new_id = existing_dream['id']
-    else:
-        # 否则生成新的唯一ID
-        new_id = str(uuid.uuid4())
+    dream = get_dream_index().get(dream_id)
     
-    # 添加时间戳和用户ID
-    data['id'] = new_id
-    data['created_at'] = datetime.datetime.now().isoformat()
-    data['user_id'] = user_id
+    if not dream:
+        return jsonify({'error': '未找到该梦境记录'}), 404
     
-    # 如果指定了空间ID，需要验证用户是否是该空间的成员
-    if 'space_id' in data and data['space_id']:
+    # 检查权限：与单独获取梦境保持一致
+    if dream.get('space_id'):
         # 这里应该检查用户是否是空间成员，但为简化处理，我们假设前端已经做了相应的限制
         pass
+    elif dream.get('user_id') != user_id:
+        return jsonify({'error': '无权访问该梦境记录'}), 403
     
-    # 检查是否已存在完全相同的梦境记录（用户ID、内容、标题都相同）
-    duplicate = next((d for d in dreams if d.get('user_id') == user_id and d.get('title') == title and d.get('content') == content), None)
-    
-    # 仅在不是重复记录时添加
-    if not duplicate:
-        dreams.append(data)
-        write_data(DREAMS_FILE, dreams)
-    
-    return jsonify(data), 201
+    options = derived_options()
+    return jsonify({
+        'dream': dream.to_dict(),
+        'interpretations': get_derived_items(DOC_INTERPRETATION, dream_id, **options),
+        'continuations': get_derived_items(DOC_CONTINUATION, dream_id, **options),
+        'predictions': get_derived_items(DOC_PREDICTION, dream_id, **options)
+    })
+
+@api_bp.route('/api/dreams', methods=['POST'])
+@login_required
+def add_dream():
+    user_id = g.user_id
+    data = request.json
+    # 个人梦境写入主文件；指定了空间ID时只锁住并写入该空间的分片
+    with shard_lock(data.get('space_id'), DREAMS_FILE):
+        index = get_dream_index()
+    
+        # 检查是否已经存在相同内容的梦境
+        title = data.get('title', '').strip()
+        content = data.get('content', '').strip()
+        fingerprint = dream_fingerprint(title, content)
+    
+        # 通过内容指纹查找是否有相同内容的梦境
+        existing_id = index.find_existing_id(fingerprint)
+    
+        if existing_id:
+            # 如果存在相同内容的梦境，使用其ID
+            new_id = existing_id
+        else:
+            # 否则生成新的唯一ID
+            new_id = str(uuid.uuid4())
+    
+        # 添加用户ID（时间戳在写入前记录）
+        data['id'] = new_id
+        data['user_id'] = user_id
+    
+        # 如果指定了空间ID，需要验证用户是否是该空间的成员
+        if 'space_id' in data and data['space_id']:
+            # 这里应该检查用户是否是空间成员，但为简化处理，我们假设前端已经做了相应的限制
+            pass
+    
+        # 检查是否已存在完全相同的梦境记录（用户ID、空间ID、内容、标题都相同）
+        duplicate = index.find_duplicate_id(user_id, data.get('space_id'), fingerprint)
+        stamp_updated([data], created=True)
+    
+        # 仅在不是重复记录时添加
+        if not duplicate:
+            dreams_file = shard_file(DREAMS_FILE, data.get('space_id'))
+            dreams = read_data(dreams_file)
+            dreams.append(data)
+            searcher = built_search_index()
+            write_data(dreams_file, dreams)
+            index.add(data)
+            index.mark_synced(DREAMS_FILE)
+            if searcher:
+                searcher.add(DOC_DREAM, data)
+                searcher.mark_synced(DREAMS_FILE)
+    
+        return jsonify(data), 201
 
-@app.route('/api/spaces/<space_id>/dreams', methods=['POST'])
+@api_bp.route('/api/spaces/<space_id>/dreams', methods=['POST'])
 @member_required()
+@space_lock(DREAMS_FILE)
 def add_space_dream(space_id):
     user_id = g.user_id
     data = request.json
-    dreams = read_data(DREAMS_FILE)
+    index = get_dream_index()
     
     # 检查是否已经存在相同内容的梦境
     title = data.get('title', '').strip()
     content = data.get('content', '').strip()
+    fingerprint = dream_fingerprint(title, content)
     
-    # 查找是否有相同内容的梦境
-    existing_dream = next((d for d in dreams if d.get('title') == title and d.get('content') == content), None)
+    # 通过内容指纹查找是否有相同内容的梦境
+    existing_id = index.find_existing_id(fingerprint)
     
-    if existing_dream:
+    if existing_id:
         # 如果存在相同内容的梦境，使用其ID
-        new_id = existing_dream['id']
+        new_id = existing_id
     else:
         # 否则生成新的唯一ID
         new_id = str(uuid.uuid4())
     
-    # 添加时间戳、用户ID和空间ID
+    # 添加用户ID和空间ID（时间戳在写入前记录）
     data['id'] = new_id
-    data['created_at'] = datetime.datetime.now().isoformat()
     data['user_id'] = user_id
     data['space_id'] = space_id
     data['username'] = get_username(user_id)  # 添加用户名
     
     # 检查是否已存在完全相同的梦境记录（用户ID、空间ID、内容、标题都相同）
-    duplicate = next((d for d in dreams if d.get('user_id') == user_id and d.get('space_id') == space_id and 
-                      d.get('title') == title and d.get('content') == content), None)
+    duplicate = index.find_duplicate_id(user_id, space_id, fingerprint)
+    stamp_updated([data], created=True)
     
     # 仅在不是重复记录时添加
     if not duplicate:
+        dreams_file = shard_file(DREAMS_FILE, space_id)
+        dreams = read_data(dreams_file)
         dreams.append(data)
-        write_data(DREAMS_FILE, dreams)
+        searcher = built_search_index()
+        write_data(dreams_file, dreams)
+        index.add(data)
+        index.mark_synced(DREAMS_FILE)
+        if searcher:
+            searcher.add(DOC_DREAM, data)
+            searcher.mark_synced(DREAMS_FILE)
     
     return jsonify(data), 201
 
-@app.route('/api/dreams/<dream_id>', methods=['PUT'])
+@api_bp.route('/api/dreams/<dream_id>', methods=['PUT'])
 @login_required
+@item_lock(DREAMS_FILE, id_arg='dream_id')
 def update_dream(dream_id):
     user_id = g.user_id
     data = request.json
-    dreams = read_data(DREAMS_FILE)
+    dreams_file = shard_file(DREAMS_FILE, g.item_space_id)
+    dreams = read_data(dreams_file)
+    target = preferred_dream([dream for dream in dreams if dream.get('id') == dream_id], user_id)
     
     for i, dream in enumerate(dreams):
-        if dream.get('id') == dream_id:
+        if dream is target:
             # 检查权限：个人梦境只能本人修改，空间梦境只能空间成员修改
             if dream.get('space_id'):
                 # 这里应该检查用户是否是空间成员，但为简化处理，我们假设前端已经做了相应的限制
@@ -315,24 +541,34 @@ def update_dream(dream_id):
             # 更新梦境数据，保留原ID、创建时间、用户ID和空间ID
             data['id'] = dream_id
             data['created_at'] = dream.get('created_at')
-            data['updated_at'] = datetime.datetime.now().isoformat()
             data['user_id'] = dream.get('user_id')
             data['space_id'] = dream.get('space_id')
             
+            index = get_dream_index()
+            searcher = built_search_index()
             dreams[i] = data
-            write_data(DREAMS_FILE, dreams)
+            stamp_updated([data])
+            write_data(dreams_file, dreams)
+            index.replace(dream, data)
+            index.mark_synced(DREAMS_FILE)
+            if searcher:
+                searcher.replace(DOC_DREAM, dream, data)
+                searcher.mark_synced(DREAMS_FILE)
             return jsonify(data)
     
     return jsonify({'error': '未找到该梦境记录'}), 404
 
-@app.route('/api/dreams/<dream_id>', methods=['DELETE'])
+@api_bp.route('/api/dreams/<dream_id>', methods=['DELETE'])
 @login_required
+@item_lock(DREAMS_FILE, id_arg='dream_id')
 def delete_dream(dream_id):
     user_id = g.user_id
-    dreams = read_data(DREAMS_FILE)
+    dreams_file = shard_file(DREAMS_FILE, g.item_space_id)
+    dreams = read_data(dreams_file)
+    target = preferred_dream([dream for dream in dreams if dream.get('id') == dream_id], user_id)
     
     for i, dream in enumerate(dreams):
-        if dream.get('id') == dream_id:
+        if dream is target:
             # 检查权限：个人梦境只能本人删除，空间梦境只能空间管理员删除
             if dream.get('space_id'):
                 # 这里应该检查用户是否是空间管理员，但为简化处理，我们假设前端已经做了相应的限制
@@ -340,21 +576,90 @@ def delete_dream(dream_id):
             elif dream.get('user_id') != user_id:
                 return jsonify({'error': '无权删除该梦境记录'}), 403
             
+            index = get_dream_index()
+            searcher = built_search_index()
             deleted = dreams.pop(i)
-            write_data(DREAMS_FILE, dreams)
+            write_data(dreams_file, dreams)
+            index.remove(deleted)
+            index.mark_synced(DREAMS_FILE)
+            if searcher:
+                searcher.remove(DOC_DREAM, deleted)
+                searcher.mark_synced(DREAMS_FILE)
+            
+            # 解梦、续写、预测由后台级联清理
+            tombstone = create_tombstone(ENTITY_DREAM, dream_id, user_id, deleted.get('space_id'))
+            deleted['cleanup_job_id'] = tombstone['id']
             return jsonify(deleted)
     
     return jsonify({'error': '未找到该梦境记录'}), 404
 
+# 全文检索API
+@api_bp.route('/api/search', methods=['GET'])
+@login_required
+def search_dreams():
+    user_id = g.user_id
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '缺少检索关键词'}), 400
+    
+    # 可选过滤条件：空间、作者、内容类型
+    space_id = request.args.get('space_id')
+    author_id = request.args.get('user_id')
+    types = request.args.get('types')
+    doc_types = [t for t in types.split(',') if t in DOC_TYPES] if types else None
+    
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        page_size = min(100, max(1, int(request.args.get('page_size', 20))))
+    except ValueError:
+        return jsonify({'error': '无效的分页参数'}), 400
+    
+    # 个人梦境只能本人检索，空间梦境只能空间成员检索
+    member_space_ids = {space['id'] for space in read_spaces()
+                        if any(member['user_id'] == user_id for member in space.get('members', []))}
+    if space_id and space_id not in member_space_ids:
+        return jsonify({'error': '您不是该空间的成员'}), 403
+    
+    def is_visible(doc):
+        if doc['space_id']:
+            return doc['space_id'] in member_space_ids
+        return doc['user_id'] == user_id
+    
+    results = get_search_index().search(query, is_visible, doc_types=doc_types,
+                                        user_id=author_id, space_id=space_id)
+    
+    start = (page - 1) * page_size
+    items = []
+    for score, doc, owner in results[start:start + page_size]:
+        items.append({
+            'type': doc['type'],
+            'id': doc['id'],
+            'dream_id': doc['dream_id'],
+            'dream_title': owner['title'],
+            'space_id': owner['space_id'],
+            'user_id': owner['user_id'],
+            'score': round(score, 4),
+            'snippet': make_snippet(search_doc_content(doc) or doc['title'], query),
+            'created_at': doc['created_at']
+        })
+    
+    return jsonify({
+        'query': query,
+        'total': len(results),
+        'page': page,
+        'page_size': page_size,
+        'results': items
+    })
+
 # 任务API
-@app.route('/api/tasks', methods=['GET'])
+@api_bp.route('/api/tasks', methods=['GET'])
 @login_required
+@conditional(TASKS_FILE, TASK_RECORDS_FILE, vary=get_today_date)
 def get_tasks():
     user_id = g.user_id
     space_id = request.args.get('space_id')
     
-    tasks = read_data(TASKS_FILE)
-    today = get_today_date()
+    tasks = read_data(shard_file(TASKS_FILE, space_id))
     
     # 过滤任务：如果指定了空间ID，则只返回该空间的任务；否则返回用户的个人任务
     if space_id:
@@ -363,28 +668,33 @@ def get_tasks():
         filtered_tasks = [task for task in tasks if task.get('submitter_id') == user_id and not task.get('space_id')]
     
     # 为每个任务添加今日完成状态
+    completed_today = completed_today_task_ids(read_data(shard_file(TASK_RECORDS_FILE, space_id)), filtered_tasks)
     for task in filtered_tasks:
-        task['completed_today'] = is_task_completed_today(task['id'])
+        task['completed_today'] = task['id'] in completed_today
     
     return jsonify(filtered_tasks)
 
-@app.route('/api/spaces/<space_id>/tasks', methods=['GET'])
+@api_bp.route('/api/spaces/<space_id>/tasks', methods=['GET'])
 @member_required()
+@conditional(TASKS_FILE, TASK_RECORDS_FILE, vary=get_today_date)
 def get_space_tasks(space_id):
-    tasks = read_data(TASKS_FILE)
+    return jsonify(space_tasks_with_status(read_data(shard_file(TASKS_FILE, space_id)),
+                                           read_data(shard_file(TASK_RECORDS_FILE, space_id)), space_id))
+
+# 空间的任务，并为每个任务添加今日完成状态
+def space_tasks_with_status(tasks, records, space_id):
     space_tasks = [task for task in tasks if task.get('space_id') == space_id]
-    
-    # 为每个任务添加今日完成状态
+    completed_today = completed_today_task_ids(records, space_tasks)
     for task in space_tasks:
-        task['completed_today'] = is_task_completed_today(task['id'])
-    
-    return jsonify(space_tasks)
+        task['completed_today'] = task['id'] in completed_today
+    return space_tasks
 
-@app.route('/api/tasks/<task_id>', methods=['GET'])
+@api_bp.route('/api/tasks/<task_id>', methods=['GET'])
 @login_required
 def get_task(task_id):
     user_id = g.user_id
-    tasks = read_data(TASKS_FILE)
+    space_id = locate_space_id(TASKS_FILE, task_id)
+    tasks = read_data(shard_file(TASKS_FILE, space_id))
     
     for task in tasks:
         if task.get('id') == task_id:
@@ -395,25 +705,23 @@ def get_task(task_id):
             elif task.get('submitter_id') != user_id:
                 return jsonify({'error': '无权访问该任务'}), 403
             
-            task['completed_today'] = is_task_completed_today(task_id)
+            records = read_data(shard_file(TASK_RECORDS_FILE, space_id))
+            task['completed_today'] = task_id in completed_today_task_ids(records, [task])
             return jsonify(task)
     
     return jsonify({'error': '未找到该任务'}), 404
 
-@app.route('/api/tasks', methods=['POST'])
+@api_bp.route('/api/tasks', methods=['POST'])
 @login_required
 def add_task():
     user_id = g.user_id
     data = request.json
-    tasks = read_data(TASKS_FILE)
     
     # 生成唯一ID
     new_id = str(uuid.uuid4())
     
-    # 添加时间戳和默认完成状态
+    # 添加默认完成状态（时间戳在写入前记录）
     data['id'] = new_id
-    data['created_at'] = datetime.datetime.now().isoformat()
-    data['updated_at'] = datetime.datetime.now().isoformat()
     data['required_images'] = data.get('required_images', 1)  # 默认需要1张图片
     data['completed_today'] = False  # 默认未完成
     data['submitter_id'] = user_id
@@ -424,104 +732,121 @@ def add_task():
         # 这里应该检查用户是否是空间成员，但为简化处理，我们假设前端已经做了相应的限制
         pass
     
-    tasks.append(data)
-    write_data(TASKS_FILE, tasks)
+    # 个人任务写入主文件；指定了空间ID时只锁住并写入该空间的分片
+    with shard_lock(data.get('space_id'), TASKS_FILE):
+        tasks_file = shard_file(TASKS_FILE, data.get('space_id'))
+        tasks = read_data(tasks_file)
+        tasks.append(data)
+        stamp_updated([data], created=True)
+        write_data(tasks_file, tasks)
+    events.record_event(data.get('space_id'), events.TASK_CREATED, user_id,
+                        {'task_id': new_id, 'title': data.get('title')})
     
     return jsonify(data), 201
 
-@app.route('/api/spaces/<space_id>/tasks', methods=['POST'])
-@member_required()
-def add_space_task(space_id):
-    user_id = g.user_id
-    data = request.json
-    tasks = read_data(TASKS_FILE)
-    
-    # 生成唯一ID
-    new_id = str(uuid.uuid4())
-    
-    # 添加时间戳、用户ID和空间ID
-    data['id'] = new_id
-    data['created_at'] = datetime.datetime.now().isoformat()
-    data['updated_at'] = datetime.datetime.now().isoformat()
+# 批量接口每次最多处理的条目数
+MAX_BATCH_SIZE = 200
+
+# 根据请求数据构造空间任务（验证指定的打卡者和审阅者），返回 (任务, 错误信息, 状态码)
+def build_space_task(data, space, space_id, user_id):
+    if not isinstance(data, dict):
+        return None, '任务数据格式不正确', 400
+    data = dict(data)
+    
+    # 添加用户ID和空间ID（时间戳在写入前记录）
+    data['id'] = str(uuid.uuid4())
     data['required_images'] = data.get('required_images', 1)  # 默认需要1张图片
     data['completed_today'] = False  # 默认未完成
     data['submitter_id'] = user_id
     data['space_id'] = space_id
     data['status'] = 'pending'  # 设置初始状态为待处理
     
-    # 处理指定的打卡者和审阅者
-    if 'assigned_submitter_id' in data and data['assigned_submitter_id']:
-        # 验证指定的打卡者是否是空间成员
-        spaces = read_data(SPACES_FILE)
-        space = next((s for s in spaces if s.get('id') == space_id), None)
+    # 处理指定的打卡者
+    if data.get('assigned_submitter_id'):
         if not space:
-            return jsonify({'error': '未找到该空间'}), 404
+            return None, '未找到该空间', 404
             
         # 检查指定的打卡者是否是空间成员
-        submitter_found = False
-        submitter_name = None
-        for member in space.get('members', []):
-            if member.get('user_id') == data['assigned_submitter_id']:
-                submitter_found = True
-                submitter_name = member.get('username')
-                break
-                
-        if not submitter_found:
-            return jsonify({'error': '指定的打卡者不是空间成员'}), 400
+        member = next((m for m in space.get('members', []) if m.get('user_id') == data['assigned_submitter_id']), None)
+        if not member:
+            return None, '指定的打卡者不是空间成员', 400
             
         # 添加打卡者名称
-        data['assigned_submitter_name'] = submitter_name
+        data['assigned_submitter_name'] = member.get('username')
     
     # 处理指定的审阅者列表
-    if 'assigned_approver_ids' in data and data['assigned_approver_ids']:
-        # 验证指定的审阅者是否都是空间成员
-        spaces = read_data(SPACES_FILE)
-        space = next((s for s in spaces if s.get('id') == space_id), None)
+    if data.get('assigned_approver_ids'):
         if not space:
-            return jsonify({'error': '未找到该空间'}), 404
+            return None, '未找到该空间', 404
             
         # 检查指定的审阅者是否都是空间成员
         approver_names = []
         for approver_id in data['assigned_approver_ids']:
-            approver_found = False
-            for member in space.get('members', []):
-                if member.get('user_id') == approver_id:
-                    approver_found = True
-                    approver_names.append(member.get('username'))
-                    break
-                    
-            if not approver_found:
-                return jsonify({'error': f'指定的审阅者 {approver_id} 不是空间成员'}), 400
+            member = next((m for m in space.get('members', []) if m.get('user_id') == approver_id), None)
+            if not member:
+                return None, f'指定的审阅者 {approver_id} 不是空间成员', 400
+            approver_names.append(member.get('username'))
                 
         # 添加审阅者名称列表
         data['assigned_approver_names'] = approver_names
     
-    # 将新任务添加到列表
-    tasks.append(data)
-    
-    # 确保数据写入成功
-    try:
-        write_data(TASKS_FILE, tasks)
-        print(f"成功创建空间任务: {data['title']}, ID: {new_id}, 空间ID: {space_id}")
-    except Exception as e:
-        print(f"保存任务数据失败: {str(e)}")
-        return jsonify({"error": "保存任务失败"}), 500
-    
-    # 再次读取数据以确认保存成功
-    updated_tasks = read_data(TASKS_FILE)
-    saved_task = next((task for task in updated_tasks if task.get('id') == new_id), None)
-    
-    if not saved_task:
-        print(f"警告: 任务已保存但无法立即读取: {new_id}")
+    return data, None, None
+
+# 创建空间任务；请求体为数组时批量创建，只读写一次任务文件并返回每一项的结果
+@api_bp.route('/api/spaces/<space_id>/tasks', methods=['POST'])
+@member_required()
+@space_lock(TASKS_FILE)
+def add_space_task(space_id):
+    user_id = g.user_id
+    data = request.json
+    batch = isinstance(data, list)
+    items = data if batch else [data]
+    if batch and not 0 < len(items) <= MAX_BATCH_SIZE:
+        return jsonify({'error': f'每次最多批量创建{MAX_BATCH_SIZE}个任务'}), 400
+    
+    space = next((s for s in read_data(SPACES_FILE) if s.get('id') == space_id), None)
+    results = []
+    created = []
+    for item in items:
+        task, error, code = build_space_task(item, space, space_id, user_id)
+        if error:
+            if not batch:
+                return jsonify({'error': error}), code
+            results.append({'success': False, 'error': error, 'status': code})
+            continue
+        created.append(task)
+        results.append({'success': True, 'task': task})
     
-    return jsonify(data), 201
+    # 将新任务添加到列表
+    if created:
+        tasks_file = shard_file(TASKS_FILE, space_id)
+        tasks = read_data(tasks_file)
+        tasks.extend(created)
+        stamp_updated(created, created=True)
+        
+        # 确保数据写入成功
+        try:
+            write_data(tasks_file, tasks)
+            for task in created:
+                logger.info(f"成功创建空间任务: {task.get('title')}, ID: {task['id']}, 空间ID: {space_id}")
+        except Exception as e:
+            logger.error(f"保存任务数据失败: {str(e)}")
+            return jsonify({"error": "保存任务失败"}), 500
+        events.record_events(space_id, [(events.TASK_CREATED, user_id, {'task_id': task['id'], 'title': task.get('title')})
+                                        for task in created])
+    
+    if batch:
+        return jsonify({'results': results, 'created': len(created)}), 201 if created else 400
+    return jsonify(created[0]), 201
 
-@app.route('/api/tasks/<task_id>', methods=['PUT'])
+@api_bp.route('/api/tasks/<task_id>', methods=['PUT'])
 @login_required
+@item_lock(TASKS_FILE, id_arg='task_id')
 def update_task(task_id):
     user_id = g.user_id
     data = request.json
-    tasks = read_data(TASKS_FILE)
+    tasks_file = shard_file(TASKS_FILE, g.item_space_id)
+    tasks = read_data(tasks_file)
     
     for i, task in enumerate(tasks):
         if task.get('id') == task_id:
@@ -535,7 +860,6 @@ def update_task(task_id):
             # 更新任务数据，保留原ID、创建时间、用户ID和空间ID
             data['id'] = task_id
             data['created_at'] = task.get('created_at')
-            data['updated_at'] = datetime.datetime.now().isoformat()
             data['submitter_id'] = task.get('submitter_id')
             data['space_id'] = task.get('space_id')
             
@@ -544,27 +868,16 @@ def update_task(task_id):
                 data['completed_today'] = task.get('completed_today', False)
             
             tasks[i] = data
-            write_data(TASKS_FILE, tasks)
+            stamp_updated([data])
+            write_data(tasks_file, tasks)
+            events.record_event(data['space_id'], events.TASK_UPDATED, user_id,
+                                {'task_id': task_id, 'title': data.get('title')})
             return jsonify(data)
     
     return jsonify({'error': '未找到该任务'}), 404
 
-@app.route('/api/tasks/<task_id>/complete', methods=['POST'])
-@login_required
-def complete_task(task_id):
-    user_id = g.user_id
-    
-    # 检查任务是否存在
-    tasks = read_data(TASKS_FILE)
-    task = None
-    for t in tasks:
-        if t.get('id') == task_id:
-            task = t
-            break
-    
-    if not task:
-        return jsonify({'error': '未找到该任务'}), 404
-    
+# 为任务创建一条打卡记录（保存图片，但不写数据文件），返回 (记录, 错误信息, 状态码)
+def build_task_record(task, user_id, username, images, completed_today):
     # 检查权限：
     # 1. 个人任务只能本人完成
     # 2. 空间任务如果指定了打卡者，只能由指定的打卡者完成
@@ -572,53 +885,39 @@ def complete_task(task_id):
     if task.get('space_id'):
         # 空间任务
         if task.get('assigned_submitter_id') and task.get('assigned_submitter_id') != user_id:
-            return jsonify({'error': '只有指定的打卡者才能完成该任务'}), 403
+            return None, '只有指定的打卡者才能完成该任务', 403
         # 这里应该检查用户是否是空间成员，但为简化处理，我们假设前端已经做了相应的限制
     elif task.get('submitter_id') != user_id:
-        return jsonify({'error': '无权完成该任务'}), 403
+        return None, '无权完成该任务', 403
     
     # 检查是否已经完成
-    if is_task_completed_today(task_id):
-        return jsonify({'error': '今天已经完成过该任务'}), 400
+    if task['id'] in completed_today:
+        return None, '今天已经完成过该任务', 400
     
-    # 获取上传的图片
-    if 'images' not in request.json:
-        return jsonify({'error': '缺少图片数据'}), 400
+    # 检查上传的图片
+    if images is None:
+        return None, '缺少图片数据', 400
     
-    images = request.json['images']
     required_images = task.get('required_images', 1)
     
     if len(images) < required_images:
-        return jsonify({'error': f'需要上传至少{required_images}张图片'}), 400
-    
-    # 保存图片
-    image_paths = []
-    for image_data in images:
-        if ',' in image_data:
-            # 处理base64编码的图片
-            image_data = image_data.split(',')[1]
-        
-        # 生成唯一文件名
-        filename = f"{uuid.uuid4()}.jpg"
-        filepath = os.path.join(IMAGES_DIR, filename)
-        
-        # 解码并保存图片
-        with open(filepath, "wb") as f:
-            f.write(base64.b64decode(image_data))
-        
-        image_paths.append(filename)
+        return None, f'需要上传至少{required_images}张图片', 400
+    
+    # 保存图片（解码和写入在有界I/O线程池中并行执行）
+    image_paths = save_base64_images(images)
     
     # 创建完成记录
-    records = read_data(TASK_RECORDS_FILE)
+    now = datetime.datetime.now().isoformat()
     record = {
         'id': str(uuid.uuid4()),
-        'task_id': task_id,
-        'date': get_today_date(),
+        'task_id': task['id'],
+        'date': clock.task_today(task),  # 任务所在时区的本地日期
         'images': image_paths,
-        'created_at': datetime.datetime.now().isoformat(),
+        'created_at': now,
+        'updated_at': now,
         'submitter_id': user_id,
         'status': 'submitted',  # 设置状态为已提交，等待审阅
-        'submitter_name': get_username(user_id)
+        'submitter_name': username
     }
     
     # 如果是空间任务，添加空间ID和指定的审阅者
@@ -630,17 +929,54 @@ def complete_task(task_id):
             record['assigned_approver_ids'] = task.get('assigned_approver_ids')
             record['assigned_approver_names'] = task.get('assigned_approver_names')
     
-    records.append(record)
-    write_data(TASK_RECORDS_FILE, records)
+    return record, None, None
+
+# 保存同一空间（个人任务为 None）的新打卡记录，更新对应任务的状态并记录空间事件
+# records、tasks 为该空间的记录和任务分片（调用方需持有这两个分片的锁）
+def save_task_records(new_records, records, tasks, user_id, space_id=None):
+    records.extend(new_records)
+    stamp_updated(new_records)
+    write_data(shard_file(TASK_RECORDS_FILE, space_id), records)
     
     # 更新任务状态为已提交
-    for i, t in enumerate(tasks):
-        if t.get('id') == task_id:
-            tasks[i]['status'] = 'submitted'
-            tasks[i]['updated_at'] = datetime.datetime.now().isoformat()
-            break
+    submitted_task_ids = {record['task_id'] for record in new_records}
+    submitted_tasks = [task for task in tasks if task.get('id') in submitted_task_ids]
+    for task in submitted_tasks:
+        task['status'] = 'submitted'
+    
+    stamp_updated(submitted_tasks)
+    write_data(shard_file(TASKS_FILE, space_id), tasks)
+    
+    by_space = {}
+    for record in new_records:
+        by_space.setdefault(record.get('space_id'), []).append(
+            (events.CHECKIN_SUBMITTED, user_id,
+             {'record_id': record['id'], 'task_id': record['task_id'], 'date': record['date'],
+              'submitter_id': user_id, 'assigned_approver_ids': record.get('assigned_approver_ids', [])}))
+    for space_id, items in by_space.items():
+        events.record_events(space_id, items)
+
+@api_bp.route('/api/tasks/<task_id>/complete', methods=['POST'])
+@login_required
+@item_lock(TASKS_FILE, TASK_RECORDS_FILE, id_arg='task_id')
+def complete_task(task_id):
+    user_id = g.user_id
+    
+    # 检查任务是否存在
+    tasks = read_data(shard_file(TASKS_FILE, g.item_space_id))
+    task = next((t for t in tasks if t.get('id') == task_id), None)
+    
+    if not task:
+        return jsonify({'error': '未找到该任务'}), 404
     
-    write_data(TASKS_FILE, tasks)
+    records = read_data(shard_file(TASK_RECORDS_FILE, g.item_space_id))
+    images = (request.json or {}).get('images')
+    record, error, code = build_task_record(task, user_id, get_username(user_id), images,
+                                            completed_today_task_ids(records, [task]))
+    if error:
+        return jsonify({'error': error}), code
+    
+    save_task_records([record], records, tasks, user_id, g.item_space_id)
     
     return jsonify({
         'success': True,
@@ -648,13 +984,60 @@ def complete_task(task_id):
         'record_id': record['id']
     })
 
-@app.route('/api/tasks/<task_id>/records', methods=['GET'])
+# 批量打卡：items 为 [{task_id, images}]，只锁住并读写涉及的空间的记录和任务分片（个人任务为主文件），
+# 每个分片只读写一次，返回每一项的结果
+@api_bp.route('/api/tasks/complete/batch', methods=['POST'])
 @login_required
+def complete_tasks_batch():
+    user_id = g.user_id
+    items = (request.json or {}).get('items')
+    if not isinstance(items, list) or not 0 < len(items) <= MAX_BATCH_SIZE:
+        return jsonify({'error': f'items 必须是包含1到{MAX_BATCH_SIZE}项的数组'}), 400
+    
+    task_ids = {item.get('task_id') for item in items if isinstance(item, dict)}
+    space_ids = {task.get('space_id') for task in read_collection(TASKS_FILE) if task.get('id') in task_ids}
+    with shards_lock(space_ids, TASK_RECORDS_FILE, TASKS_FILE):
+        # 空间ID -> (任务分片, 记录分片)
+        shards = {space_id: (read_data(shard_file(TASKS_FILE, space_id)),
+                             read_data(shard_file(TASK_RECORDS_FILE, space_id)))
+                  for space_id in space_ids}
+        tasks_by_id = {task.get('id'): task for tasks, _ in shards.values() for task in tasks}
+        completed_today = completed_today_task_ids(
+            [record for _, records in shards.values() for record in records],
+            [tasks_by_id[task_id] for task_id in task_ids if task_id in tasks_by_id])
+        username = get_username(user_id)
+        
+        results = []
+        new_records = {}
+        for item in items:
+            task_id = item.get('task_id') if isinstance(item, dict) else None
+            task = tasks_by_id.get(task_id)
+            if not task:
+                results.append({'task_id': task_id, 'success': False, 'error': '未找到该任务', 'status': 404})
+                continue
+            record, error, code = build_task_record(task, user_id, username, item.get('images'), completed_today)
+            if error:
+                results.append({'task_id': task_id, 'success': False, 'error': error, 'status': code})
+                continue
+            completed_today.add(task_id)
+            new_records.setdefault(task.get('space_id'), []).append(record)
+            results.append({'task_id': task_id, 'success': True, 'record_id': record['id']})
+        
+        for space_id, space_records in new_records.items():
+            tasks, records = shards[space_id]
+            save_task_records(space_records, records, tasks, user_id, space_id)
+    
+    succeeded = sum(len(space_records) for space_records in new_records.values())
+    return jsonify({'results': results, 'succeeded': succeeded, 'failed': len(items) - succeeded})
+
+@api_bp.route('/api/tasks/<task_id>/records', methods=['GET'])
+@login_required
+@conditional(TASKS_FILE, TASK_RECORDS_FILE, RECORDS_ARCHIVE_DIR)
 def get_task_records(task_id):
     user_id = g.user_id
     
     # 检查任务是否存在
-    tasks = read_data(TASKS_FILE)
+    tasks = read_data(shard_file(TASKS_FILE, locate_space_id(TASKS_FILE, task_id)))
     task = next((t for t in tasks if t.get('id') == task_id), None)
     
     if not task:
@@ -667,24 +1050,25 @@ def get_task_records(task_id):
     elif task.get('submitter_id') != user_id:
         return jsonify({'error': '无权查看该任务记录'}), 403
     
-    records = read_data(TASK_RECORDS_FILE)
-    task_records = [record for record in records if record.get('task_id') == task_id]
+    # 历史记录包含已封存的月份，可用 month=YYYY-MM 只查询某个月
+    task_records = archive.load_records(space_id=task.get('space_id'), task_id=task_id, month=request.args.get('month'))
     return jsonify(task_records)
 
-@app.route('/api/spaces/<space_id>/tasks/records', methods=['GET'])
+@api_bp.route('/api/spaces/<space_id>/tasks/records', methods=['GET'])
 @member_required()
+@conditional(TASK_RECORDS_FILE, RECORDS_ARCHIVE_DIR)
 def get_space_task_records(space_id):
-    records = read_data(TASK_RECORDS_FILE)
-    space_records = [record for record in records if record.get('space_id') == space_id]
+    space_records = archive.load_records(space_id=space_id, month=request.args.get('month'))
     return jsonify(space_records)
 
-@app.route('/api/tasks/records/today', methods=['GET'])
+@api_bp.route('/api/tasks/records/today', methods=['GET'])
 @login_required
+@conditional(TASK_RECORDS_FILE, vary=get_today_date)
 def get_today_records():
     user_id = g.user_id
     space_id = request.args.get('space_id')
     
-    records = read_data(TASK_RECORDS_FILE)
+    records = read_data(shard_file(TASK_RECORDS_FILE, space_id))
     today = get_today_date()
     
     # 过滤记录：如果指定了空间ID，则只返回该空间的今日记录；否则返回用户的个人今日记录
@@ -695,29 +1079,26 @@ def get_today_records():
     
     return jsonify(today_records)
 
-@app.route('/api/spaces/<space_id>/tasks/records/today', methods=['GET'])
+@api_bp.route('/api/spaces/<space_id>/tasks/records/today', methods=['GET'])
 @member_required()
+@conditional(TASK_RECORDS_FILE, vary=get_today_date)
 def get_space_today_records(space_id):
-    records = read_data(TASK_RECORDS_FILE)
-    today = get_today_date()
-    space_today_records = [record for record in records if record.get('date') == today and record.get('space_id') == space_id]
-    return jsonify(space_today_records)
+    return jsonify(space_today_records(read_data(shard_file(TASK_RECORDS_FILE, space_id)), space_id, get_today_date()))
+
+def space_today_records(records, space_id, today):
+    return [record for record in records if record.get('date') == today and record.get('space_id') == space_id]
 
-@app.route('/api/images/<filename>', methods=['GET'])
+@api_bp.route('/api/images/<filename>', methods=['GET'])
 def get_image(filename):
-    # 添加调试输出
-    print(f"请求图片: {filename}")
-    
     # 检查文件是否存在
     file_path = os.path.join(IMAGES_DIR, filename)
     if not os.path.exists(file_path):
-        print(f"图片文件不存在: {file_path}")
+        logger.debug(f"图片文件不存在: {file_path}")
         return jsonify({"error": "图片文件不存在"}), 404
     
-    print(f"图片文件存在，准备返回: {file_path}")
     return send_from_directory(IMAGES_DIR, filename)
 
-@app.route('/api/images', methods=['GET'])
+@api_bp.route('/api/images', methods=['GET'])
 def list_images():
     """列出图片目录中的所有文件"""
     try:
@@ -746,11 +1127,13 @@ def list_images():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/tasks/<task_id>', methods=['DELETE'])
+@api_bp.route('/api/tasks/<task_id>', methods=['DELETE'])
 @login_required
+@item_lock(TASKS_FILE, id_arg='task_id')
 def delete_task(task_id):
     user_id = g.user_id
-    tasks = read_data(TASKS_FILE)
+    tasks_file = shard_file(TASKS_FILE, g.item_space_id)
+    tasks = read_data(tasks_file)
     
     for i, task in enumerate(tasks):
         if task.get('id') == task_id:
@@ -762,20 +1145,148 @@ def delete_task(task_id):
                 return jsonify({'error': '无权删除该任务'}), 403
             
             deleted = tasks.pop(i)
-            write_data(TASKS_FILE, tasks)
+            write_data(tasks_file, tasks)
             
-            # 删除相关的完成记录
-            records = read_data(TASK_RECORDS_FILE)
-            records = [record for record in records if record.get('task_id') != task_id]
-            write_data(TASK_RECORDS_FILE, records)
+            # 相关的完成记录、历史记录和图片由后台级联清理
+            tombstone = create_tombstone(ENTITY_TASK, task_id, user_id, deleted.get('space_id'))
+            deleted['cleanup_job_id'] = tombstone['id']
+            events.record_event(deleted.get('space_id'), events.TASK_DELETED, user_id,
+                                {'task_id': task_id, 'title': deleted.get('title')})
             
             return jsonify(deleted)
     
     return jsonify({'error': '未找到该任务'}), 404
 
 # 任务审批API（仅适用于空间任务）
-@app.route('/api/spaces/<space_id>/tasks/records/<record_id>/approve', methods=['POST'])
+
+# 审批或拒绝一条打卡记录（在已读取的数据上修改，不写文件），返回 (记录, 任务, 错误信息, 状态码)
+def review_task_record(records_by_id, tasks_by_id, space_id, record_id, user_id, username, status, text):
+    record = records_by_id.get(record_id)
+    if not record or record.get('space_id') != space_id:
+        return None, None, '未找到该任务记录', 404
+        
+    # 检查是否是指定的审阅者
+    if record.get('assigned_approver_ids') and user_id not in record['assigned_approver_ids']:
+        action = '审批' if status == 'approved' else '拒绝'
+        return None, None, f'只有指定的审阅者才能{action}该任务', 403
+    
+    # 更新记录状态
+    now = datetime.datetime.now().isoformat()
+    record['status'] = status
+    record['approver_id'] = user_id
+    record['approver_name'] = username
+    if status == 'approved':
+        record['approved_at'] = now
+        record['approval_comment'] = text
+    else:
+        record['rejection_reason'] = text
+    
+    # 更新任务状态
+    task = tasks_by_id.get(record.get('task_id'))
+    if task is not None:
+        task['status'] = status
+        if status == 'approved':
+            task['approver_id'] = user_id  # 记录审批者ID
+    
+    return record, task, None, None
+
+# 创建打卡历史记录
+def build_check_in_history(space_id, task, user_id, username, comment):
+    return {
+        'id': str(uuid.uuid4()),
+        'task_id': task.get('id'),
+        'date': clock.today(space_id=space_id),
+        'created_at': datetime.datetime.now().isoformat(),
+        'user_id': user_id,
+        'user_name': username,
+        'action': 'approve',
+        'description': f'审核通过了任务 {task.get("title")}，审批词：{comment}',
+        'space_id': space_id
+    }
+
+def review_event(record, status, text):
+    data = {'record_id': record['id'], 'task_id': record.get('task_id'), 'date': record.get('date'),
+            'submitter_id': record.get('submitter_id')}
+    if status == 'approved':
+        data['comment'] = text
+        return events.CHECKIN_APPROVED, data
+    data['reason'] = text
+    return events.CHECKIN_REJECTED, data
+
+def review_task_records(space_id, items, user_id, status):
+    """
+    批量审批或拒绝打卡记录，items 为 [(记录ID, 审批词或拒绝原因)]。
+    该空间的记录、任务分片和历史记录文件各只读写一次（调用方需持有对应的锁），返回每一项的结果
+    """
+    records_file = shard_file(TASK_RECORDS_FILE, space_id)
+    tasks_file = shard_file(TASKS_FILE, space_id)
+    records = read_data(records_file)
+    tasks = read_data(tasks_file)
+    records_by_id = {record.get('id'): record for record in records}
+    tasks_by_id = {task.get('id'): task for task in tasks}
+    username = get_username(user_id)
+    
+    results = []
+    histories = []
+    reviewed_records = []
+    reviewed_tasks = []
+    space_events = []
+    for record_id, text in items:
+        record, task, error, code = review_task_record(records_by_id, tasks_by_id, space_id, record_id,
+                                                       user_id, username, status, text)
+        if error:
+            results.append({'record_id': record_id, 'success': False, 'error': error, 'status': code})
+            continue
+        result = {'record_id': record_id, 'success': True}
+        reviewed_records.append(record)
+        if task is not None:
+            reviewed_tasks.append(task)
+            if status == 'approved':
+                result['history_record'] = build_check_in_history(space_id, task, user_id, username, text)
+                histories.append(result['history_record'])
+        event_type, event_data = review_event(record, status, text)
+        space_events.append((event_type, user_id, event_data))
+        results.append(result)
+    
+    if reviewed_records:
+        stamp_updated(reviewed_records)
+        write_data(records_file, records)
+    if reviewed_tasks:
+        stamp_updated(reviewed_tasks)
+        write_data(tasks_file, tasks)
+    if histories:
+        history_records = read_data(HISTORY_RECORDS_FILE)
+        history_records.extend(histories)
+        write_data(HISTORY_RECORDS_FILE, history_records)
+    events.record_events(space_id, space_events)
+    return results
+
+# 批量审批请求体：{record_ids: [...], comment} 或 {items: [{record_id, comment}]}（未指定时使用外层的值）
+# 同一记录ID出现多次时只保留第一次，每条记录只审批一次（只产生一条历史记录和一个事件）
+def parse_review_items(data, text_key):
+    default_text = data.get(text_key)
+    if 'items' in data:
+        items = data['items']
+        if not isinstance(items, list):
+            return None
+        parsed = [(item.get('record_id'), item.get(text_key, default_text)) for item in items if isinstance(item, dict)]
+        if len(parsed) != len(items):
+            return None
+    else:
+        record_ids = data.get('record_ids')
+        if not isinstance(record_ids, list):
+            return None
+        parsed = [(record_id, default_text) for record_id in record_ids]
+    if any(not isinstance(record_id, str) or text is None for record_id, text in parsed):
+        return None
+    unique = {}
+    for record_id, text in parsed:
+        unique.setdefault(record_id, text)
+    return list(unique.items())
+
+@api_bp.route('/api/spaces/<space_id>/tasks/records/<record_id>/approve', methods=['POST'])
 @member_required()
+@space_lock(TASK_RECORDS_FILE, TASKS_FILE, HISTORY_RECORDS_FILE)
 def approve_task_record(space_id, record_id):
     user_id = g.user_id
     data = request.json
@@ -784,66 +1295,19 @@ def approve_task_record(space_id, record_id):
     if not data or 'comment' not in data:
         return jsonify({'error': '缺少审批词'}), 400
     
-    # 获取记录
-    records = read_data(TASK_RECORDS_FILE)
-    record_index = next((i for i, record in enumerate(records) if record.get('id') == record_id and record.get('space_id') == space_id), None)
-    
-    if record_index is None:
-        return jsonify({'error': '未找到该任务记录'}), 404
-        
-    # 检查是否是指定的审阅者
-    if 'assigned_approver_ids' in records[record_index] and records[record_index]['assigned_approver_ids']:
-        if user_id not in records[record_index]['assigned_approver_ids']:
-            return jsonify({'error': '只有指定的审阅者才能审批该任务'}), 403
-    
-    # 获取任务信息
-    task_id = records[record_index].get('task_id')
-    tasks = read_data(TASKS_FILE)
-    task_index = next((i for i, task in enumerate(tasks) if task.get('id') == task_id), None)
-    
-    # 更新记录状态
-    records[record_index]['status'] = 'approved'
-    records[record_index]['approver_id'] = user_id
-    records[record_index]['approver_name'] = get_username(user_id)
-    records[record_index]['approved_at'] = datetime.datetime.now().isoformat()
-    records[record_index]['approval_comment'] = data['comment']
-    
-    write_data(TASK_RECORDS_FILE, records)
-    
-    # 更新任务状态
-    if task_index is not None:
-        tasks[task_index]['status'] = 'approved'
-        tasks[task_index]['updated_at'] = datetime.datetime.now().isoformat()
-        tasks[task_index]['approver_id'] = user_id  # 记录审批者ID
-        
-        write_data(TASKS_FILE, tasks)
-        
-        # 创建打卡历史记录
-        check_in_history = {
-            'id': str(uuid.uuid4()),
-            'task_id': task_id,
-            'date': get_today_date(),
-            'created_at': datetime.datetime.now().isoformat(),
-            'user_id': user_id,
-            'user_name': get_username(user_id),
-            'action': 'approve',
-            'description': f'审核通过了任务 {tasks[task_index].get("title")}，审批词：{data["comment"]}',
-            'space_id': space_id
-        }
-        
-        # 获取历史记录列表
-        history_records = read_data(HISTORY_RECORDS_FILE)
-        history_records.append(check_in_history)
-        write_data(HISTORY_RECORDS_FILE, history_records)
+    result = review_task_records(space_id, [(record_id, data['comment'])], user_id, 'approved')[0]
+    if not result['success']:
+        return jsonify({'error': result['error']}), result['status']
     
     return jsonify({
         'success': True,
         'message': '任务记录已审批通过',
-        'history_record': check_in_history
+        'history_record': result.get('history_record')
     })
 
-@app.route('/api/spaces/<space_id>/tasks/records/<record_id>/reject', methods=['POST'])
+@api_bp.route('/api/spaces/<space_id>/tasks/records/<record_id>/reject', methods=['POST'])
 @member_required()
+@space_lock(TASK_RECORDS_FILE, TASKS_FILE)
 def reject_task_record(space_id, record_id):
     user_id = g.user_id
     data = request.json
@@ -852,105 +1316,61 @@ def reject_task_record(space_id, record_id):
     if not data or 'reason' not in data:
         return jsonify({'error': '缺少拒绝原因'}), 400
     
-    # 获取记录
-    records = read_data(TASK_RECORDS_FILE)
-    record_index = next((i for i, record in enumerate(records) if record.get('id') == record_id and record.get('space_id') == space_id), None)
-    
-    if record_index is None:
-        return jsonify({'error': '未找到该任务记录'}), 404
-        
-    # 检查是否是指定的审阅者
-    if 'assigned_approver_ids' in records[record_index] and records[record_index]['assigned_approver_ids']:
-        if user_id not in records[record_index]['assigned_approver_ids']:
-            return jsonify({'error': '只有指定的审阅者才能拒绝该任务'}), 403
-    
-    # 获取任务信息
-    task_id = records[record_index].get('task_id')
-    tasks = read_data(TASKS_FILE)
-    task_index = next((i for i, task in enumerate(tasks) if task.get('id') == task_id), None)
-    
-    # 更新记录状态
-    records[record_index]['status'] = 'rejected'
-    records[record_index]['approver_id'] = user_id
-    records[record_index]['approver_name'] = get_username(user_id)
-    records[record_index]['rejection_reason'] = data['reason']
-    
-    write_data(TASK_RECORDS_FILE, records)
-    
-    # 更新任务状态
-    if task_index is not None:
-        tasks[task_index]['status'] = 'rejected'
-        tasks[task_index]['updated_at'] = datetime.datetime.now().isoformat()
-        write_data(TASKS_FILE, tasks)
+    result = review_task_records(space_id, [(record_id, data['reason'])], user_id, 'rejected')[0]
+    if not result['success']:
+        return jsonify({'error': result['error']}), result['status']
     
     return jsonify({
         'success': True,
         'message': '任务记录已拒绝'
     })
 
+# 批量审批通过
+@api_bp.route('/api/spaces/<space_id>/tasks/records/batch/approve', methods=['POST'])
+@member_required()
+@space_lock(TASK_RECORDS_FILE, TASKS_FILE, HISTORY_RECORDS_FILE)
+def approve_task_records_batch(space_id):
+    items = parse_review_items(request.json or {}, 'comment')
+    if items is None:
+        return jsonify({'error': '缺少记录ID或审批词'}), 400
+    if not 0 < len(items) <= MAX_BATCH_SIZE:
+        return jsonify({'error': f'每次最多批量审批{MAX_BATCH_SIZE}条记录'}), 400
+    
+    results = review_task_records(space_id, items, g.user_id, 'approved')
+    succeeded = sum(1 for result in results if result['success'])
+    return jsonify({'results': results, 'succeeded': succeeded, 'failed': len(results) - succeeded})
+
+# 批量拒绝
+@api_bp.route('/api/spaces/<space_id>/tasks/records/batch/reject', methods=['POST'])
+@member_required()
+@space_lock(TASK_RECORDS_FILE, TASKS_FILE)
+def reject_task_records_batch(space_id):
+    items = parse_review_items(request.json or {}, 'reason')
+    if items is None:
+        return jsonify({'error': '缺少记录ID或拒绝原因'}), 400
+    if not 0 < len(items) <= MAX_BATCH_SIZE:
+        return jsonify({'error': f'每次最多批量拒绝{MAX_BATCH_SIZE}条记录'}), 400
+    
+    results = review_task_records(space_id, items, g.user_id, 'rejected')
+    succeeded = sum(1 for result in results if result['success'])
+    return jsonify({'results': results, 'succeeded': succeeded, 'failed': len(results) - succeeded})
+
 # 用户设置API
-@app.route('/api/user/settings', methods=['GET'])
+@api_bp.route('/api/user/settings', methods=['GET'])
 @login_required
 def get_user_settings():
-    user_id = g.user_id
-    
-    # 读取用户设置
-    try:
-        with open(USER_SETTINGS_FILE, 'r', encoding='utf-8') as f:
-            all_settings = json.load(f)
-            # 确保all_settings是一个字典
-            if not isinstance(all_settings, dict):
-                all_settings = {}
-    except (json.JSONDecodeError, FileNotFoundError):
-        all_settings = {}
-    
-    # 获取当前用户的设置
-    user_settings = all_settings.get(user_id, {})
-    
-    # 确保返回的JSON格式与前端期望的格式一致
-    response = {
-        "defaultShareSpaceId": user_settings.get("defaultShareSpaceId")
-    }
-    
-    return jsonify(response)
+    return jsonify(settings.get_settings(g.user_id))
 
-@app.route('/api/user/settings', methods=['PUT'])
+@api_bp.route('/api/user/settings', methods=['PUT'])
 @login_required
 def update_user_settings():
-    user_id = g.user_id
-    data = request.json
-    
-    # 读取所有用户设置
-    try:
-        with open(USER_SETTINGS_FILE, 'r', encoding='utf-8') as f:
-            all_settings = json.load(f)
-            # 确保all_settings是一个字典
-            if not isinstance(all_settings, dict):
-                all_settings = {}
-    except (json.JSONDecodeError, FileNotFoundError):
-        all_settings = {}
-    
-    # 更新当前用户的设置
-    if user_id not in all_settings:
-        all_settings[user_id] = {}
-    
-    # 更新设置
-    if "defaultShareSpaceId" in data:
-        all_settings[user_id]["defaultShareSpaceId"] = data["defaultShareSpaceId"]
-    
-    # 保存设置
-    with open(USER_SETTINGS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(all_settings, f, ensure_ascii=False, indent=2)
-    
-    # 确保返回的JSON格式与前端期望的格式一致
-    response = {
-        "defaultShareSpaceId": all_settings[user_id].get("defaultShareSpaceId")
-    }
-    
-    return jsonify(response)
+    updates, error = settings.validate_settings(request.json)
+    if error:
+        return jsonify({'error': error}), 400
+    return jsonify(settings.put_settings(g.user_id, updates))
 
 # 获取任务历史记录API
-@app.route('/api/spaces/<space_id>/tasks/<task_id>/history', methods=['GET'])
+@api_bp.route('/api/spaces/<space_id>/tasks/<task_id>/history', methods=['GET'])
 @member_required()
 def get_task_history(space_id, task_id):
     user_id = g.user_id
@@ -967,22 +1387,21 @@ def get_task_history(space_id, task_id):
     return jsonify(task_history)
 
 # 梦境解析API
-@app.route('/api/dream_interpretations', methods=['GET'])
+@api_bp.route('/api/dream_interpretations', methods=['GET'])
 @login_required
 def get_dream_interpretations():
     dream_id = request.args.get('dream_id')
     if not dream_id:
         return jsonify({"error": "未提供梦境ID"}), 400
         
-    interpretations = read_data(DREAM_INTERPRETATIONS_FILE)
-    
-    # 根据梦境ID筛选
-    result = [interp for interp in interpretations if interp.get('dream_id') == dream_id]
+    # 包括内容相同的梦境的解梦（own_only=1 时只返回本梦境的，bypass_cache=1 时不使用缓存）
+    result = get_derived_items(DOC_INTERPRETATION, dream_id, style=request.args.get('style'), **derived_options())
     
     return jsonify(result)
 
-@app.route('/api/dream_interpretations', methods=['POST'])
+@api_bp.route('/api/dream_interpretations', methods=['POST'])
 @login_required
+@file_lock(DREAM_INTERPRETATIONS_FILE)
 def add_dream_interpretation():
     data = request.get_json()
     if not data:
@@ -999,9 +1418,7 @@ def add_dream_interpretation():
     content = data.get('content')
     
     # 检查梦境是否存在
-    dreams = read_data(DREAMS_FILE)
-    dream = next((d for d in dreams if d.get('id') == dream_id), None)
-    if not dream:
+    if not get_dream_index().exists(dream_id):
         return jsonify({"error": "梦境不存在"}), 404
     
     # 创建新的解梦记录
@@ -1014,29 +1431,26 @@ def add_dream_interpretation():
     }
     
     # 保存解梦记录
-    interpretations = read_data(DREAM_INTERPRETATIONS_FILE)
-    interpretations.append(interpretation)
-    write_data(DREAM_INTERPRETATIONS_FILE, interpretations)
+    save_derived_item(DOC_INTERPRETATION, interpretation)
     
     return jsonify(interpretation), 201
 
 # 梦境续写API
-@app.route('/api/dream_continuations', methods=['GET'])
+@api_bp.route('/api/dream_continuations', methods=['GET'])
 @login_required
 def get_dream_continuations():
     dream_id = request.args.get('dream_id')
     if not dream_id:
         return jsonify({"error": "未提供梦境ID"}), 400
         
-    continuations = read_data(DREAM_CONTINUATIONS_FILE)
-    
-    # 根据梦境ID筛选
-    result = [cont for cont in continuations if cont.get('dream_id') == dream_id]
+    # 包括内容相同的梦境的续写（own_only=1 时只返回本梦境的，bypass_cache=1 时不使用缓存）
+    result = get_derived_items(DOC_CONTINUATION, dream_id, style=request.args.get('style'), **derived_options())
     
     return jsonify(result)
 
-@app.route('/api/dream_continuations', methods=['POST'])
+@api_bp.route('/api/dream_continuations', methods=['POST'])
 @login_required
+@file_lock(DREAM_CONTINUATIONS_FILE)
 def add_dream_continuation():
     data = request.get_json()
     if not data:
@@ -1053,9 +1467,7 @@ def add_dream_continuation():
     content = data.get('content')
     
     # 检查梦境是否存在
-    dreams = read_data(DREAMS_FILE)
-    dream = next((d for d in dreams if d.get('id') == dream_id), None)
-    if not dream:
+    if not get_dream_index().exists(dream_id):
         return jsonify({"error": "梦境不存在"}), 404
     
     # 创建新的续写记录
@@ -1068,29 +1480,26 @@ def add_dream_continuation():
     }
     
     # 保存续写记录
-    continuations = read_data(DREAM_CONTINUATIONS_FILE)
-    continuations.append(continuation)
-    write_data(DREAM_CONTINUATIONS_FILE, continuations)
+    save_derived_item(DOC_CONTINUATION, continuation)
     
     return jsonify(continuation), 201
 
 # 梦境预测API
-@app.route('/api/dream_predictions', methods=['GET'])
+@api_bp.route('/api/dream_predictions', methods=['GET'])
 @login_required
 def get_dream_predictions():
     dream_id = request.args.get('dream_id')
     if not dream_id:
         return jsonify({"error": "未提供梦境ID"}), 400
         
-    predictions = read_data(DREAM_PREDICTIONS_FILE)
-    
-    # 根据梦境ID筛选
-    result = [pred for pred in predictions if pred.get('dream_id') == dream_id]
+    # 包括内容相同的梦境的预测（own_only=1 时只返回本梦境的，bypass_cache=1 时不使用缓存）
+    result = get_derived_items(DOC_PREDICTION, dream_id, **derived_options())
     
     return jsonify(result)
 
-@app.route('/api/dream_predictions', methods=['POST'])
+@api_bp.route('/api/dream_predictions', methods=['POST'])
 @login_required
+@file_lock(DREAM_PREDICTIONS_FILE)
 def add_dream_prediction():
     data = request.get_json()
     if not data:
@@ -1106,9 +1515,7 @@ def add_dream_prediction():
     content = data.get('content')
     
     # 检查梦境是否存在
-    dreams = read_data(DREAMS_FILE)
-    dream = next((d for d in dreams if d.get('id') == dream_id), None)
-    if not dream:
+    if not get_dream_index().exists(dream_id):
         return jsonify({"error": "梦境不存在"}), 404
     
     # 创建新的预测记录
@@ -1120,12 +1527,11 @@ def add_dream_prediction():
     }
     
     # 保存预测记录
-    predictions = read_data(DREAM_PREDICTIONS_FILE)
-    predictions.append(prediction)
-    write_data(DREAM_PREDICTIONS_FILE, predictions)
+    save_derived_item(DOC_PREDICTION, prediction)
     
     return jsonify(prediction), 201
 
+@file_lock(TASK_STATS_FILE)
 def update_daily_task_stats():
     """
     更新前一天的任务统计数据
@@ -1133,15 +1539,17 @@ def update_daily_task_stats():
     """
     logger.info("开始更新每日任务统计数据...")
     
-    # 获取前一天的日期
-    yesterday = (datetime.datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-    yesterday_month = yesterday[:7]  # 格式: YYYY-MM
-    
     # 读取任务和任务记录数据
-    tasks_data = read_data(TASKS_FILE)
-    records_data = read_data(TASK_RECORDS_FILE)
+    tasks_data = read_collection(TASKS_FILE)
+    records_data = read_collection(TASK_RECORDS_FILE)
     stats_data = read_data(TASK_STATS_FILE)
     
+    # 统计的是所有任务所在的时区都已经结束的最近一天
+    zones = task_timezones(tasks_data)
+    yesterday = min((datetime.date.fromisoformat(clock.local_date(zone)) - timedelta(days=1)).isoformat()
+                    for zone in set(zones.values()) or {None})
+    yesterday_month = yesterday[:7]  # 格式: YYYY-MM
+    
     # 如果monthly_stats字段不存在，初始化它
     if 'monthly_stats' not in stats_data:
         stats_data['monthly_stats'] = {}
@@ -1153,28 +1561,8 @@ def update_daily_task_stats():
             "daily_stats": []
         }
     
-    # 计算前一天未成功打卡的任务数量
-    failed_tasks_count = 0
-    
-    # 遍历所有任务
-    for task_id, task in tasks_data.items():
-        # 检查任务是否在前一天就已经存在
-        created_at = datetime.datetime.fromisoformat(task['created_at'].replace('Z', '+00:00'))
-        if created_at.date() > datetime.datetime.fromisoformat(yesterday).date():
-            continue  # 跳过昨天之后创建的任务
-        
-        # 检查任务是否有记录
-        task_completed = False
-        for record_id, record in records_data.items():
-            if record['task_id'] == task_id and record['date'] == yesterday:
-                # 判断记录状态是否为成功（已通过）
-                if record['status'] == 'approved':
-                    task_completed = True
-                    break
-        
-        # 如果任务没有完成或者被拒绝，计入未成功任务
-        if not task_completed:
-            failed_tasks_count += 1
+    # 计算前一天未成功打卡（没有记录或记录未通过）的任务数量，跳过昨天之后创建的任务
+    failed_tasks_count = len(missed_task_ids(tasks_data, records_data, yesterday, zones))
     
     # 查找是否已经有昨天的统计数据
     found_existing = False
@@ -1221,11 +1609,42 @@ def schedule_daily_stats_update():
         except Exception as e:
             logger.error(f"更新任务统计时出错: {str(e)}")
 
-# 在单独的线程中启动定时任务
-stats_thread = threading.Thread(target=schedule_daily_stats_update, daemon=True)
-stats_thread.start()
+# 定时任务：多进程部署时只在获得调度锁的进程中运行，该进程退出后由其他进程接替
+def run_scheduled_jobs():
+    ensure_storage()
+    wait_for_scheduler_leadership()
+    logger.info(f"进程 {os.getpid()} 负责运行定时任务")
+    
+    # 恢复上次未完成的级联清理
+    requeue_pending_tombstones()
+
+    # 恢复上次未完成的生成任务，之后定期重新排队租约已过期的任务
+    threading.Thread(target=schedule_job_requeue, daemon=True).start()
+    
+    # 启动每日重置任务的线程
+    threading.Thread(target=reset_tasks_daily, daemon=True).start()
+    
+    # 在单独的线程中启动统计更新定时任务
+    threading.Thread(target=schedule_daily_stats_update, daemon=True).start()
+    
+    # 每天把过期的打卡记录月份封存到归档文件
+    threading.Thread(target=archive.schedule_partition_sealing, daemon=True).start()
+
+_background_started = False
+_background_guard = threading.Lock()
+
+# 启动定时任务和后台级联清理线程（每个进程处理自己产生的清理任务），每个进程只启动一次
+def start_background_jobs():
+    global _background_started
+    with _background_guard:
+        if _background_started:
+            return
+        _background_started = True
+    threading.Thread(target=run_scheduled_jobs, daemon=True).start()
+    start_cleanup_worker()
+    start_generation_workers()
 
-@app.route('/api/tasks/stats/monthly/<month>', methods=['GET'])
+@api_bp.route('/api/tasks/stats/monthly/<month>', methods=['GET'])
 @login_required
 def get_monthly_task_stats(month):
     """
@@ -1238,9 +1657,10 @@ def get_monthly_task_stats(month):
     except ValueError:
         return jsonify({"error": "无效的月份格式，请使用YYYY-MM格式"}), 400
     
-    # 读取统计数据
-    stats_data = read_data(TASK_STATS_FILE)
-    
+    return jsonify(build_monthly_stats(read_data(TASK_STATS_FILE), month, get_today_date()))
+
+def build_monthly_stats(stats_data, month, today):
+    """指定月份的统计数据；还没有统计的月份返回已经过去的日期，失败数为0"""
     # 如果没有该月的数据，初始化一个空的
     if 'monthly_stats' not in stats_data or month not in stats_data['monthly_stats']:
         # 创建当月的空统计数据
@@ -1250,7 +1670,7 @@ def get_monthly_task_stats(month):
         }
         
         # 对于当月中已经过去的日期，生成统计数据（使用0作为占位）
-        today = datetime.datetime.now().date()
+        today = datetime.date.fromisoformat(today)
         month_date = datetime.datetime.strptime(month, '%Y-%m').date()
         
         # 只有在查询的是当月或之前的月份时才生成数据
@@ -1276,13 +1696,13 @@ def get_monthly_task_stats(month):
                         "failed_tasks_count": 0  # 默认值为0
                     })
         
-        return jsonify(current_month_stats)
+        return current_month_stats
     
     # 返回该月的统计数据
-    return jsonify(stats_data['monthly_stats'][month])
+    return stats_data['monthly_stats'][month]
 
 # 手动触发更新前一天的统计数据（用于测试）
-@app.route('/api/tasks/stats/update', methods=['POST'])
+@api_bp.route('/api/tasks/stats/update', methods=['POST'])
 @login_required
 def trigger_stats_update():
     """手动触发统计数据更新（开发测试用）"""
@@ -1293,24 +1713,22 @@ def trigger_stats_update():
         logger.error(f"手动更新统计数据失败: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
 
-@app.route('/api/spaces/<space_id>/statistics/start-date', methods=['GET'])
+@api_bp.route('/api/spaces/<space_id>/statistics/start-date', methods=['GET'])
 @member_required()
 def get_space_statistics_start_date(space_id):
     """获取空间的统计起始日期"""
-    # 读取空间统计设置
-    stats_data = read_data(SPACES_STATISTICS_FILE)
-    
-    # 获取空间的统计起始日期，如果不存在则使用当前日期
-    current_date = get_today_date()
-    start_date = stats_data.get("spaces", {}).get(space_id, {}).get("statisticsStartDate", current_date)
-    
     return jsonify({
         "success": True,
-        "statisticsStartDate": start_date
+        "statisticsStartDate": statistics_start_date(read_data(SPACES_STATISTICS_FILE), space_id, get_today_date())
     })
 
-@app.route('/api/spaces/<space_id>/statistics/start-date', methods=['PUT'])
+# 空间的统计起始日期，如果不存在则使用当前日期
+def statistics_start_date(stats_data, space_id, today):
+    return stats_data.get("spaces", {}).get(space_id, {}).get("statisticsStartDate", today)
+
+@api_bp.route('/api/spaces/<space_id>/statistics/start-date', methods=['PUT'])
 @member_required()
+@file_lock(SPACES_STATISTICS_FILE)
 def update_space_statistics_start_date(space_id):
     """更新空间的统计起始日期"""
     data = request.json
@@ -1342,5 +1760,100 @@ def update_space_statistics_start_date(space_id):
         "statisticsStartDate": start_date
     })
 
+# 空间首页各部分依赖的数据文件（空间本身由 member_required 读取）
+DASHBOARD_SECTIONS = {
+    'space': (USERS_FILE,),
+    'tasks': (TASKS_FILE, TASK_RECORDS_FILE),
+    'today_records': (TASK_RECORDS_FILE,),
+    'dreams': (DREAMS_FILE, USERS_FILE),
+    'statistics_start_date': (SPACES_STATISTICS_FILE,),
+    'monthly_stats': (TASK_STATS_FILE,)
+}
+DASHBOARD_FILES = (SPACES_FILE,) + tuple(dict.fromkeys(
+    file_path for file_paths in DASHBOARD_SECTIONS.values() for file_path in file_paths))
+
+@api_bp.route('/api/spaces/<space_id>/dashboard', methods=['GET'])
+@member_required()
+@conditional(*DASHBOARD_FILES, vary=get_today_date)
+def get_space_dashboard(space_id):
+    """
+    空间首页一次请求：空间详情、任务（含今日完成状态）、今日打卡记录、空间梦境、统计起始日期和月度统计。
+    include 参数选择需要的部分（逗号分隔，默认全部），month 参数指定月度统计的月份（默认本月）。
+    各数据文件（任务、打卡记录和梦境只读取该空间的分片）只读取一次，并且来自同一时刻的快照
+    """
+    include = [name.strip() for name in request.args.get('include', '').split(',') if name.strip()] \
+        or list(DASHBOARD_SECTIONS)
+    unknown = [name for name in include if name not in DASHBOARD_SECTIONS]
+    if unknown:
+        return jsonify({"error": f"不支持的内容: {', '.join(unknown)}"}), 400
+
+    today = get_today_date()
+    month = request.args.get('month') or today[:7]
+    if 'monthly_stats' in include:
+        try:
+            datetime.datetime.strptime(month, '%Y-%m')
+        except ValueError:
+            return jsonify({"error": "无效的月份格式，请使用YYYY-MM格式"}), 400
+
+    paths = {file_path: shard_file(file_path, space_id) for name in include for file_path in DASHBOARD_SECTIONS[name]}
+    snapshot = read_snapshot(*paths.values())
+    snapshot = {file_path: snapshot[path] for file_path, path in paths.items()}
+    dashboard = {}
+    if 'space' in include:
+        dashboard['space'] = dict(g.space, members=get_members_with_username(g.space['members'],
+                                                                           snapshot[USERS_FILE]))
+    if 'tasks' in include:
+        dashboard['tasks'] = space_tasks_with_status(snapshot[TASKS_FILE], snapshot[TASK_RECORDS_FILE], space_id)
+    if 'today_records' in include:
+        dashboard['today_records'] = space_today_records(snapshot[TASK_RECORDS_FILE], space_id, today)
+    if 'dreams' in include:
+        dashboard['dreams'] = space_dreams_with_usernames(snapshot[DREAMS_FILE], space_id,
+                                                          usernames_by_id(snapshot[USERS_FILE]))
+    if 'statistics_start_date' in include:
+        dashboard['statistics_start_date'] = statistics_start_date(snapshot[SPACES_STATISTICS_FILE], space_id, today)
+    if 'monthly_stats' in include:
+        dashboard['monthly_stats'] = build_monthly_stats(snapshot[TASK_STATS_FILE], month, today)
+    return jsonify(dashboard)
+
+def create_app(config=None):
+    """
+    创建Flask应用。config 为覆盖 DEFAULT_CONFIG 的字典。
+    数据目录和数据文件在首个请求时按需初始化（部署时可预先执行 init_storage）。
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
+    if app.config['STORAGE'] is not None and app.config['STORAGE'] != storage_config:
+        raise ValueError(f"数据目录布局在导入时已由环境变量确定（{storage_config.data_dir}），"
+                         f"请在导入应用之前设置 TAPIR_DATA_DIR 等环境变量")
+    CORS(app)  # 允许跨域请求
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    # 注册蓝图
+    app.register_blueprint(api_bp)
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    app.register_blueprint(space_bp, url_prefix='/api/spaces')
+    app.register_blueprint(cleanup_bp, url_prefix='/api/cleanup')
+    app.register_blueprint(events_bp, url_prefix='/api/events')
+    app.register_blueprint(generation_bp, url_prefix='/api/generation_jobs')
+    app.register_blueprint(sync_bp, url_prefix='/api/sync')
+
+    # 注册性能监控中间件和 /metrics 端点
+    metrics.init_app(app, profile_dir=PROFILES_DIR)
+
+    # 注册响应压缩中间件
+    compress.init_app(app)
+
+    # 首个请求时初始化存储（在计时之后注册，冷启动的耗时计入首个请求）
+    app.before_request(ensure_storage)
+
+    if app.config['BACKGROUND_JOBS']:
+        start_background_jobs()
+    return app
+
+# 本地调试服务器；生产环境请使用 serve.py（ASGI）
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=8081)
+    init_storage()
+    create_app().run(debug=True, host='0.0.0.0', port=8081)
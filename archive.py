@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import bisect
+import datetime
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from storage import (TASK_RECORDS_FILE, RECORDS_ARCHIVE_DIR, read_data, file_lock, shard_file,
+                     read_collection, write_collection, collection_lock, bump_generation, file_signature,
+                     ensure_storage)
+
+# 打卡记录按月分区归档
+# task_records.json 及各空间的打卡记录分片只保存当前月和最近的月份（热分区，可修改）；更早的月份被封存为按列存储的归档文件，
+# 每月一个文件，只在查询历史记录和统计时按需读取，热数据量不再随空间存在的时间增长
+#
+# 归档文件格式（data/archive/task_records/YYYY-MM.col）：
+#   第一行是JSON文件头：行数、各列在文件中的偏移和长度、各空间/任务的行范围
+#   之后每列一行JSON：所有行都有值的列存为数组，部分行缺失的列存为 {"rows": [...], "values": [...]}
+#   行按 (空间ID, 任务ID, 日期, 创建时间) 排序，同一空间、同一任务的记录是连续的行
+#
+# 用法:
+#   python archive.py seal     封存热分区之外的月份
+#   python archive.py stats    查看各分区的记录数
+
+logger = logging.getLogger('tapir_twins')
+
+ARCHIVE_VERSION = 1
+
+# 保留在热分区中的月份数（当前月 + 上个月）
+HOT_MONTHS = int(os.environ.get('TAPIR_HOT_MONTHS', '2'))
+
+# 每天封存的时间（凌晨，在每日统计之后）
+SEAL_HOUR = 1
+
+# 文件头缓存：路径 -> (文件签名, 文件头, 数据起始偏移)
+_headers = {}
+_headers_lock = threading.Lock()
+
+
+def archive_path(month):
+    return os.path.join(RECORDS_ARCHIVE_DIR, f'{month}.col')
+
+# 已封存的月份（升序）
+def archived_months():
+    if not os.path.isdir(RECORDS_ARCHIVE_DIR):
+        return []
+    return sorted(name[:-4] for name in os.listdir(RECORDS_ARCHIVE_DIR) if name.endswith('.col'))
+
+# 仍在热分区中的最早月份，早于该月份的记录会被封存
+def hot_cutoff_month(today=None):
+    today = today or datetime.date.today()
+    year, month = today.year, today.month - (HOT_MONTHS - 1)
+    while month < 1:
+        year, month = year - 1, month + 12
+    return f'{year:04d}-{month:02d}'
+
+def record_month(record):
+    return (record.get('date') or '')[:7]
+
+def _sort_key(record):
+    return (record.get('space_id') or '', record.get('task_id') or '', record.get('date') or '',
+            record.get('created_at') or '')
+
+def _row_ranges(records, key):
+    ranges = {}
+    for i, record in enumerate(records):
+        value = record.get(key) or ''
+        if value in ranges:
+            ranges[value][1] = i + 1
+        else:
+            ranges[value] = [i, i + 1]
+    return ranges
+
+def encode_archive(month, records):
+    """把一个月的记录编码为归档文件内容（bytes）"""
+    records = sorted(records, key=_sort_key)
+    names = []
+    for record in records:
+        for name in record:
+            if name not in names:
+                names.append(name)
+
+    blobs = []
+    columns = {}
+    offset = 0
+    for name in names:
+        rows = [i for i, record in enumerate(records) if name in record]
+        values = [records[i][name] for i in rows]
+        if len(rows) == len(records):
+            encoding, column = 'dense', values
+        else:
+            encoding, column = 'sparse', {'rows': rows, 'values': values}
+        blob = json.dumps(column, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+        columns[name] = [offset, len(blob), encoding]
+        offset += len(blob)
+        blobs.append(blob)
+
+    header = {
+        'version': ARCHIVE_VERSION,
+        'collection': 'task_records',
+        'month': month,
+        'rows': len(records),
+        'columns': columns,
+        'spaces': _row_ranges(records, 'space_id'),
+        'tasks': _row_ranges(records, 'task_id')
+    }
+    return json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n' + b''.join(blobs)
+
+def _write_archive(month, records):
+    path = archive_path(month)
+    if not records:
+        if os.path.exists(path):
+            os.remove(path)
+        bump_generation(RECORDS_ARCHIVE_DIR)
+        return
+    raw = encode_archive(month, records)
+    fd, tmp_path = tempfile.mkstemp(dir=RECORDS_ARCHIVE_DIR, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(raw)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    bump_generation(RECORDS_ARCHIVE_DIR)
+
+def _read_header(path):
+    signature = file_signature(path)
+    if signature is None:
+        return None, None
+    with _headers_lock:
+        cached = _headers.get(path)
+        if cached and cached[0] == signature:
+            return cached[1], cached[2]
+    with open(path, 'rb') as f:
+        line = f.readline()
+    header = json.loads(line.decode('utf-8'))
+    with _headers_lock:
+        _headers[path] = (signature, header, len(line))
+    return header, len(line)
+
+def read_archive(month, space_id=None, task_id=None, columns=None):
+    """读取一个月的归档记录；可只读取某个空间或任务的行、只读取部分列"""
+    path = archive_path(month)
+    header, data_start = _read_header(path)
+    if header is None:
+        return []
+
+    start, end = 0, header['rows']
+    for key, value in (('spaces', space_id), ('tasks', task_id)):
+        if value is not None:
+            row_range = header[key].get(value)
+            if not row_range:
+                return []
+            start, end = max(start, row_range[0]), min(end, row_range[1])
+    if start >= end:
+        return []
+
+    records = [{} for _ in range(end - start)]
+    names = [name for name in header['columns'] if columns is None or name in columns]
+    with open(path, 'rb') as f:
+        for name in names:
+            offset, length, encoding = header['columns'][name]
+            f.seek(data_start + offset)
+            column = json.loads(f.read(length).decode('utf-8'))
+            if encoding == 'dense':
+                for record, value in zip(records, column[start:end]):
+                    record[name] = value
+            else:
+                rows = column['rows']
+                lo, hi = bisect.bisect_left(rows, start), bisect.bisect_left(rows, end)
+                for row, value in zip(rows[lo:hi], column['values'][lo:hi]):
+                    records[row - start][name] = value
+    # 同一任务的行按日期排序；按空间读取时恢复为按创建时间的顺序，与热分区一致
+    if task_id is None:
+        records.sort(key=lambda r: r.get('created_at') or '')
+    return records
+
+def load_records(space_id=None, task_id=None, month=None):
+    """读取历史记录（归档分区 + 热分区），按空间、任务或月份过滤；指定空间时热分区只读取该空间的分片"""
+    records = []
+    for archived in archived_months():
+        if month is None or archived == month:
+            records.extend(read_archive(archived, space_id=space_id, task_id=task_id))
+    hot = read_data(shard_file(TASK_RECORDS_FILE, space_id)) if space_id else read_collection(TASK_RECORDS_FILE)
+    for record in hot:
+        if ((space_id is None or record.get('space_id') == space_id) and
+                (task_id is None or record.get('task_id') == task_id) and
+                (month is None or record_month(record) == month)):
+            records.append(record)
+    return records
+
+def seal_partitions(today=None):
+    """
+    把热分区中早于保留范围的月份封存到归档文件，返回 {月份: 封存的记录数}。
+    每个月份的归档只重写一次，热分区只重写有记录被封存的空间分片
+    """
+    cutoff = hot_cutoff_month(today)
+    with collection_lock(TASK_RECORDS_FILE):
+        records = read_collection(TASK_RECORDS_FILE)
+        by_month = {}
+        hot = []
+        for record in records:
+            month = record_month(record)
+            if month and month < cutoff:
+                by_month.setdefault(month, []).append(record)
+            else:
+                hot.append(record)
+        if not by_month:
+            return {}
+        os.makedirs(RECORDS_ARCHIVE_DIR, exist_ok=True)
+        for month, sealed in sorted(by_month.items()):
+            with file_lock(archive_path(month)):
+                # 已封存过的月份（例如补录的记录）与原有归档合并后重写
+                _write_archive(month, read_archive(month) + sealed)
+        # 归档写入成功后再从热分区移除
+        write_collection(TASK_RECORDS_FILE, hot)
+    sealed_counts = {month: len(sealed) for month, sealed in sorted(by_month.items())}
+    logger.info(f"已封存打卡记录分区: {sealed_counts}")
+    return sealed_counts
+
+def remove_archived_records(should_remove, columns=('id', 'task_id', 'space_id')):
+    """从归档分区中删除记录，返回被删除的记录；先只读取判断所需的列，没有匹配的分区不重写"""
+    removed = []
+    for month in archived_months():
+        if not any(should_remove(record) for record in read_archive(month, columns=columns)):
+            continue
+        with file_lock(archive_path(month)):
+            kept = []
+            for record in read_archive(month):
+                (removed if should_remove(record) else kept).append(record)
+            _write_archive(month, kept)
+    return removed
+
+# 归档记录引用的全部图片文件名（只读取 images 列）
+def archived_images():
+    return {filename for month in archived_months()
+            for record in read_archive(month, columns=('images',))
+            for filename in record.get('images', [])}
+
+def partition_stats():
+    stats = {'hot': len(read_collection(TASK_RECORDS_FILE)), 'archived': {}}
+    for month in archived_months():
+        header, _ = _read_header(archive_path(month))
+        stats['archived'][month] = {'rows': header['rows'], 'bytes': os.path.getsize(archive_path(month))}
+    return stats
+
+# 每天凌晨封存过期的热分区（只在负责定时任务的进程中运行）
+def schedule_partition_sealing():
+    while True:
+        try:
+            seal_partitions()
+        except Exception as e:
+            logger.error(f"封存打卡记录分区失败: {str(e)}")
+        now = datetime.datetime.now()
+        next_run = now.replace(hour=SEAL_HOUR, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += datetime.timedelta(days=1)
+        time.sleep((next_run - now).total_seconds())
+
+
+if __name__ == '__main__':
+    import argparse
+
+    ensure_storage()
+    parser = argparse.ArgumentParser(description='TapirTwins 打卡记录分区归档')
+    parser.add_argument('command', choices=['seal', 'stats'])
+    args = parser.parse_args()
+
+    if args.command == 'seal':
+        print(json.dumps({'sealed': seal_partitions()}, ensure_ascii=False, indent=2))
+    print(json.dumps(partition_stats(), ensure_ascii=False, indent=2))
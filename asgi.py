@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import mimetypes
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+
+import metrics
+from app import create_app
+from storage import IMAGES_DIR, io_executor
+
+# ASGI入口
+# 与调试服务器相同的路由通过ASGI适配器提供：请求体在事件循环中异步接收完毕后才交给处理线程，
+# 慢速上传图片的客户端不再占用处理线程；Flask视图在有界的请求线程池中并发执行，
+# 事件推送等长时间等待的连接在单独的线程池中执行，不占用请求线程；
+# 图片下载在事件循环中分块发送，文件读取在有界I/O线程池中执行
+#
+# 运行: python serve.py  或  uvicorn asgi:application --host 0.0.0.0 --port 8081
+
+# 执行Flask视图的线程数
+REQUEST_THREADS = int(os.environ.get('TAPIR_REQUEST_THREADS', '16'))
+
+# 执行事件推送等长连接的线程数，即每个进程同时保持的长连接数上限
+STREAM_THREADS = int(os.environ.get('TAPIR_STREAM_THREADS', '256'))
+
+# 图片分块发送的大小
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+IMAGE_ROUTE_PREFIX = '/api/images/'
+
+# 长时间占用处理线程的路由：SSE事件推送，以及空间事件（长轮询和SSE）
+STREAM_ROUTES = (re.compile(r'/api/events/stream$'), re.compile(r'/api/spaces/[^/]+/events$'))
+
+# 执行Flask视图的线程池，以及执行长连接的线程池
+request_executor = ThreadPoolExecutor(max_workers=REQUEST_THREADS, thread_name_prefix='tapir-request')
+stream_executor = ThreadPoolExecutor(max_workers=STREAM_THREADS, thread_name_prefix='tapir-stream')
+
+
+class WsgiRequest(WsgiToAsgiInstance):
+    """
+    一个请求的WSGI适配：与 asgiref 的 WsgiToAsgiInstance 相同地接收请求体、构造 environ，
+    但在指定的线程池中执行WSGI应用（asgiref 默认把所有请求放到同一个线程中依次执行），
+    客户端断开后停止迭代响应并关闭它，及时释放处理线程
+    """
+
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+        self.disconnected = threading.Event()
+
+    async def __call__(self, scope, receive, send):
+        self.receive = receive
+        await super().__call__(scope, receive, send)
+
+    async def run_wsgi_app(self, body):
+        watcher = asyncio.ensure_future(self._watch_disconnect())
+        try:
+            await sync_to_async(self._run_wsgi_app, thread_sensitive=False, executor=self.executor)(body)
+        finally:
+            watcher.cancel()
+
+    # 请求体接收完毕后，下一条消息只会是客户端断开
+    async def _watch_disconnect(self):
+        while (await self.receive())['type'] != 'http.disconnect':
+            pass
+        self.disconnected.set()
+
+    def _run_wsgi_app(self, body):
+        try:
+            environ = self.build_environ(self.scope, body)
+        except ValueError:
+            # 重复的请求头过多
+            self.sync_send({'type': 'http.response.start', 'status': 400,
+                            'headers': [(b'content-type', b'text/plain')]})
+            self.sync_send({'type': 'http.response.body', 'body': b'Bad Request: Too many duplicate headers'})
+            return
+        response = self.wsgi_application(environ, self.start_response)
+        try:
+            for output in response:
+                if self.disconnected.is_set():
+                    return
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                if output:
+                    self.sync_send({'type': 'http.response.body', 'body': output, 'more_body': True})
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({'type': 'http.response.body'})
+
+
+class TapirASGI:
+    """在WSGI适配器之前直接处理图片下载，其余请求交给Flask应用"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        path = scope.get('path', '')
+        if (scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD') and
+                path.startswith(IMAGE_ROUTE_PREFIX) and '/' not in path[len(IMAGE_ROUTE_PREFIX):]):
+            await self._send_image(scope, send, path[len(IMAGE_ROUTE_PREFIX):])
+            return
+        executor = stream_executor if any(route.match(path) for route in STREAM_ROUTES) else request_executor
+        await WsgiRequest(self.wsgi_app, executor)(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _send_image(self, scope, send, filename):
+        started_at = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        file_path = os.path.join(IMAGES_DIR, os.path.basename(filename))
+        status = 200
+        try:
+            f = await loop.run_in_executor(io_executor, open, file_path, 'rb')
+        except (FileNotFoundError, IsADirectoryError):
+            status = 404
+            body = '{"error": "图片文件不存在"}'.encode('utf-8')
+            await send({'type': 'http.response.start', 'status': status,
+                        'headers': [(b'content-type', b'application/json'),
+                                    (b'content-length', str(len(body)).encode())]})
+            await send({'type': 'http.response.body', 'body': body})
+        else:
+            try:
+                size = os.fstat(f.fileno()).st_size
+                content_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+                await send({'type': 'http.response.start', 'status': status,
+                            'headers': [(b'content-type', content_type.encode()),
+                                        (b'content-length', str(size).encode()),
+                                        (b'access-control-allow-origin', b'*')]})
+                if scope['method'] == 'HEAD':
+                    await send({'type': 'http.response.body', 'body': b''})
+                else:
+                    while True:
+                        chunk = await loop.run_in_executor(io_executor, f.read, IMAGE_CHUNK_SIZE)
+                        more_body = len(chunk) == IMAGE_CHUNK_SIZE
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': more_body})
+                        if not more_body:
+                            break
+            finally:
+                await loop.run_in_executor(io_executor, f.close)
+        metrics.REQUEST_LATENCY.observe((scope['method'], '/api/images/<filename>', str(status)),
+                                        time.perf_counter() - started_at)
+
+
+application = TapirASGI(create_app())
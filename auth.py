@@ -8,58 +8,38 @@ import os
 import uuid
 import datetime
 import hashlib
-import jwt
 import re
 
+# 数据文件路径与其他模块共享
+from storage import USERS_FILE, SPACES_FILE, file_lock, init_data_file, read_data, write_data
+
 # 配置
 SECRET_KEY = "tapir_twins_secret_key"  # 实际应用中应该使用环境变量存储
 TOKEN_EXPIRATION = 24 * 60 * 60  # 24小时
 
-# 数据文件路径
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
-USERS_FILE = os.path.join(DATA_DIR, 'users.json')
-SPACES_FILE = os.path.join(DATA_DIR, 'spaces.json')
-
-# 确保数据目录存在
-os.makedirs(DATA_DIR, exist_ok=True)
-
 # 初始化用户数据文件
 def init_users_file():
-    if not os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
+    init_data_file(USERS_FILE)
 
 # 初始化空间数据文件
 def init_spaces_file():
-    if not os.path.exists(SPACES_FILE):
-        with open(SPACES_FILE, 'w', encoding='utf-8') as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
+    init_data_file(SPACES_FILE)
 
 # 读取用户数据
 def read_users():
-    try:
-        with open(USERS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
-        return []
+    return read_data(USERS_FILE)
 
 # 写入用户数据
 def write_users(users):
-    with open(USERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+    write_data(USERS_FILE, users)
 
 # 读取空间数据
 def read_spaces():
-    try:
-        with open(SPACES_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
-        return []
+    return read_data(SPACES_FILE)
 
 # 写入空间数据
 def write_spaces(spaces):
-    with open(SPACES_FILE, 'w', encoding='utf-8') as f:
-        json.dump(spaces, f, ensure_ascii=False, indent=2)
+    write_data(SPACES_FILE, spaces)
 
 # 密码哈希
 def hash_password(password):
@@ -71,6 +51,7 @@ def verify_password(stored_hash, password):
 
 # 生成JWT令牌
 def generate_token(user_id):
+    import jwt  # 延迟导入：jwt 会连带导入 ssl、urllib.request，只在登录和验证令牌时需要
     payload = {
         'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=TOKEN_EXPIRATION),
         'iat': datetime.datetime.utcnow(),
@@ -80,6 +61,7 @@ def generate_token(user_id):
 
 # 验证JWT令牌
 def verify_token(token):
+    import jwt
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
         return payload['sub']
@@ -131,6 +113,7 @@ auth_bp = Blueprint('auth', __name__)
 
 # 用户注册
 @auth_bp.route('/register', methods=['POST'])
+@file_lock(USERS_FILE)
 def register():
     data = request.get_json()
     
@@ -246,6 +229,3 @@ def get_current_user():
         }
     })
 
-# 初始化
-init_users_file()
-init_spaces_file()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import hashlib
+import json
+import os
+import random
+import uuid
+
+# 基准测试用的合成数据生成器
+# 按给定规模生成用户、空间、任务、按天累积的打卡记录、历史记录以及带中文内容的梦境，
+# 写入指定的数据目录（与 TAPIR_DATA_DIR 配合使用）
+
+DREAM_SUBJECTS = ['我', '妈妈', '一只貘', '老同学', '陌生人', '小猫', '外婆', '同事', '一位老师', '双胞胎']
+DREAM_PLACES = ['在海边', '在学校的走廊里', '在一座空城', '在森林深处', '在飞机上', '在老家的院子里',
+                '在地铁站', '在图书馆', '在山顶', '在一条长长的隧道里']
+DREAM_ACTIONS = ['飞了起来', '迷路了', '参加考试却忘了带笔', '追着一只发光的鸟', '找不到回家的路',
+                 '和巨大的鲸鱼说话', '一直在下楼梯', '捡到了一把旧钥匙', '看见天空裂开', '变成了一条鱼']
+DREAM_FEELINGS = ['心里很平静', '非常紧张', '有点害怕', '觉得很温暖', '醒来后还在心跳',
+                  '感觉时间停止了', '莫名地想哭', '特别开心']
+TASK_TITLES = ['早起打卡', '背单词', '跑步五公里', '读书一小时', '冥想十分钟', '喝八杯水', '练字',
+               '写日记', '拉伸运动', '不喝奶茶', '整理房间', '练习钢琴']
+INTERPRETATION_STYLES = ['周公解梦', '心理学', '荣格', '弗洛伊德']
+STATUS_WEIGHTS = [('approved', 0.75), ('rejected', 0.1), ('submitted', 0.15)]
+
+
+def _dream_text(rng, sentences):
+    parts = []
+    for _ in range(sentences):
+        parts.append(f'{rng.choice(DREAM_SUBJECTS)}{rng.choice(DREAM_PLACES)}{rng.choice(DREAM_ACTIONS)}，'
+                     f'{rng.choice(DREAM_FEELINGS)}。')
+    return ''.join(parts)
+
+def _weighted_status(rng):
+    value = rng.random()
+    for status, weight in STATUS_WEIGHTS:
+        if value < weight:
+            return status
+        value -= weight
+    return STATUS_WEIGHTS[-1][0]
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def _write(data_dir, name, data):
+    with open(os.path.join(data_dir, name), 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def generate_dataset(data_dir, users=20, spaces=5, members_per_space=4, tasks_per_space=6,
+                     months=3, checkin_rate=0.8, dreams_per_user=20, derived_per_dream=1, seed=42):
+    """生成合成数据集，返回包含各实体ID的清单（用于驱动基准请求）"""
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(data_dir, 'images'), exist_ok=True)
+    now = datetime.datetime.now()
+    today = now.date()
+    days = max(1, int(months * 30))
+    password_hash = hashlib.sha256('password123'.encode()).hexdigest()
+
+    user_list = []
+    for i in range(users):
+        created_at = (now - datetime.timedelta(days=days + 1)).isoformat()
+        user_list.append({
+            'id': _uuid(rng),
+            'username': f'bench_user_{i}',
+            'password_hash': password_hash,
+            'email': f'bench_user_{i}@example.com',
+            'created_at': created_at,
+            'updated_at': created_at
+        })
+    usernames = {u['id']: u['username'] for u in user_list}
+
+    space_list = []
+    for i in range(spaces):
+        members = rng.sample(user_list, min(members_per_space, len(user_list)))
+        created_at = (now - datetime.timedelta(days=days + 1)).isoformat()
+        space_list.append({
+            'id': _uuid(rng),
+            'name': f'基准空间{i}',
+            'description': '合成数据',
+            'creator_id': members[0]['id'],
+            'members': [{'user_id': m['id'], 'role': 'admin' if j == 0 else rng.choice(['submitter', 'approver'])}
+                        for j, m in enumerate(members)],
+            'created_at': created_at,
+            'updated_at': created_at,
+            'invite_code': ''.join(rng.choice('ABCDEFGHJKLMNPQRSTUVWXYZ23456789') for _ in range(8))
+        })
+
+    tasks = []
+    records = []
+    history = []
+    for space in space_list:
+        member_ids = [m['user_id'] for m in space['members']]
+        for _ in range(tasks_per_space):
+            created = now - datetime.timedelta(days=days)
+            submitter_id = rng.choice(member_ids)
+            approver_id = rng.choice(member_ids)
+            task = {
+                'id': _uuid(rng),
+                'title': rng.choice(TASK_TITLES),
+                'description': '每天坚持',
+                'created_at': created.isoformat(),
+                'updated_at': created.isoformat(),
+                'required_images': 1,
+                'completed_today': False,
+                'submitter_id': space['creator_id'],
+                'space_id': space['id'],
+                'status': 'pending',
+                'assigned_submitter_id': submitter_id,
+                'assigned_submitter_name': usernames[submitter_id],
+                'assigned_approver_ids': [approver_id],
+                'assigned_approver_names': [usernames[approver_id]]
+            }
+            tasks.append(task)
+            for offset in range(days, -1, -1):
+                if rng.random() > checkin_rate:
+                    continue
+                date = today - datetime.timedelta(days=offset)
+                created_at = datetime.datetime.combine(date, datetime.time(8)) + \
+                    datetime.timedelta(minutes=rng.randint(0, 720))
+                status = 'submitted' if offset == 0 else _weighted_status(rng)
+                record = {
+                    'id': _uuid(rng),
+                    'task_id': task['id'],
+                    'date': date.strftime('%Y-%m-%d'),
+                    'images': [f'{_uuid(rng)}.jpg'],
+                    'created_at': created_at.isoformat(),
+                    'submitter_id': submitter_id,
+                    'status': status,
+                    'submitter_name': usernames[submitter_id],
+                    'space_id': space['id'],
+                    'assigned_approver_ids': [approver_id],
+                    'assigned_approver_names': [usernames[approver_id]]
+                }
+                if status == 'approved':
+                    approved_at = (created_at + datetime.timedelta(hours=1)).isoformat()
+                    record.update({'approver_id': approver_id, 'approver_name': usernames[approver_id],
+                                   'approved_at': approved_at, 'approval_comment': '很棒'})
+                    history.append({
+                        'id': _uuid(rng),
+                        'task_id': task['id'],
+                        'date': record['date'],
+                        'created_at': approved_at,
+                        'user_id': approver_id,
+                        'user_name': usernames[approver_id],
+                        'action': 'approve',
+                        'description': f'审核通过了任务 {task["title"]}，审批词：很棒',
+                        'space_id': space['id']
+                    })
+                elif status == 'rejected':
+                    record.update({'approver_id': approver_id, 'approver_name': usernames[approver_id],
+                                   'rejection_reason': '图片不清楚'})
+                records.append(record)
+
+    dreams = []
+    interpretations = []
+    continuations = []
+    predictions = []
+    user_spaces = {u['id']: [s['id'] for s in space_list if any(m['user_id'] == u['id'] for m in s['members'])]
+                   for u in user_list}
+    for user in user_list:
+        for _ in range(dreams_per_user):
+            created = now - datetime.timedelta(days=rng.randint(0, days), minutes=rng.randint(0, 1440))
+            space_id = rng.choice(user_spaces[user['id']]) if user_spaces[user['id']] and rng.random() < 0.4 else None
+            dream = {
+                'id': _uuid(rng),
+                'title': f'{rng.choice(DREAM_PLACES)}的梦',
+                'content': _dream_text(rng, rng.randint(2, 8)),
+                'date': created.strftime('%Y-%m-%d'),
+                'created_at': created.isoformat(),
+                'user_id': user['id']
+            }
+            if space_id:
+                dream['space_id'] = space_id
+                dream['username'] = user['username']
+            dreams.append(dream)
+            for _ in range(derived_per_dream):
+                for collection, extra in ((interpretations, {'style': rng.choice(INTERPRETATION_STYLES)}),
+                                          (continuations, {'style': rng.choice(INTERPRETATION_STYLES)}),
+                                          (predictions, {})):
+                    item = {'id': _uuid(rng), 'dream_id': dream['id'],
+                            'content': _dream_text(rng, rng.randint(6, 20)),
+                            'created_at': created.isoformat()}
+                    item.update(extra)
+                    collection.append(item)
+
+    _write(data_dir, 'users.json', user_list)
+    _write(data_dir, 'spaces.json', space_list)
+    _write(data_dir, 'tasks.json', tasks)
+    _write(data_dir, 'task_records.json', records)
+    _write(data_dir, 'history_records.json', history)
+    _write(data_dir, 'dreams.json', dreams)
+    _write(data_dir, 'dream_interpretations.json', interpretations)
+    _write(data_dir, 'dream_continuations.json', continuations)
+    _write(data_dir, 'dream_predictions.json', predictions)
+    _write(data_dir, 'user_settings.json', {})
+
+    return {
+        'users': [u['id'] for u in user_list],
+        'spaces': [{'id': s['id'], 'members': [m['user_id'] for m in s['members']]} for s in space_list],
+        'tasks': [{'id': t['id'], 'space_id': t['space_id']} for t in tasks],
+        'dreams': [{'id': d['id'], 'user_id': d['user_id'], 'space_id': d.get('space_id')} for d in dreams],
+        'counts': {
+            'users': len(user_list), 'spaces': len(space_list), 'tasks': len(tasks),
+            'records': len(records), 'history': len(history), 'dreams': len(dreams),
+            'interpretations': len(interpretations), 'continuations': len(continuations),
+            'predictions': len(predictions)
+        }
+    }
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import gc
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench_data import generate_dataset
+from models import Dream, Task, TaskRecord
+
+# 模型内存基准测试
+# 对比同一批数据以原始字典和 __slots__ 模型对象保存时的内存占用（换算为每百万条），
+# 以及 from_dict / to_dict 的转换耗时
+#
+# 用法:
+#   python bench_models.py --count 200000 --output bench_models.json
+
+COLLECTIONS = {
+    'task_records': ('task_records.json', TaskRecord),
+    'tasks': ('tasks.json', Task),
+    'dreams': ('dreams.json', Dream)
+}
+
+PER_MILLION = 1000000
+
+
+def load_samples(data_dir, file_name):
+    with open(f'{data_dir}/{file_name}', 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def repeat_to(samples, count):
+    """把样本重复到指定条数并序列化，解析时每条记录的字符串都是独立的对象（与读取数据文件时一致）"""
+    items = [samples[i % len(samples)] for i in range(count)]
+    return json.dumps(items, ensure_ascii=False)
+
+def measure_memory(raw, model):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        dicts = json.loads(raw)
+        dict_bytes = tracemalloc.get_traced_memory()[0] - base
+        objects = [model.from_dict(item) for item in dicts]
+        # 释放字典后，剩下的就是模型对象及其共享的字段值
+        del dicts
+        gc.collect()
+        model_bytes = tracemalloc.get_traced_memory()[0] - base
+        count = len(objects)
+        del objects
+    finally:
+        tracemalloc.stop()
+    return count, dict_bytes, model_bytes
+
+# 转换耗时单独测量（tracemalloc 会显著拖慢内存分配）
+def measure_speed(raw, model):
+    started_at = time.perf_counter()
+    dicts = json.loads(raw)
+    parse_seconds = time.perf_counter() - started_at
+    started_at = time.perf_counter()
+    objects = [model.from_dict(item) for item in dicts]
+    from_dict_seconds = time.perf_counter() - started_at
+    started_at = time.perf_counter()
+    for obj in objects:
+        obj.to_dict()
+    to_dict_seconds = time.perf_counter() - started_at
+    return parse_seconds, from_dict_seconds, to_dict_seconds
+
+def measure(raw, model):
+    count, dict_bytes, model_bytes = measure_memory(raw, model)
+    parse_seconds, from_dict_seconds, to_dict_seconds = measure_speed(raw, model)
+    return {
+        'records': count,
+        'dict_mb_per_million': round(dict_bytes / count * PER_MILLION / 1024 / 1024, 1),
+        'model_mb_per_million': round(model_bytes / count * PER_MILLION / 1024 / 1024, 1),
+        'saving': round(1 - model_bytes / dict_bytes, 3),
+        'json_parse_us_per_record': round(parse_seconds / count * 1e6, 3),
+        'from_dict_us_per_record': round(from_dict_seconds / count * 1e6, 3),
+        'to_dict_us_per_record': round(to_dict_seconds / count * 1e6, 3)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='TapirTwins 模型内存基准测试')
+    parser.add_argument('--count', type=int, default=200000, help='每个集合测量的记录数')
+    parser.add_argument('--collections', default=','.join(COLLECTIONS), help='逗号分隔的集合名称')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='结果输出文件')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='tapir_bench_models_') as data_dir:
+        generate_dataset(data_dir, users=20, spaces=5, months=3, dreams_per_user=20,
+                         derived_per_dream=0, seed=args.seed)
+        results = {}
+        for name in [c.strip() for c in args.collections.split(',') if c.strip()]:
+            file_name, model = COLLECTIONS[name]
+            raw = repeat_to(load_samples(data_dir, file_name), args.count)
+            results[name] = result = measure(raw, model)
+            print(f"{name:14s} 字典={result['dict_mb_per_million']:8.1f}MB/百万条 "
+                  f"模型={result['model_mb_per_million']:8.1f}MB/百万条 节省={result['saving']:.1%} "
+                  f"from_dict={result['from_dict_us_per_record']:.2f}us to_dict={result['to_dict_us_per_record']:.2f}us")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'count': args.count, 'python': sys.version.split()[0], 'collections': results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# 工作进程冷启动基准测试
+# 每轮启动一个新的Python进程（相当于一个新的工作进程），分阶段测量：
+# 导入第三方依赖、导入应用模块、create_app、首个请求（按需初始化数据目录）以及之后的普通请求
+#
+# 用法:
+#   python bench_startup.py --runs 10 --output bench_startup.json
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PHASES = ('interpreter', 'dependencies', 'import_app', 'create_app', 'first_request', 'warm_request')
+
+# 在子进程中执行，输出各阶段的耗时（秒）
+CHILD_SCRIPT = '''
+import json, time
+started_at = time.perf_counter()
+import flask, flask_cors
+dependencies = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app({'BACKGROUND_JOBS': False})
+created = time.perf_counter()
+client = application.test_client()
+response = client.post('/api/auth/register',
+                       json={'username': 'bench', 'password': 'password123', 'email': 'bench@example.com'})
+first = time.perf_counter()
+client.get('/api/dreams', headers={'Authorization': 'Bearer ' + response.get_json()['token']})
+warm = time.perf_counter()
+print(json.dumps({
+    'dependencies': dependencies - started_at,
+    'import_app': imported - dependencies,
+    'create_app': created - imported,
+    'first_request': first - created,
+    'warm_request': warm - first
+}))
+'''
+
+
+def run_once():
+    with tempfile.TemporaryDirectory(prefix='tapir_bench_startup_') as data_dir:
+        env = dict(os.environ, TAPIR_DATA_DIR=data_dir)
+        started_at = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', CHILD_SCRIPT], cwd=PACKAGE_DIR, env=env,
+                                check=True, capture_output=True, text=True).stdout
+        total = time.perf_counter() - started_at
+    phases = json.loads(output.strip().splitlines()[-1])
+    # 解释器启动及退出的耗时 = 子进程总耗时 - 各阶段耗时
+    phases['interpreter'] = total - sum(phases.values())
+    phases['total'] = total
+    return phases
+
+def summarize(runs):
+    return {
+        phase: {
+            'median_ms': round(statistics.median(run[phase] for run in runs) * 1000, 1),
+            'min_ms': round(min(run[phase] for run in runs) * 1000, 1)
+        }
+        for phase in PHASES + ('total',)
+    }
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='TapirTwins 工作进程冷启动基准测试')
+    parser.add_argument('--runs', type=int, default=10, help='启动次数')
+    parser.add_argument('--output', help='结果输出文件')
+    args = parser.parse_args(argv)
+
+    # 第一次运行可能需要编译字节码，不计入结果
+    run_once()
+    runs = [run_once() for _ in range(args.runs)]
+    summary = summarize(runs)
+    for phase in PHASES + ('total',):
+        print(f"{phase:14s} 中位数={summary[phase]['median_ms']:8.1f}ms 最小={summary[phase]['min_ms']:8.1f}ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'runs': args.runs, 'python': sys.version.split()[0], 'phases': summary},
+                      f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_data import generate_dataset
+
+# 接口基准测试
+# 在临时数据目录中生成合成数据，通过Flask测试客户端（或 --url 指定的本地服务）并发请求各接口，
+# 统计每个接口的 p50/p95/p99 延迟和吞吐量，结果保存为JSON以便对比历次运行
+#
+# 用法:
+#   python benchmark.py --users 50 --spaces 10 --months 6 --workers 8 --requests 200 --output bench.json
+#   python benchmark.py --compare bench.json --output bench_new.json
+
+
+class FlaskClient:
+    """通过Flask测试客户端直接驱动应用，每个线程使用独立的客户端"""
+
+    def __init__(self, app):
+        self._app = app
+        self._local = threading.local()
+
+    def request(self, method, path, headers, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self._app.test_client()
+        response = client.open(path, method=method, headers=headers, json=body)
+        return response.status_code, len(response.get_data())
+
+
+class HttpClient:
+    """通过HTTP请求驱动已启动的本地服务"""
+
+    def __init__(self, base_url):
+        self._base_url = base_url.rstrip('/')
+
+    def request(self, method, path, headers, body=None):
+        data = None
+        headers = dict(headers)
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self._base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read())
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def build_scenarios(manifest, tokens, seed):
+    """返回 [(接口名称, 生成请求的函数)]，函数返回 (方法, 路径, 请求头, 请求体)"""
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    spaces = manifest['spaces']
+    dreams = manifest['dreams']
+    tasks_by_space = {}
+    for task in manifest['tasks']:
+        tasks_by_space.setdefault(task['space_id'], []).append(task['id'])
+
+    def pick(values):
+        with lock:
+            return rng.choice(values)
+
+    def auth(user_id):
+        return {'Authorization': f'Bearer {tokens[user_id]}'}
+
+    def space_member():
+        space = pick(spaces)
+        return space['id'], pick(space['members'])
+
+    def personal_dreams():
+        user_id = pick(manifest['users'])
+        return 'GET', '/api/dreams', auth(user_id), None
+
+    def space_dreams():
+        space_id, user_id = space_member()
+        return 'GET', f'/api/spaces/{space_id}/dreams', auth(user_id), None
+
+    def user_spaces():
+        return 'GET', '/api/spaces', auth(pick(manifest['users'])), None
+
+    def space_tasks():
+        space_id, user_id = space_member()
+        return 'GET', f'/api/spaces/{space_id}/tasks', auth(user_id), None
+
+    def space_records():
+        space_id, user_id = space_member()
+        return 'GET', f'/api/spaces/{space_id}/tasks/records', auth(user_id), None
+
+    def space_today_records():
+        space_id, user_id = space_member()
+        return 'GET', f'/api/spaces/{space_id}/tasks/records/today', auth(user_id), None
+
+    def dream_interpretations():
+        dream = pick(dreams)
+        return 'GET', f'/api/dream_interpretations?dream_id={dream["id"]}', auth(dream['user_id']), None
+
+    def dream_detail():
+        dream = pick(dreams)
+        return 'GET', f'/api/dreams/{dream["id"]}/detail', auth(dream['user_id']), None
+
+    def search():
+        user_id = pick(manifest['users'])
+        query = pick(['海边', '考试', '鲸鱼', '钥匙', '飞了起来', '森林'])
+        return 'GET', f'/api/search?q={urllib.request.quote(query)}', auth(user_id), None
+
+    def task_history():
+        space_id, user_id = space_member()
+        task_id = pick(tasks_by_space.get(space_id) or [''])
+        return 'GET', f'/api/spaces/{space_id}/tasks/{task_id}/history', auth(user_id), None
+
+    def add_dream():
+        user_id = pick(manifest['users'])
+        with lock:
+            marker = rng.getrandbits(64)
+        body = {'title': f'基准梦境{marker}', 'content': f'我在海边看见了编号为{marker}的鲸鱼。',
+                'date': datetime.date.today().strftime('%Y-%m-%d')}
+        return 'POST', '/api/dreams', auth(user_id), body
+
+    def add_space_task():
+        space_id, user_id = space_member()
+        return 'POST', f'/api/spaces/{space_id}/tasks', auth(user_id), {'title': '基准任务', 'required_images': 1}
+
+    return [
+        ('GET /api/dreams', personal_dreams),
+        ('GET /api/spaces/<space_id>/dreams', space_dreams),
+        ('GET /api/spaces', user_spaces),
+        ('GET /api/spaces/<space_id>/tasks', space_tasks),
+        ('GET /api/spaces/<space_id>/tasks/records', space_records),
+        ('GET /api/spaces/<space_id>/tasks/records/today', space_today_records),
+        ('GET /api/spaces/<space_id>/tasks/<task_id>/history', task_history),
+        ('GET /api/dream_interpretations', dream_interpretations),
+        ('GET /api/dreams/<dream_id>/detail', dream_detail),
+        ('GET /api/search', search),
+        ('POST /api/dreams', add_dream),
+        ('POST /api/spaces/<space_id>/tasks', add_space_task),
+    ]
+
+# 压缩指标的累计值（仅测试客户端模式可用，与应用在同一进程中）
+def compression_totals():
+    import metrics
+    totals = {'original_bytes': 0, 'compressed_bytes': 0, 'seconds': 0.0}
+    for encoding in ('br', 'gzip'):
+        totals['original_bytes'] += metrics.COMPRESSION_BYTES.get((encoding, 'original'))
+        totals['compressed_bytes'] += metrics.COMPRESSION_BYTES.get((encoding, 'compressed'))
+        totals['seconds'] += metrics.COMPRESSION_LATENCY.get((encoding,))[0]
+    return totals
+
+def compression_summary(before, after, requests):
+    original = after['original_bytes'] - before['original_bytes']
+    compressed = after['compressed_bytes'] - before['compressed_bytes']
+    if not original:
+        return None
+    return {
+        'ratio': round(compressed / original, 3),
+        'bytes_saved_per_request': round((original - compressed) / requests, 1),
+        'cpu_ms_per_request': round((after['seconds'] - before['seconds']) / requests * 1000, 3)
+    }
+
+def run_endpoint(client, make_request, requests, workers, warmup, accept_encoding=None):
+    def request_args():
+        method, path, headers, body = make_request()
+        if accept_encoding:
+            headers = dict(headers, **{'Accept-Encoding': accept_encoding})
+        return method, path, headers, body
+
+    for _ in range(warmup):
+        client.request(*request_args())
+
+    latencies = []
+    statuses = {}
+    total_bytes = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal total_bytes
+        method, path, headers, body = request_args()
+        started_at = time.perf_counter()
+        status, size = client.request(method, path, headers, body)
+        elapsed = time.perf_counter() - started_at
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+            total_bytes += size
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(one, range(requests)))
+    wall = time.perf_counter() - started_at
+
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items() if status >= 400)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+        'avg_response_bytes': round(total_bytes / len(latencies), 1)
+    }
+
+def compare_results(previous, current, threshold):
+    """对比两次运行结果，返回回退的接口列表"""
+    regressions = []
+    for name, result in current['endpoints'].items():
+        before = previous.get('endpoints', {}).get(name)
+        if not before:
+            continue
+        for key in ('p95_ms', 'p50_ms'):
+            if before[key] and result[key] > before[key] * (1 + threshold):
+                regressions.append({'endpoint': name, 'metric': key, 'before': before[key], 'after': result[key],
+                                    'change': round(result[key] / before[key] - 1, 3)})
+        if before.get('throughput_rps') and result['throughput_rps'] < before['throughput_rps'] * (1 - threshold):
+            regressions.append({'endpoint': name, 'metric': 'throughput_rps', 'before': before['throughput_rps'],
+                                'after': result['throughput_rps'],
+                                'change': round(result['throughput_rps'] / before['throughput_rps'] - 1, 3)})
+    return regressions
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='TapirTwins 接口基准测试')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--spaces', type=int, default=5)
+    parser.add_argument('--members-per-space', type=int, default=4)
+    parser.add_argument('--tasks-per-space', type=int, default=6)
+    parser.add_argument('--months', type=float, default=3)
+    parser.add_argument('--dreams-per-user', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=4, help='并发请求数')
+    parser.add_argument('--accept-encoding', default='gzip, br',
+                        help='请求的 Accept-Encoding，传空字符串则不请求压缩')
+    parser.add_argument('--requests', type=int, default=100, help='每个接口的请求次数')
+    parser.add_argument('--warmup', type=int, default=3, help='每个接口正式计时前的预热请求次数')
+    parser.add_argument('--endpoints', help='只测试名称包含这些关键字的接口，逗号分隔')
+    parser.add_argument('--url', help='驱动已启动的本地服务（需使用相同的 TAPIR_DATA_DIR），默认使用测试客户端')
+    parser.add_argument('--data-dir', help='数据目录，默认创建临时目录并在结束后删除')
+    parser.add_argument('--output', default='bench_results.json', help='结果输出文件')
+    parser.add_argument('--compare', help='与之前的结果文件对比')
+    parser.add_argument('--threshold', type=float, default=0.2, help='判定为回退的变化比例')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='tapir_bench_')
+    # 必须在导入应用之前设置数据目录
+    os.environ['TAPIR_DATA_DIR'] = data_dir
+
+    try:
+        started_at = time.perf_counter()
+        manifest = generate_dataset(data_dir, users=args.users, spaces=args.spaces,
+                                    members_per_space=args.members_per_space,
+                                    tasks_per_space=args.tasks_per_space, months=args.months,
+                                    dreams_per_user=args.dreams_per_user, seed=args.seed)
+        print(f"已生成合成数据 ({time.perf_counter() - started_at:.2f}s): {manifest['counts']}")
+
+        from storage import init_storage
+        init_storage()
+
+        from auth import generate_token
+        tokens = {user_id: generate_token(user_id) for user_id in manifest['users']}
+        if args.url:
+            client = HttpClient(args.url)
+        else:
+            import app as tapir_app
+            client = FlaskClient(tapir_app.create_app())
+
+        scenarios = build_scenarios(manifest, tokens, args.seed)
+        if args.endpoints:
+            keywords = [k.strip() for k in args.endpoints.split(',') if k.strip()]
+            scenarios = [(name, fn) for name, fn in scenarios if any(k in name for k in keywords)]
+
+        endpoints = {}
+        for name, make_request in scenarios:
+            before = None if args.url else compression_totals()
+            result = run_endpoint(client, make_request, args.requests, args.workers, args.warmup,
+                                  args.accept_encoding)
+            if before is not None:
+                # 预热请求也会被压缩，按全部请求数平均
+                result['compression'] = compression_summary(before, compression_totals(),
+                                                            args.requests + args.warmup)
+            endpoints[name] = result
+            compression = result.get('compression')
+            print(f"{name:55s} p50={result['p50_ms']:8.2f}ms p95={result['p95_ms']:8.2f}ms "
+                  f"p99={result['p99_ms']:8.2f}ms {result['throughput_rps']:8.1f} req/s errors={result['errors']}"
+                  + (f" 压缩比={compression['ratio']:.2f} 压缩CPU={compression['cpu_ms_per_request']:.2f}ms"
+                     if compression else ''))
+
+        results = {
+            'created_at': datetime.datetime.now().isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'mode': 'http' if args.url else 'test_client',
+            'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'data_dir')},
+            'dataset': manifest['counts'],
+            'endpoints': endpoints
+        }
+
+        exit_code = 0
+        if args.compare:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                previous = json.load(f)
+            regressions = compare_results(previous, results, args.threshold)
+            results['compared_with'] = {'file': args.compare, 'git_revision': previous.get('git_revision'),
+                                        'regressions': regressions}
+            for r in regressions:
+                print(f"回退: {r['endpoint']} {r['metric']} {r['before']} -> {r['after']} ({r['change']:+.1%})")
+            if regressions:
+                exit_code = 1
+
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+        return exit_code
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
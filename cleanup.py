@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from flask import Blueprint, jsonify, g
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+from auth import login_required
+from storage import (IMAGES_DIR, DREAMS_FILE, TASKS_FILE, TASK_RECORDS_FILE, SPACES_FILE,
+                     HISTORY_RECORDS_FILE, DREAM_INTERPRETATIONS_FILE, DREAM_CONTINUATIONS_FILE,
+                     DREAM_PREDICTIONS_FILE, SPACES_STATISTICS_FILE, TOMBSTONES_FILE,
+                     read_data, write_data, file_lock, collection_files, read_collection, remove_space_shards)
+from events import remove_event_log
+from archive import read_archive, archived_months, archived_images, remove_archived_records
+
+# 级联删除与后台清理
+# 删除任务、梦境、空间时立即从主数据中移除并写入墓碑（快速响应），
+# 关联的打卡记录、历史记录、衍生内容和图片文件由后台线程分批清理
+
+logger = logging.getLogger('tapir_twins')
+
+# 被删除的实体类型
+ENTITY_TASK = 'task'
+ENTITY_DREAM = 'dream'
+ENTITY_SPACE = 'space'
+ENTITY_ORPHANS = 'orphans'  # 对账发现的孤儿数据
+
+# 墓碑状态
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+# 每批最多合并处理的墓碑数量，同一批次中每个数据文件只读写一次
+BATCH_SIZE = 50
+
+# 未被任何打卡记录引用的图片，超过该时间才视为孤儿（避免误删正在提交的图片）
+ORPHAN_IMAGE_GRACE_SECONDS = 60 * 60
+
+# 衍生内容数据文件
+DERIVED_FILES = {
+    'interpretations': DREAM_INTERPRETATIONS_FILE,
+    'continuations': DREAM_CONTINUATIONS_FILE,
+    'predictions': DREAM_PREDICTIONS_FILE
+}
+
+_queue = queue.Queue()
+# 正在处理中的墓碑进度（仅内存），处理完成后写回墓碑文件
+_running_progress = {}
+
+cleanup_bp = Blueprint('cleanup', __name__)
+
+
+# 写入墓碑并加入后台清理队列；audience 为除删除者和空间成员以外还需要得知该删除的用户（用于同步）
+def create_tombstone(entity_type, entity_id, user_id, space_id=None, audience=None):
+    tombstone = {
+        'id': str(uuid.uuid4()),
+        'entity_type': entity_type,
+        'entity_id': entity_id,
+        'space_id': space_id,
+        'user_id': user_id,
+        'deleted_at': datetime.datetime.now().isoformat(),
+        'status': STATUS_PENDING,
+        'progress': {}
+    }
+    if audience:
+        tombstone['audience'] = list(audience)
+    with file_lock(TOMBSTONES_FILE):
+        tombstones = read_data(TOMBSTONES_FILE)
+        tombstones.append(tombstone)
+        write_data(TOMBSTONES_FILE, tombstones)
+    _queue.put(tombstone['id'])
+    return tombstone
+
+# 获取墓碑（处理中的墓碑附带实时进度）
+def get_tombstone(tombstone_id):
+    tombstone = next((t for t in read_data(TOMBSTONES_FILE) if t.get('id') == tombstone_id), None)
+    if tombstone and tombstone_id in _running_progress:
+        tombstone = dict(tombstone, status=STATUS_RUNNING, progress=dict(_running_progress[tombstone_id]))
+    return tombstone
+
+def _update_tombstones(changes):
+    with file_lock(TOMBSTONES_FILE):
+        tombstones = read_data(TOMBSTONES_FILE)
+        for tombstone in tombstones:
+            if tombstone.get('id') in changes:
+                tombstone.update(changes[tombstone['id']])
+        write_data(TOMBSTONES_FILE, tombstones)
+
+# 过滤数据文件（分片集合逐个分片加锁处理），返回被移除的条目；没有变化的文件不重写
+def _remove_from_file(file_path, should_remove):
+    removed = []
+    for path in collection_files(file_path):
+        with file_lock(path):
+            kept = []
+            removed_here = []
+            for item in read_data(path):
+                (removed_here if should_remove(item) else kept).append(item)
+            if removed_here:
+                write_data(path, kept)
+        removed.extend(removed_here)
+    return removed
+
+def _remove_images(filenames):
+    count = 0
+    for filename in filenames:
+        try:
+            os.remove(os.path.join(IMAGES_DIR, os.path.basename(filename)))
+            count += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"删除图片失败 {filename}: {str(e)}")
+    return count
+
+def _count(owner, key, amount=1):
+    if owner in _running_progress and amount:
+        progress = _running_progress[owner]
+        progress[key] = progress.get(key, 0) + amount
+
+def _set_stage(owners, stage):
+    for owner in owners:
+        _running_progress[owner]['stage'] = stage
+
+
+def process_batch(tombstone_ids):
+    """一次性级联清理一批墓碑，每个数据文件在整批中只读写一次"""
+    tombstones = [t for t in read_data(TOMBSTONES_FILE)
+                  if t.get('id') in tombstone_ids and t.get('status') in (STATUS_PENDING, STATUS_RUNNING)]
+    if not tombstones:
+        return
+
+    owners = [t['id'] for t in tombstones]
+    for owner in owners:
+        _running_progress[owner] = {'stage': 'tasks'}
+    _update_tombstones({owner: {'status': STATUS_RUNNING} for owner in owners})
+
+    # 被删除实体ID -> 负责的墓碑ID，用于按墓碑统计清理进度
+    task_owner = {}
+    space_owner = {}
+    dream_owner = {}
+    sweep_owners = []
+    for t in tombstones:
+        if t['entity_type'] == ENTITY_TASK:
+            task_owner[t['entity_id']] = t['id']
+        elif t['entity_type'] == ENTITY_SPACE:
+            space_owner[t['entity_id']] = t['id']
+        elif t['entity_type'] == ENTITY_DREAM:
+            dream_owner[t['entity_id']] = t['id']
+        elif t['entity_type'] == ENTITY_ORPHANS:
+            sweep_owners.append(t['id'])
+
+    try:
+        # 空间：移除空间下的全部任务，任务的关联数据随后一并清理
+        if space_owner:
+            for task in _remove_from_file(TASKS_FILE, lambda t: t.get('space_id') in space_owner):
+                task_owner[task['id']] = space_owner[task['space_id']]
+                _count(space_owner[task['space_id']], 'tasks')
+
+        # 打卡记录及其图片
+        _set_stage(owners, 'records')
+        images = []
+        def is_removed_record(r):
+            return r.get('task_id') in task_owner or r.get('space_id') in space_owner
+        removed_records = _remove_from_file(TASK_RECORDS_FILE, is_removed_record)
+        # 已封存月份中的记录
+        removed_records += remove_archived_records(is_removed_record)
+        for record in removed_records:
+            owner = task_owner.get(record.get('task_id')) or space_owner.get(record.get('space_id'))
+            _count(owner, 'records')
+            images.extend((owner, filename) for filename in record.get('images', []))
+
+        # 历史记录
+        _set_stage(owners, 'history')
+        removed_history = _remove_from_file(
+            HISTORY_RECORDS_FILE,
+            lambda h: h.get('task_id') in task_owner or h.get('space_id') in space_owner)
+        for history in removed_history:
+            _count(task_owner.get(history.get('task_id')) or space_owner.get(history.get('space_id')), 'history')
+
+        # 空间梦境
+        _set_stage(owners, 'dreams')
+        if space_owner:
+            for dream in _remove_from_file(DREAMS_FILE, lambda d: d.get('space_id') in space_owner):
+                dream_owner.setdefault(dream['id'], space_owner[dream['space_id']])
+                _count(space_owner[dream['space_id']], 'dreams')
+
+        # 衍生内容：相同内容的梦境共享ID，只有该ID下已没有任何梦境时才清理
+        if dream_owner:
+            remaining_ids = {d.get('id') for d in read_collection(DREAMS_FILE)}
+            dead_dream_ids = {dream_id: owner for dream_id, owner in dream_owner.items()
+                              if dream_id not in remaining_ids}
+            for key, file_path in DERIVED_FILES.items():
+                for item in _remove_from_file(file_path, lambda i: i.get('dream_id') in dead_dream_ids):
+                    _count(dead_dream_ids[item['dream_id']], key)
+
+        # 空间统计设置
+        if space_owner:
+            with file_lock(SPACES_STATISTICS_FILE):
+                stats_data = read_data(SPACES_STATISTICS_FILE)
+                spaces_stats = stats_data.get('spaces', {}) if isinstance(stats_data, dict) else {}
+                if any(space_id in spaces_stats for space_id in space_owner):
+                    for space_id in space_owner:
+                        spaces_stats.pop(space_id, None)
+                    write_data(SPACES_STATISTICS_FILE, stats_data)
+            # 空间事件日志及已清空的数据分片
+            for space_id in space_owner:
+                remove_event_log(space_id)
+                remove_space_shards(space_id)
+
+        # 图片文件
+        _set_stage(owners, 'images')
+        for owner, filename in images:
+            _count(owner, 'images', _remove_images([filename]))
+
+        # 对账发现的孤儿数据
+        for owner in sweep_owners:
+            _set_stage([owner], 'orphans')
+            _running_progress[owner].update(remove_orphans())
+
+        changes = {}
+        now = datetime.datetime.now().isoformat()
+        for owner in owners:
+            progress = _running_progress.pop(owner)
+            progress['stage'] = STATUS_DONE
+            changes[owner] = {'status': STATUS_DONE, 'progress': progress, 'completed_at': now}
+        _update_tombstones(changes)
+    except Exception as e:
+        logger.error(f"级联清理失败: {str(e)}")
+        changes = {}
+        for owner in owners:
+            progress = _running_progress.pop(owner, {})
+            changes[owner] = {'status': STATUS_FAILED, 'progress': progress, 'error': str(e)}
+        _update_tombstones(changes)
+
+
+# 后台清理线程：合并队列中的墓碑分批处理
+def cleanup_worker():
+    while True:
+        batch = [_queue.get()]
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            process_batch(set(batch))
+        except Exception as e:
+            logger.error(f"后台清理线程出错: {str(e)}")
+
+# 重新排队上次未完成的清理（只在负责定时任务的进程中执行）
+def requeue_pending_tombstones():
+    for tombstone in read_data(TOMBSTONES_FILE):
+        if tombstone.get('status') in (STATUS_PENDING, STATUS_RUNNING):
+            _queue.put(tombstone['id'])
+
+# 启动后台清理线程
+def start_cleanup_worker():
+    thread = threading.Thread(target=cleanup_worker, daemon=True)
+    thread.start()
+    return thread
+
+
+def find_orphans():
+    """查找已失去归属的数据：不存在的空间、任务、梦境下的数据以及未被引用的图片"""
+    space_ids = {s.get('id') for s in read_data(SPACES_FILE)}
+    tasks = read_collection(TASKS_FILE)
+    task_ids = {t.get('id') for t in tasks}
+    # 打卡记录包括已封存月份的记录（只读取判断所需的列）
+    records = read_collection(TASK_RECORDS_FILE) + [
+        record for month in archived_months()
+        for record in read_archive(month, columns=('id', 'task_id', 'space_id'))]
+    dreams = read_collection(DREAMS_FILE)
+    dream_ids = {d.get('id') for d in dreams}
+
+    def orphan_space(item):
+        return bool(item.get('space_id')) and item.get('space_id') not in space_ids
+
+    report = {
+        'tasks': [t.get('id') for t in tasks if orphan_space(t)],
+        'records': [r.get('id') for r in records if r.get('task_id') not in task_ids or orphan_space(r)],
+        'history': [h.get('id') for h in read_data(HISTORY_RECORDS_FILE)
+                    if h.get('task_id') not in task_ids or orphan_space(h)],
+        'dreams': [d.get('id') for d in dreams if orphan_space(d)]
+    }
+    for key, file_path in DERIVED_FILES.items():
+        report[key] = [i.get('id') for i in read_data(file_path) if i.get('dream_id') not in dream_ids]
+
+    referenced = {filename for r in read_collection(TASK_RECORDS_FILE) for filename in r.get('images', [])}
+    referenced |= archived_images()
+    cutoff = time.time() - ORPHAN_IMAGE_GRACE_SECONDS
+    report['images'] = sorted(
+        filename for filename in os.listdir(IMAGES_DIR)
+        if filename not in referenced and os.path.getmtime(os.path.join(IMAGES_DIR, filename)) < cutoff
+    ) if os.path.isdir(IMAGES_DIR) else []
+    return report
+
+def remove_orphans():
+    """清理孤儿数据，返回各类数据的清理数量"""
+    report = find_orphans()
+    counts = {}
+    for key, file_path in [('tasks', TASKS_FILE), ('records', TASK_RECORDS_FILE),
+                           ('history', HISTORY_RECORDS_FILE), ('dreams', DREAMS_FILE)] + list(DERIVED_FILES.items()):
+        ids = set(report[key])
+        if key == 'dreams':
+            # 梦境ID可能在多条记录间共享，只移除属于已删除空间的那些
+            space_ids = {s.get('id') for s in read_data(SPACES_FILE)}
+            removed = _remove_from_file(file_path, lambda d: d.get('space_id') and d.get('space_id') not in space_ids)
+        else:
+            removed = _remove_from_file(file_path, lambda i: i.get('id') in ids) if ids else []
+        if key == 'records' and ids:
+            removed += remove_archived_records(lambda r: r.get('id') in ids, columns=('id',))
+        counts[key] = len(removed)
+    counts['images'] = _remove_images(report['images'])
+    return counts
+
+# 对账：查找孤儿数据，apply为True时安排后台清理
+def reconcile_orphans(apply=False, user_id=None):
+    report = find_orphans()
+    summary = {key: len(ids) for key, ids in report.items()}
+    tombstone = None
+    if apply and any(summary.values()):
+        tombstone = create_tombstone(ENTITY_ORPHANS, None, user_id)
+    return report, summary, tombstone
+
+
+# 查询清理进度
+@cleanup_bp.route('/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_cleanup_job(job_id):
+    tombstone = get_tombstone(job_id)
+    if not tombstone:
+        return jsonify({'error': '未找到该清理任务'}), 404
+    if tombstone.get('user_id') != g.user_id:
+        return jsonify({'error': '无权查看该清理任务'}), 403
+    return jsonify(tombstone)
+
+
+if __name__ == '__main__':
+    import argparse
+    from storage import ensure_storage
+
+    ensure_storage()
+    parser = argparse.ArgumentParser(description='TapirTwins 数据对账与孤儿数据清理')
+    parser.add_argument('command', choices=['reconcile'])
+    parser.add_argument('--apply', action='store_true', help='立即清理发现的孤儿数据')
+    args = parser.parse_args()
+
+    report, summary, _ = reconcile_orphans()
+    print(json.dumps({'summary': summary, 'orphans': report}, ensure_ascii=False, indent=2))
+    if args.apply:
+        print(json.dumps({'removed': remove_orphans()}, ensure_ascii=False, indent=2))
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import functools
+import os
+import time
+from zoneinfo import ZoneInfo
+
+from flask import g, has_request_context
+
+from auth import read_spaces
+from settings import get_settings
+
+# 时区与请求内的时钟
+# 打卡日期、“今天”的记录、缺卡和统计都按本地日期计算：空间任务使用空间的时区，个人任务使用用户设置的时区，
+# 都未设置时使用默认时区（TAPIR_TIMEZONE，未设置时为服务器本地时间）。
+# 同一请求内只取一次当前时间，每个时区的本地日期只计算一次
+
+DEFAULT_TIMEZONE = os.environ.get('TAPIR_TIMEZONE') or None
+
+
+@functools.lru_cache(maxsize=None)
+def _zone(name):
+    return ZoneInfo(name)
+
+# 指定时区的当前时间（不带时区信息）；name 为 None 时使用默认时区
+def local_now(name=None, timestamp=None):
+    timestamp = time.time() if timestamp is None else timestamp
+    name = name or DEFAULT_TIMEZONE
+    if name is None:
+        return datetime.datetime.fromtimestamp(timestamp)
+    return datetime.datetime.fromtimestamp(timestamp, _zone(name)).replace(tzinfo=None)
+
+def local_date(name=None, timestamp=None):
+    return local_now(name, timestamp).strftime('%Y-%m-%d')
+
+# 把时间戳换算为指定时区的日期；不带时区的时间戳按服务器本地时间处理（本服务写入的 created_at 等）
+def date_in_zone(timestamp_text, name=None):
+    try:
+        moment = datetime.datetime.fromisoformat(str(timestamp_text).replace('Z', '+00:00'))
+    except ValueError:
+        return str(timestamp_text)[:10]
+    return local_date(name, moment.timestamp())
+
+def space_timezone(space):
+    return (space or {}).get('timezone') or DEFAULT_TIMEZONE
+
+def user_timezone(user_id):
+    return (get_settings(user_id).get('timezone') if user_id else None) or DEFAULT_TIMEZONE
+
+# 请求内缓存空间和用户的时区，同一请求中多次查询只读取一次
+def _request_cached(key, compute):
+    if not has_request_context():
+        return compute()
+    zones = g.setdefault('clock_zones', {})
+    if key not in zones:
+        zones[key] = compute()
+    return zones[key]
+
+def _find_space(space_id):
+    # member_required 已经读取过的空间直接使用
+    if has_request_context():
+        space = g.get('space')
+        if space and space.get('id') == space_id:
+            return space
+    return next((space for space in read_spaces() if space.get('id') == space_id), None)
+
+def space_id_timezone(space_id):
+    return _request_cached(('space', space_id), lambda: space_timezone(_find_space(space_id)))
+
+def user_id_timezone(user_id):
+    return _request_cached(('user', user_id), lambda: user_timezone(user_id))
+
+def task_timezone(task, spaces_by_id=None):
+    """任务的时区：空间任务使用空间的时区，个人任务使用创建者的时区"""
+    space_id = task.get('space_id')
+    if space_id:
+        if spaces_by_id is not None:
+            return space_timezone(spaces_by_id.get(space_id))
+        return space_id_timezone(space_id)
+    return user_id_timezone(task.get('submitter_id'))
+
+def _request_now():
+    if not has_request_context():
+        return time.time()
+    if 'clock_now' not in g:
+        g.clock_now = time.time()
+    return g.clock_now
+
+def today_in(name):
+    """指定时区的“今天”；在请求中使用请求开始时取得的时间，每个时区只计算一次"""
+    if not has_request_context():
+        return local_date(name)
+    dates = g.setdefault('clock_dates', {})
+    if name not in dates:
+        dates[name] = local_date(name, _request_now())
+    return dates[name]
+
+def today(space_id=None, user_id=None):
+    """空间（指定 space_id 时）或用户的“今天”"""
+    if space_id:
+        return today_in(space_id_timezone(space_id))
+    return today_in(user_id_timezone(user_id))
+
+def task_today(task, spaces_by_id=None):
+    return today_in(task_timezone(task, spaces_by_id))
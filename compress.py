@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gzip
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import observe_compression, record_cache
+
+try:
+    import brotli
+except ImportError:  # 未安装 brotli 时只使用 gzip
+    brotli = None
+
+# 响应压缩
+# 按客户端的 Accept-Encoding 使用 brotli（已安装时）或 gzip 压缩JSON等文本响应；
+# 小于阈值或不在类型白名单中的响应不压缩。带ETag的响应内容由ETag确定，
+# 其压缩结果缓存起来，相同的响应不再重复压缩
+
+# 小于该字节数的响应不压缩
+MIN_SIZE = int(os.environ.get('TAPIR_COMPRESS_MIN_SIZE', '1024'))
+
+# 可压缩的内容类型
+COMPRESSIBLE_TYPES = {
+    'application/json',
+    'text/plain',
+    'text/html',
+    'text/css',
+    'text/csv',
+    'application/javascript'
+}
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# 压缩结果缓存的总字节数上限
+CACHE_MAX_BYTES = int(os.environ.get('TAPIR_COMPRESS_CACHE_BYTES', str(32 * 1024 * 1024)))
+
+_cache = OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# 按客户端的偏好选择编码，客户端不接受压缩时返回None
+def choose_encoding(accept_encodings):
+    best, best_quality = None, 0
+    for encoding in available_encodings():
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+def _cache_get(key):
+    with _cache_lock:
+        body = _cache.get(key)
+        if body is not None:
+            _cache.move_to_end(key)
+        return body
+
+def _cache_put(key, body):
+    global _cache_bytes
+    if len(body) > CACHE_MAX_BYTES:
+        return
+    with _cache_lock:
+        if key in _cache:
+            return
+        _cache[key] = body
+        _cache_bytes += len(body)
+        while _cache_bytes > CACHE_MAX_BYTES:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= len(evicted)
+
+def compress_response(response):
+    from flask import request
+
+    if response.mimetype not in COMPRESSIBLE_TYPES:
+        return response
+    # 可压缩的响应随 Accept-Encoding 变化，代理缓存需要区分
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed or
+            'Content-Encoding' in response.headers or request.method == 'HEAD'):
+        return response
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < MIN_SIZE:
+        return response
+
+    etag = response.headers.get('ETag')
+    key = (etag, request.full_path, encoding) if etag else None
+    body = _cache_get(key) if key else None
+    if key:
+        record_cache('compression', body is not None)
+    if body is not None:
+        observe_compression(encoding, None, len(data), len(body))
+    else:
+        started_at = time.perf_counter()
+        body = compress_body(data, encoding)
+        observe_compression(encoding, time.perf_counter() - started_at, len(data), len(body))
+        if len(body) >= len(data):
+            return response
+        if key:
+            _cache_put(key, body)
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def init_app(app):
+    """注册响应压缩中间件（after_request 按注册的相反顺序执行，在监控中间件之后注册使请求耗时包含压缩）"""
+    app.after_request(compress_response)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from dream_index import FileBackedIndex
+from metrics import CACHE_BYTES, CACHE_EVICTIONS, record_cache
+from storage import encode_lines, file_signature, is_line_delimited, read_data, write_bytes
+
+# 梦境衍生内容（解梦、续写、预测）的分层存储
+# 磁盘层：数据文件按行存储（见 storage.LINE_DELIMITED_FILES），内存中只保留 梦境ID -> 各记录在文件中的偏移量，
+#         读取某个梦境的衍生内容时只读取并解析对应的几行，不解析整个文件；文件在外部被修改时重新扫描偏移量
+# 内存层：所有集合共享一个按字节数限制大小的LRU缓存，缓存最近读取过的梦境的衍生内容，
+#         上限由 TAPIR_DERIVED_CACHE_BYTES 指定（默认16MB，为0时不缓存）
+
+CACHE_MAX_BYTES = int(os.environ.get('TAPIR_DERIVED_CACHE_BYTES', str(16 * 1024 * 1024)))
+
+# 内容相同的梦境共享衍生内容的查询结果缓存：有效期（秒）和最多条目数
+MEMO_TTL_SECONDS = int(os.environ.get('TAPIR_MEMO_TTL_SECONDS', '3600'))
+MEMO_MAX_ENTRIES = int(os.environ.get('TAPIR_MEMO_MAX_ENTRIES', '4096'))
+
+# 不完整解析整行JSON，只提取记录的梦境ID；梦境ID中含转义字符时才解析整行
+_DREAM_ID_RE = re.compile(rb'"dream_id":"([^"\\]*)"')
+
+
+class ByteBudgetLRU:
+    """按字节数限制总大小的LRU缓存，超出上限时淘汰最久未使用的条目"""
+
+    def __init__(self, name, max_bytes):
+        self.name = name  # 监控指标中的缓存名称
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # 键 -> (值, 字节数)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, nbytes):
+        with self._lock:
+            self._pop(key)
+            # 单个条目超过上限时不缓存
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                CACHE_EVICTIONS.inc((self.name,))
+            CACHE_BYTES.set((self.name,), self._bytes)
+
+    def discard(self, key):
+        with self._lock:
+            self._pop(key)
+            CACHE_BYTES.set((self.name,), self._bytes)
+
+    # 移除满足条件的全部键
+    def discard_where(self, predicate):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._pop(key)
+            CACHE_BYTES.set((self.name,), self._bytes)
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+
+class MemoCache:
+    """带有效期的LRU结果缓存：每个条目记录计算时数据的版本号，版本变化或超过有效期即失效，超过条目数上限时淘汰最久未使用的"""
+
+    def __init__(self, name, ttl_seconds, max_entries):
+        self.name = name  # 监控指标中的缓存名称
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # 键 -> (版本号, 过期时间, 值)
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            hit = entry is not None and entry[0] == version and entry[1] > time.monotonic()
+            if hit:
+                self._entries.move_to_end(key)
+            elif entry is not None:
+                del self._entries[key]
+        record_cache(self.name, hit)
+        return entry[2] if hit else None
+
+    def put(self, key, version, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (version, time.monotonic() + self.ttl_seconds, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                CACHE_EVICTIONS.inc((self.name,))
+
+
+# 衍生内容共享的内存层
+derived_cache = ByteBudgetLRU('derived_content', CACHE_MAX_BYTES)
+
+# 按 (类型, 内容指纹, 风格) 的查询结果缓存
+derived_memo = MemoCache('derived_memo', MEMO_TTL_SECONDS, MEMO_MAX_ENTRIES)
+
+
+class DerivedStore(FileBackedIndex):
+    """一种衍生内容的存储：梦境ID -> 记录在数据文件中的 (偏移量, 长度)，记录内容按需读取并进入共享的LRU缓存"""
+
+    def __init__(self, name, file_path, cache=derived_cache):
+        super().__init__(name)
+        self.file_path = file_path
+        self.cache = cache
+        self._offsets = {}
+        self._legacy = None  # 文件不是按行存储时（例如被手工编辑过），退回为全部记录保存在内存中
+
+    # 扫描数据文件，只提取每行记录的梦境ID和位置
+    def _scan(self):
+        try:
+            with open(self.file_path, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return {}, None
+        if not is_line_delimited(raw):
+            legacy = {}
+            for item in read_data(self.file_path):
+                legacy.setdefault(item.get('dream_id'), []).append(item)
+            return None, legacy
+        offsets = {}
+        for offset, line in _iter_lines(raw):
+            match = _DREAM_ID_RE.search(line)
+            dream_id = match.group(1).decode('utf-8') if match else json.loads(line).get('dream_id')
+            offsets.setdefault(dream_id, []).append((offset, len(line)))
+        return offsets, None
+
+    def items_with_positions(self):
+        """读取全部记录及其在文件中的 (偏移量, 长度)，用于建立检索索引；文件不是按行存储时位置为 None"""
+        try:
+            with open(self.file_path, 'rb') as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return []
+        if not is_line_delimited(raw):
+            return [(item, None) for item in read_data(self.file_path)]
+        return [(json.loads(line), (offset, len(line))) for offset, line in _iter_lines(raw)]
+
+    def rebuild(self, scanned):
+        with self._lock:
+            self._offsets, self._legacy = scanned
+            self.cache.discard_where(lambda key: key[0] == self.name)
+
+    def refresh(self):
+        self.ensure_fresh(self.file_path, self._scan)
+        return self
+
+    # 按偏移量读取记录；文件在获取偏移量之后被替换时返回 None，由调用方重新扫描
+    def _read_entries(self, positions):
+        signature = file_signature(self.file_path)
+        try:
+            fd = os.open(self.file_path, os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            stat = os.fstat(fd)
+            if signature is None or (stat.st_mtime_ns, stat.st_size) != signature[1:] or signature != self._signature:
+                return None
+            return [os.pread(fd, length, offset) for offset, length in positions]
+        finally:
+            os.close(fd)
+
+    def get(self, dream_id):
+        """获取某个梦境的全部衍生内容（按写入顺序）"""
+        for _ in range(3):
+            self.refresh()
+            with self._lock:
+                if self._legacy is not None:
+                    return list(self._legacy.get(dream_id, []))
+                key = (self.name, dream_id)
+                cached = self.cache.get(key)
+                record_cache(f'derived_{self.name}', cached is not None)
+                if cached is not None:
+                    return list(cached)
+                positions = self._offsets.get(dream_id, [])
+                if not positions:
+                    return []
+                lines = self._read_entries(positions)
+                if lines is None:
+                    continue
+                items = [json.loads(line) for line in lines]
+                self.cache.put(key, items, sum(len(line) for line in lines))
+                return list(items)
+        return read_data_by_dream(self.file_path, dream_id)
+
+    def get_item(self, dream_id, item_id, position=None):
+        """按位置读取一条记录并核对ID；没有位置或位置已失效（文件已被替换）时从该梦境的衍生内容中查找"""
+        if position is not None:
+            self.refresh()
+            with self._lock:
+                lines = self._read_entries([position])
+            try:
+                item = json.loads(lines[0]) if lines else None
+            except ValueError:
+                item = None
+            if isinstance(item, dict) and item.get('id') == item_id:
+                return item
+        return next((item for item in self.get(dream_id) if item.get('id') == item_id), None)
+
+    def append(self, item):
+        """
+        追加一条记录（调用方持有该数据文件的 file_lock），返回记录在文件中的 (偏移量, 长度)：
+        新文件由原文件去掉末尾的 ']' 行再加上新的一行组成，已有记录按字节分块复制，不读入内存也不重新编码
+        """
+        with self._lock:
+            self.refresh()
+            line = encode_lines([item])[2:-3]
+            if self._legacy is not None:
+                write_bytes(self.file_path, encode_lines(read_data(self.file_path) + [item]))
+                self._signature = None
+                return None
+            try:
+                size = os.path.getsize(self.file_path)
+            except FileNotFoundError:
+                size = 0
+            # 空文件为 '[\n]\n'，否则末尾 '\n]\n' 之前是最后一条记录
+            if size <= 4:
+                offset = 2
+                write_bytes(self.file_path, b'[\n' + line + b'\n]\n')
+            else:
+                offset = size - 1
+                write_bytes(self.file_path, b',\n' + line + b'\n]\n', keep=size - 3)
+            self._offsets.setdefault(item.get('dream_id'), []).append((offset, len(line)))
+            self.cache.discard((self.name, item.get('dream_id')))
+            self.mark_synced(self.file_path)
+            return offset, len(line)
+
+
+# 按行存储的文件中每条记录的 (偏移量, 行内容)，行尾的逗号不属于记录
+def _iter_lines(raw):
+    offset = 2
+    while offset < len(raw) - 2:
+        end = raw.index(b'\n', offset)
+        yield offset, raw[offset:end - (1 if raw[end - 1:end] == b',' else 0)]
+        offset = end + 1
+
+
+# 解析整个数据文件获取某个梦境的衍生内容（文件被频繁替换、按偏移量读取不成功时使用）
+def read_data_by_dream(file_path, dream_id):
+    return [item for item in read_data(file_path) if item.get('dream_id') == dream_id]
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import re
+import threading
+import unicodedata
+
+from metrics import record_cache
+from models import Dream
+from storage import file_signature, synced_signature
+
+# 梦境相关的内存索引
+# 相同标题+内容的梦境共享同一个ID，这里用内容指纹代替对全部梦境的线性比对；
+# 同时维护梦境ID主索引。梦境索引中保存的是 Dream 模型对象（解梦、续写、预测的按梦境ID存取见 derived_store.py）
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# 规范化文本：统一Unicode形式、去除首尾空白并合并连续空白
+def normalize_text(text):
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', str(text))
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+# 计算梦境内容指纹
+def dream_fingerprint(title, content):
+    normalized = normalize_text(title) + '\x00' + normalize_text(content)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+class FileBackedIndex:
+    """与单个数据文件保持同步的内存索引基类"""
+
+    def __init__(self, name):
+        self.name = name  # 监控指标中的缓存名称
+        self._lock = threading.RLock()
+        self._signature = None
+
+    # 如果数据文件在索引之外被修改，则从头重建索引
+    def ensure_fresh(self, file_path, loader):
+        with self._lock:
+            signature = file_signature(file_path)
+            stale = signature is None or signature != self._signature
+            record_cache(self.name, not stale)
+            if stale:
+                self.rebuild(loader())
+                self._signature = file_signature(file_path)
+
+    # 索引当前对应的数据文件签名（调用 ensure_fresh 之后有效），可作为派生缓存的版本号
+    @property
+    def signature(self):
+        return self._signature
+
+    # 在写入一次数据文件并同步更新索引后记录新的文件签名，避免下次访问时无谓的重建
+    def mark_synced(self, file_path):
+        with self._lock:
+            self._signature = synced_signature(self._signature, file_path)
+
+    def rebuild(self, items):
+        raise NotImplementedError
+
+
+class DreamIndex(FileBackedIndex):
+    """梦境索引：ID -> 梦境（Dream），指纹 -> 梦境ID，(用户ID, 空间ID, 指纹) -> 梦境ID"""
+
+    def __init__(self, name='dreams'):
+        super().__init__(name)
+        self._by_id = {}
+        self._by_fingerprint = {}
+        self._by_owner = {}
+
+    def rebuild(self, dreams):
+        with self._lock:
+            self._by_id = {}
+            self._by_fingerprint = {}
+            self._by_owner = {}
+            for dream in dreams:
+                self.add(dream)
+
+    @staticmethod
+    def _owner_key(user_id, space_id, fingerprint):
+        return (user_id, space_id or None, fingerprint)
+
+    # 相同内容的梦境共享ID，用归属和创建时间区分同一ID下的不同记录
+    @staticmethod
+    def _same_entry(a, b):
+        return (a.get('user_id') == b.get('user_id') and
+                (a.get('space_id') or None) == (b.get('space_id') or None) and
+                a.get('created_at') == b.get('created_at'))
+
+    # 接受梦境字典或 Dream 对象，索引中统一保存为 Dream
+    def add(self, dream):
+        if isinstance(dream, dict):
+            dream = Dream.from_dict(dream)
+        fingerprint = dream_fingerprint(dream.get('title'), dream.get('content'))
+        key = self._owner_key(dream.get('user_id'), dream.get('space_id'), fingerprint)
+        with self._lock:
+            self._by_id.setdefault(dream.get('id'), []).append(dream)
+            self._by_fingerprint.setdefault(fingerprint, []).append(dream.get('id'))
+            self._by_owner.setdefault(key, []).append(dream.get('id'))
+
+    def remove(self, dream):
+        fingerprint = dream_fingerprint(dream.get('title'), dream.get('content'))
+        key = self._owner_key(dream.get('user_id'), dream.get('space_id'), fingerprint)
+        with self._lock:
+            entries = self._by_id.get(dream.get('id'), [])
+            for i, entry in enumerate(entries):
+                if self._same_entry(entry, dream):
+                    entries.pop(i)
+                    break
+            if not entries:
+                self._by_id.pop(dream.get('id'), None)
+            self._discard(self._by_fingerprint, fingerprint, dream.get('id'))
+            self._discard(self._by_owner, key, dream.get('id'))
+
+    # 替换一条记录，在同一ID下保持原来的位置（get 仍返回最早写入的记录）
+    def replace(self, old_dream, new_dream):
+        if isinstance(new_dream, dict):
+            new_dream = Dream.from_dict(new_dream)
+        with self._lock:
+            entries = self._by_id.get(old_dream.get('id'), [])
+            position = next((i for i, entry in enumerate(entries) if self._same_entry(entry, old_dream)), None)
+            if position is None or new_dream.get('id') != old_dream.get('id'):
+                self.remove(old_dream)
+                self.add(new_dream)
+                return
+            entries[position] = new_dream
+            old_fingerprint = dream_fingerprint(old_dream.get('title'), old_dream.get('content'))
+            new_fingerprint = dream_fingerprint(new_dream.get('title'), new_dream.get('content'))
+            if new_fingerprint != old_fingerprint:
+                dream_id = new_dream.get('id')
+                self._discard(self._by_fingerprint, old_fingerprint, dream_id)
+                self._by_fingerprint.setdefault(new_fingerprint, []).append(dream_id)
+                self._discard(self._by_owner, self._owner_key(old_dream.get('user_id'), old_dream.get('space_id'),
+                                                              old_fingerprint), dream_id)
+                self._by_owner.setdefault(self._owner_key(new_dream.get('user_id'), new_dream.get('space_id'),
+                                                          new_fingerprint), []).append(dream_id)
+
+    @staticmethod
+    def _discard(mapping, key, dream_id):
+        ids = mapping.get(key)
+        if not ids:
+            return
+        try:
+            ids.remove(dream_id)
+        except ValueError:
+            return
+        if not ids:
+            del mapping[key]
+
+    # 按ID获取梦境（与线性查找一致，返回该ID下最早写入的记录），返回 Dream 对象
+    def get(self, dream_id):
+        with self._lock:
+            entries = self._by_id.get(dream_id)
+            return entries[0] if entries else None
+
+    # 该ID下的全部记录（按写入顺序）
+    def entries(self, dream_id):
+        with self._lock:
+            return list(self._by_id.get(dream_id, []))
+
+    def exists(self, dream_id):
+        with self._lock:
+            return dream_id in self._by_id
+
+    # 查找相同内容的已有梦境ID
+    def find_existing_id(self, fingerprint):
+        with self._lock:
+            ids = self._by_fingerprint.get(fingerprint)
+            return ids[0] if ids else None
+
+    # 内容指纹相同的全部梦境ID（去重，按写入顺序）
+    def equivalent_ids(self, fingerprint):
+        with self._lock:
+            return list(dict.fromkeys(self._by_fingerprint.get(fingerprint, [])))
+
+    # 查找同一用户在同一空间下内容完全相同的梦境ID
+    def find_duplicate_id(self, user_id, space_id, fingerprint):
+        with self._lock:
+            ids = self._by_owner.get(self._owner_key(user_id, space_id, fingerprint))
+            return ids[0] if ids else None
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from flask import Blueprint, Response, request, g, stream_with_context
+import datetime
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from auth import login_required, read_spaces
+from storage import EVENTS_DIR, file_lock
+
+# 空间事件日志与推送
+# 每个空间一个只追加的事件文件，事件序号在空间内从1开始连续递增；
+# 客户端通过 /api/spaces/<space_id>/events?since=<seq> 只获取新事件，不再反复下载整个集合，
+# 或通过 /api/events/stream 以SSE接收自己所在全部空间的推送（例如新的打卡待审批）
+
+logger = logging.getLogger('tapir_twins')
+
+# 事件类型
+TASK_CREATED = 'task.created'
+TASK_UPDATED = 'task.updated'
+TASK_DELETED = 'task.deleted'
+CHECKIN_SUBMITTED = 'checkin.submitted'
+CHECKIN_APPROVED = 'checkin.approved'
+CHECKIN_REJECTED = 'checkin.rejected'
+MEMBER_JOINED = 'member.joined'
+MEMBER_REMOVED = 'member.removed'
+MEMBER_ROLE_CHANGED = 'member.role_changed'
+
+# 等待新事件时检查其他进程写入的间隔（秒）
+POLL_INTERVAL = 1.0
+
+# SSE心跳间隔（秒）和客户端断线重连间隔（毫秒）
+STREAM_HEARTBEAT = 15
+STREAM_RETRY_MS = 3000
+
+# 进程内的事件缓存：空间ID -> {'offset': 已读取的字节数, 'events': [...]}
+_logs = {}
+_logs_lock = threading.Lock()
+# 本进程写入事件后唤醒等待中的长轮询和事件流
+_new_events = threading.Condition()
+
+
+def event_log_path(space_id):
+    return os.path.join(EVENTS_DIR, f"{os.path.basename(space_id)}.jsonl")
+
+# 读取事件文件中新追加的部分，返回该空间的全部事件（按序号排列）
+def _load_events(space_id):
+    path = event_log_path(space_id)
+    with _logs_lock:
+        log = _logs.setdefault(space_id, {'offset': 0, 'events': []})
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        if size < log['offset']:
+            # 文件被删除或重建（例如空间已删除），重新读取
+            log['offset'] = 0
+            log['events'] = []
+        if size > log['offset']:
+            with open(path, 'rb') as f:
+                f.seek(log['offset'])
+                chunk = f.read(size - log['offset'])
+            # 只处理完整的行，未写完的行留到下次读取
+            end = chunk.rfind(b'\n') + 1
+            for line in chunk[:end].splitlines():
+                if line.strip():
+                    log['events'].append(json.loads(line.decode('utf-8')))
+            log['offset'] += end
+        return log['events']
+
+# 追加一条空间事件，返回该事件
+def record_event(space_id, event_type, actor_id, data=None):
+    recorded = record_events(space_id, [(event_type, actor_id, data)])
+    return recorded[0] if recorded else None
+
+# 在一次加锁中追加多条空间事件，items 为 (事件类型, 操作者ID, 数据) 列表
+def record_events(space_id, items):
+    if not space_id or not items:
+        return []
+    os.makedirs(EVENTS_DIR, exist_ok=True)
+    path = event_log_path(space_id)
+    with file_lock(path):
+        seq = len(_load_events(space_id))
+        now = datetime.datetime.now().isoformat()
+        recorded = []
+        for event_type, actor_id, data in items:
+            seq += 1
+            recorded.append({
+                'seq': seq,
+                'type': event_type,
+                'space_id': space_id,
+                'actor_id': actor_id,
+                'created_at': now,
+                'data': data or {}
+            })
+        with open(path, 'ab') as f:
+            f.write(b''.join(json.dumps(event, ensure_ascii=False).encode('utf-8') + b'\n'
+                             for event in recorded))
+        _load_events(space_id)
+    with _new_events:
+        _new_events.notify_all()
+    hub.publish()
+    return recorded
+
+# 获取序号大于 since 的事件
+def events_since(space_id, since=0, limit=None):
+    events = _load_events(space_id)
+    # 序号从1开始连续，直接按下标切片
+    since = max(0, since)
+    return events[since:since + limit] if limit else events[since:]
+
+# 最新事件序号
+def latest_seq(space_id):
+    return len(_load_events(space_id))
+
+def wait_for_events(space_id, since=0, limit=None, timeout=0):
+    """获取新事件；暂无新事件时最多等待 timeout 秒（长轮询）"""
+    deadline = time.monotonic() + timeout
+    while True:
+        events = events_since(space_id, since, limit)
+        remaining = deadline - time.monotonic()
+        if events or remaining <= 0:
+            return events
+        with _new_events:
+            _new_events.wait(min(remaining, POLL_INTERVAL))
+
+# 删除空间的事件日志（空间删除后由后台清理调用）
+def remove_event_log(space_id):
+    path = event_log_path(space_id)
+    if not os.path.exists(path):
+        return
+    with file_lock(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    with _logs_lock:
+        _logs.pop(space_id, None)
+
+
+# 格式化一条SSE消息
+def format_sse(data, event_id=None, event_type=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event_type:
+        lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+class Subscription:
+    """一个推送连接订阅的空间及各空间已投递到的事件序号"""
+
+    def __init__(self, space_ids, positions):
+        self.space_ids = set(space_ids)
+        self.positions = dict(positions)
+        self.queue = queue.Queue()
+
+    # 投递该空间中序号大于已投递位置的事件
+    def deliver(self, space_id, latest):
+        position = self.positions.get(space_id, 0)
+        if position >= latest:
+            return
+        for event in events_since(space_id, position):
+            self.queue.put(event)
+            self.positions[space_id] = event['seq']
+
+
+class EventHub:
+    """
+    进程内的发布/订阅中心：每个进程一个分发线程，被唤醒（本进程写入事件）或每隔 POLL_INTERVAL 秒
+    （发现其他进程写入的事件）时把新事件投递到订阅了对应空间的连接，每个空间每轮只检查一次事件文件
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def subscribe(self, space_ids, positions):
+        subscription = Subscription(space_ids, positions)
+        with self._lock:
+            for space_id in subscription.space_ids:
+                self._subscribers.setdefault(space_id, set()).add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='tapir-event-hub', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for space_id in subscription.space_ids:
+                subscribers = self._subscribers.get(space_id)
+                if subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[space_id]
+
+    def publish(self, event=None):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(POLL_INTERVAL)
+            self._wakeup.clear()
+            with self._lock:
+                subscribers = {space_id: list(subs) for space_id, subs in self._subscribers.items()}
+            for space_id, subs in subscribers.items():
+                try:
+                    latest = latest_seq(space_id)
+                    for subscription in subs:
+                        subscription.deliver(space_id, latest)
+                except Exception as e:
+                    logger.error(f"分发空间 {space_id} 的事件失败: {str(e)}")
+
+
+hub = EventHub()
+
+events_bp = Blueprint('events', __name__)
+
+
+# 解析 Last-Event-ID 中的投递位置（空间ID:序号，逗号分隔）
+def parse_cursor(cursor):
+    positions = {}
+    for part in (cursor or '').split(','):
+        space_id, _, seq = part.strip().rpartition(':')
+        if space_id and seq.isdigit():
+            positions[space_id] = int(seq)
+    return positions
+
+# 当前用户所有空间的事件推送（SSE）；types 参数可只订阅部分事件类型
+# 连接在等待事件时一直占用处理线程，ASGI入口在单独的线程池中执行它（见 asgi.STREAM_ROUTES）
+@events_bp.route('/stream', methods=['GET'])
+@login_required
+def stream_user_events():
+    user_id = g.user_id
+    space_ids = [space['id'] for space in read_spaces()
+                 if any(member['user_id'] == user_id for member in space.get('members', []))]
+    types = {t.strip() for t in request.args.get('types', '').split(',') if t.strip()}
+    
+    # 断线重连时从上次的位置继续，否则只推送连接之后的新事件
+    resumed = parse_cursor(request.headers.get('Last-Event-ID') or request.args.get('cursor'))
+    positions = {space_id: min(resumed[space_id], latest_seq(space_id)) if space_id in resumed
+                 else latest_seq(space_id) for space_id in space_ids}
+    
+    return Response(stream_with_context(_stream(user_id, space_ids, positions, types)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def _stream(user_id, space_ids, positions, types):
+    subscription = hub.subscribe(space_ids, positions)
+    # 事件ID是连接的整体投递位置，而不是单个空间的序号
+    delivered = dict(positions)
+    try:
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        while True:
+            try:
+                event = subscription.queue.get(timeout=STREAM_HEARTBEAT)
+            except queue.Empty:
+                # 心跳，保持连接并及时发现已断开的客户端
+                yield ": heartbeat\n\n"
+                continue
+            delivered[event['space_id']] = event['seq']
+            cursor = ','.join(f"{space_id}:{seq}" for space_id, seq in sorted(delivered.items()))
+            if not types or event['type'] in types:
+                yield format_sse(event, cursor, event['type'])
+            # 被移出空间后结束推送，客户端重连时按新的成员关系订阅
+            if event['type'] == MEMBER_REMOVED and event['data'].get('user_id') == user_id:
+                return
+    finally:
+        hub.unsubscribe(subscription)
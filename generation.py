@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from flask import Blueprint, request, jsonify, g
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+from auth import login_required
+from dream_index import dream_fingerprint
+from metrics import GENERATION_JOBS
+from search import DOC_INTERPRETATION, DOC_CONTINUATION, DOC_PREDICTION
+from storage import GENERATION_JOBS_FILE, read_data, write_data, file_lock
+
+# 服务端生成解梦、续写、预测
+# 客户端提交生成任务后轮询任务状态，由后台工作线程池调用生成服务并把结果写入已有的衍生内容集合。
+# 相同内容的梦境共享同一个梦境ID，任务按 (梦境内容指纹, 类型, 风格) 去重：同一内容同一风格只生成一次，
+# 多个用户同时请求时共享同一个任务，已有相同内容、相同风格的结果时直接复用（请求中 bypass_cache 为 true 时重新生成）。
+# 排队和执行中的任务带有租约，租约过期（排队或执行它的进程已退出）的任务由负责定时任务的进程定期重新排队。
+# 生成服务可替换，默认使用不依赖网络的本地占位实现（stub）
+
+logger = logging.getLogger('tapir_twins')
+
+# 可生成的衍生内容类型；预测没有风格
+KINDS = (DOC_INTERPRETATION, DOC_CONTINUATION, DOC_PREDICTION)
+STYLED_KINDS = (DOC_INTERPRETATION, DOC_CONTINUATION)
+
+# 任务状态
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+# 每个进程同时调用生成服务的任务数
+GENERATION_WORKERS = int(os.environ.get('TAPIR_GENERATION_WORKERS', '2'))
+
+# 生成失败时的最多尝试次数及重试间隔
+MAX_ATTEMPTS = 3
+RETRY_DELAY_SECONDS = 5
+
+# 任务租约（秒）：排队或开始执行时获得，超过租约仍未结束的任务视为进程已退出，可由其他工作线程重新执行。
+# 应大于生成服务单次调用的最长耗时
+JOB_LEASE_SECONDS = int(os.environ.get('TAPIR_GENERATION_LEASE_SECONDS', '300'))
+
+# 检查租约过期任务的间隔（秒）
+REQUEUE_INTERVAL_SECONDS = 60
+
+# 每个用户同时排队中的任务数上限
+MAX_PENDING_JOBS_PER_USER = 10
+
+# 已结束的任务保留天数
+JOB_RETENTION_DAYS = 7
+
+_queue = queue.Queue()
+_workers_started = False
+_workers_guard = threading.Lock()
+
+# 由应用提供的数据访问函数（见 configure）
+_hooks = {}
+
+generation_bp = Blueprint('generation', __name__)
+
+
+class GenerationError(Exception):
+    """生成服务调用失败（可重试）"""
+
+
+class GenerationProvider:
+    """生成服务接口：根据梦境生成一段文本"""
+
+    name = None
+
+    def generate(self, kind, dream, style):
+        raise NotImplementedError
+
+
+class StubProvider(GenerationProvider):
+    """本地占位实现：不访问网络，按梦境内容生成固定格式的文本，用于开发和测试"""
+
+    name = 'stub'
+
+    LABELS = {DOC_INTERPRETATION: '解梦', DOC_CONTINUATION: '续写', DOC_PREDICTION: '预测'}
+
+    def generate(self, kind, dream, style):
+        excerpt = (dream.get('content') or '')[:50]
+        prefix = f"[{style}] " if style else ''
+        return f"{prefix}{self.LABELS[kind]}：关于「{dream.get('title') or ''}」—— {excerpt}"
+
+
+# 生成服务名称 -> 实现类，通过 TAPIR_GENERATION_PROVIDER 选择
+_providers = {StubProvider.name: StubProvider}
+_provider = None
+
+def register_provider(provider_class):
+    _providers[provider_class.name] = provider_class
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        name = os.environ.get('TAPIR_GENERATION_PROVIDER', StubProvider.name)
+        _provider = _providers[name]()
+    return _provider
+
+def set_provider(provider):
+    global _provider
+    _provider = provider
+
+
+def configure(load_dream, load_results, save_result):
+    """
+    注册应用的数据访问函数：
+    load_dream(dream_id, user_id=None) 返回梦境或 None，指定 user_id 时只返回该用户可见的梦境；
+    load_results(kind, dream_id, style=None) 返回该梦境（包括内容相同的梦境）已有的衍生内容；
+    save_result(kind, dream_id, style, content) 保存生成结果并返回新记录
+    """
+    _hooks.update(load_dream=load_dream, load_results=load_results, save_result=save_result)
+
+
+def job_key(kind, fingerprint, style):
+    return (kind, fingerprint, style or None)
+
+def _result_exists(job):
+    return any(item.get('id') == job.get('result_id')
+               for item in _hooks['load_results'](job['kind'], job['dream_id']))
+
+def _is_expired(job, cutoff):
+    return job.get('status') in (STATUS_DONE, STATUS_FAILED) and (job.get('completed_at') or '') < cutoff
+
+# 排队或执行中的任务租约是否已过期；旧版本的任务没有租约，视为已过期
+def _lease_expired(job, now):
+    return job.get('status') in (STATUS_PENDING, STATUS_RUNNING) and \
+        (job.get('lease_expires_at') or '') < now.isoformat()
+
+def _lease_until(now, delay=0):
+    return (now + datetime.timedelta(seconds=delay + JOB_LEASE_SECONDS)).isoformat()
+
+# 把任务改回排队状态并获得新的排队租约（调用方持有任务文件锁，之后把任务放入队列）
+def _requeue(job, now):
+    job.update(status=STATUS_PENDING, lease_id=None, lease_expires_at=_lease_until(now))
+
+def _new_job(kind, dream, key, user_id, now):
+    return {
+        'id': str(uuid.uuid4()),
+        'kind': kind,
+        'dream_id': dream.get('id'),
+        'fingerprint': key[1],
+        'style': key[2],
+        'status': STATUS_PENDING,
+        'user_ids': [user_id],
+        'attempts': 0,
+        'result_id': None,
+        'error': None,
+        'lease_id': None,
+        'lease_expires_at': _lease_until(now),
+        'created_at': now.isoformat(),
+        'completed_at': None
+    }
+
+# 查找可复用的任务（进行中，或已完成且结果仍在），否则创建新任务；返回 (任务, 是否新建, 错误信息)
+# 进行中的任务租约已过期时重新排队后复用；
+# 内容相同的梦境已有同一风格的结果时，直接返回一个已完成的任务而不调用生成服务；
+# bypass_cache 为真时不复用已有结果，总是重新生成（仍与进行中的相同任务合并）
+def find_or_create_job(kind, dream, style, user_id, bypass_cache=False):
+    key = job_key(kind, dream_fingerprint(dream.get('title'), dream.get('content')), style)
+    now = datetime.datetime.now()
+    cutoff = (now - datetime.timedelta(days=JOB_RETENTION_DAYS)).isoformat()
+    requeued, created, existing = False, False, []
+    with file_lock(GENERATION_JOBS_FILE):
+        jobs = [job for job in read_data(GENERATION_JOBS_FILE) if not _is_expired(job, cutoff)]
+        job = next((job for job in reversed(jobs)
+                    if job_key(job['kind'], job['fingerprint'], job.get('style')) == key and (
+                        job['status'] in (STATUS_PENDING, STATUS_RUNNING) or
+                        job['status'] == STATUS_DONE and not bypass_cache and _result_exists(job))), None)
+        if job is not None:
+            requeued = _lease_expired(job, now)
+            if requeued:
+                _requeue(job, now)
+            if requeued or user_id not in job['user_ids']:
+                if user_id not in job['user_ids']:
+                    job['user_ids'].append(user_id)
+                write_data(GENERATION_JOBS_FILE, jobs)
+        else:
+            job = _new_job(kind, dream, key, user_id, now)
+            existing = [] if bypass_cache else _hooks['load_results'](kind, dream.get('id'), style=key[2])
+            if existing:
+                job.update(status=STATUS_DONE, result_id=existing[-1].get('id'), lease_expires_at=None,
+                           completed_at=now.isoformat())
+            else:
+                pending = sum(1 for j in jobs if j['status'] == STATUS_PENDING and j['user_ids'][0] == user_id)
+                if pending >= MAX_PENDING_JOBS_PER_USER:
+                    return None, False, '排队中的生成任务过多，请稍后再试'
+            jobs.append(job)
+            write_data(GENERATION_JOBS_FILE, jobs)
+            created = not existing
+    if created or requeued:
+        _queue.put(job['id'])
+    GENERATION_JOBS.inc((kind, 'created' if created else 'memoized' if existing else 'deduplicated'))
+    return job, created, None
+
+def get_job(job_id):
+    return next((job for job in read_data(GENERATION_JOBS_FILE) if job.get('id') == job_id), None)
+
+# 领取任务：排队中或租约已过期的任务改为执行中并获得新的执行租约；
+# 返回任务，已被其他工作线程领取或已结束时返回 None
+def _claim_job(job_id):
+    now = datetime.datetime.now()
+    with file_lock(GENERATION_JOBS_FILE):
+        jobs = read_data(GENERATION_JOBS_FILE)
+        job = next((job for job in jobs if job.get('id') == job_id), None)
+        if job is None or job.get('status') != STATUS_PENDING and not _lease_expired(job, now):
+            return None
+        job.update(status=STATUS_RUNNING, lease_id=str(uuid.uuid4()), lease_expires_at=_lease_until(now))
+        write_data(GENERATION_JOBS_FILE, jobs)
+    return job
+
+def _holds_lease(job_id, lease_id):
+    job = get_job(job_id)
+    return job is not None and job.get('status') == STATUS_RUNNING and job.get('lease_id') == lease_id
+
+# 修改任务，只在任务仍由该执行租约持有时修改（租约过期后任务可能已被其他工作线程领取），返回修改后的任务或 None
+def _update_job(job_id, changes, lease_id):
+    with file_lock(GENERATION_JOBS_FILE):
+        jobs = read_data(GENERATION_JOBS_FILE)
+        job = next((job for job in jobs if job.get('id') == job_id), None)
+        if job is None or job.get('status') != STATUS_RUNNING or job.get('lease_id') != lease_id:
+            return None
+        job.update(changes)
+        write_data(GENERATION_JOBS_FILE, jobs)
+    return job
+
+# 结束领取到的任务：释放租约并记录结束时间
+def _finish_job(job, status, **changes):
+    changes.update(status=status, lease_id=None, lease_expires_at=None,
+                   completed_at=datetime.datetime.now().isoformat())
+    if _update_job(job['id'], changes, job['lease_id']) is not None:
+        GENERATION_JOBS.inc((job['kind'], status))
+
+def run_job(job_id):
+    """执行一个生成任务：调用生成服务并写入结果，失败时延迟重试"""
+    job = _claim_job(job_id)
+    if job is None:
+        return
+    dream = _hooks['load_dream'](job['dream_id'])
+    if dream is None:
+        _finish_job(job, STATUS_FAILED, error='梦境不存在')
+        return
+    try:
+        content = get_provider().generate(job['kind'], dream, job.get('style'))
+    except Exception as e:
+        attempts = job['attempts'] + 1
+        logger.error(f"生成任务 {job_id} 第{attempts}次失败: {str(e)}")
+        if attempts < MAX_ATTEMPTS:
+            delay = RETRY_DELAY_SECONDS * attempts
+            # 重新排队，排队租约从重试时开始计算
+            if _update_job(job_id, {'status': STATUS_PENDING, 'attempts': attempts, 'error': str(e), 'lease_id': None,
+                                    'lease_expires_at': _lease_until(datetime.datetime.now(), delay)}, job['lease_id']):
+                timer = threading.Timer(delay, _queue.put, args=(job_id,))
+                timer.daemon = True
+                timer.start()
+        else:
+            _finish_job(job, STATUS_FAILED, attempts=attempts, error=str(e))
+        return
+    # 租约已过期、任务已由其他工作线程重新执行时不再保存结果
+    if not _holds_lease(job_id, job['lease_id']):
+        logger.warning(f"生成任务 {job_id} 的租约已过期，丢弃本次结果")
+        return
+    item = _hooks['save_result'](job['kind'], job['dream_id'], job.get('style'), content)
+    _finish_job(job, STATUS_DONE, attempts=job['attempts'] + 1, result_id=item['id'], error=None)
+
+
+# 生成工作线程：从队列中取任务执行，线程数即同时调用生成服务的上限
+def generation_worker():
+    while True:
+        job_id = _queue.get()
+        try:
+            run_job(job_id)
+        except Exception as e:
+            logger.error(f"生成任务 {job_id} 执行出错: {str(e)}")
+
+def start_generation_workers():
+    global _workers_started
+    with _workers_guard:
+        if _workers_started:
+            return
+        _workers_started = True
+    for _ in range(GENERATION_WORKERS):
+        threading.Thread(target=generation_worker, daemon=True).start()
+
+def requeue_jobs(include_pending=False):
+    """
+    重新排队租约已过期的任务（排队或执行它的进程已退出），租约未过期的执行中任务可能仍由其他进程执行，不受影响。
+    include_pending 为真时（启动时，本进程之前排队的任务已丢失）同时把排队中的任务放入队列，
+    重复放入的任务只会被领取一次。返回重新排队的任务数
+    """
+    now = datetime.datetime.now()
+    with file_lock(GENERATION_JOBS_FILE):
+        jobs = read_data(GENERATION_JOBS_FILE)
+        expired = [job for job in jobs if _lease_expired(job, now)]
+        for job in expired:
+            _requeue(job, now)
+        if expired:
+            write_data(GENERATION_JOBS_FILE, jobs)
+    queued = [job for job in jobs if job in expired or include_pending and job.get('status') == STATUS_PENDING]
+    for job in queued:
+        _queue.put(job['id'])
+    if expired:
+        logger.info(f"重新排队 {len(expired)} 个租约已过期的生成任务")
+    return len(expired)
+
+# 定期重新排队租约已过期的任务（只在负责定时任务的进程中运行，启动时先恢复上次未完成的任务）
+def schedule_job_requeue():
+    include_pending = True
+    while True:
+        try:
+            requeue_jobs(include_pending)
+            include_pending = False
+        except Exception as e:
+            logger.error(f"重新排队生成任务失败: {str(e)}")
+        time.sleep(REQUEUE_INTERVAL_SECONDS)
+
+
+# 任务及其结果（已完成时）
+def _job_response(job):
+    result = None
+    if job['status'] == STATUS_DONE:
+        result = next((item for item in _hooks['load_results'](job['kind'], job['dream_id'])
+                       if item.get('id') == job['result_id']), None)
+    fields = ('id', 'kind', 'dream_id', 'style', 'status', 'attempts', 'error', 'created_at', 'completed_at')
+    return dict({key: job.get(key) for key in fields}, result=result)
+
+# 创建生成任务
+@generation_bp.route('', methods=['POST'])
+@login_required
+def create_generation_job():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "无效的请求数据"}), 400
+    kind = data.get('kind')
+    if kind not in KINDS:
+        return jsonify({"error": f"不支持的生成类型，可选: {', '.join(KINDS)}"}), 400
+    style = data.get('style') if kind in STYLED_KINDS else None
+    if kind in STYLED_KINDS and (not isinstance(style, str) or not style.strip()):
+        return jsonify({"error": "缺少必填字段: style"}), 400
+
+    # 个人梦境只有本人、空间梦境只有空间成员可以提交生成任务
+    dream = _hooks['load_dream'](data.get('dream_id'), g.user_id)
+    if dream is None:
+        return jsonify({"error": "梦境不存在"}), 404
+
+    job, created, error = find_or_create_job(kind, dream, style.strip() if style else None, g.user_id,
+                                             bypass_cache=data.get('bypass_cache') is True)
+    if error:
+        return jsonify({"error": error}), 429
+    return jsonify(_job_response(job)), 200 if job['status'] == STATUS_DONE else 202
+
+# 查询生成任务（只有提交过该任务的用户可以查询）
+@generation_bp.route('/<job_id>', methods=['GET'])
+@login_required
+def get_generation_job(job_id):
+    job = get_job(job_id)
+    if job is None or g.user_id not in job.get('user_ids', []):
+        return jsonify({"error": "生成任务不存在"}), 404
+    return jsonify(_job_response(job))
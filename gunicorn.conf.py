@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import os
+
+# gunicorn 多进程部署配置
+# 运行: gunicorn -c gunicorn.conf.py asgi:application
+
+bind = f"{os.environ.get('TAPIR_HOST', '0.0.0.0')}:{os.environ.get('TAPIR_PORT', '8081')}"
+workers = int(os.environ.get('TAPIR_WORKERS', str(multiprocessing.cpu_count())))
+worker_class = 'uvicorn.workers.UvicornWorker'
+loglevel = os.environ.get('TAPIR_LOG_LEVEL', 'info')
+
+# 每个工作进程各自导入应用（各自的内存索引、清理线程和监控指标）
+preload_app = False
+
+
+# 在主进程中一次性初始化数据文件
+def on_starting(server):
+    from storage import init_storage
+    init_storage()
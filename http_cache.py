@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from flask import request, g, make_response, current_app
+from functools import wraps
+import hashlib
+
+from metrics import record_cache
+from storage import file_signature, shard_file
+
+# 条件请求（ETag / If-None-Match）
+# 列表接口的弱ETag由相关集合的版本（写入时递增的代数及文件修改时间、大小；空间接口为该空间的分片）、当前用户和请求路径计算，
+# 客户端带回的ETag未变化时直接返回304，不读取也不序列化数据
+
+
+def compute_etag(file_paths, vary=None):
+    parts = [request.full_path, getattr(g, 'user_id', None)]
+    # 空间接口（路径或参数中的 space_id）只依赖该空间的分片，其他空间的写入不会使其失效
+    space_id = (request.view_args or {}).get('space_id') or request.args.get('space_id')
+    parts.extend(file_signature(shard_file(file_path, space_id)) for file_path in file_paths)
+    if vary:
+        parts.append(vary())
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:24]
+
+def conditional(*file_paths, vary=None):
+    """
+    为GET接口添加弱ETag，数据文件未变化时返回304。
+    必须放在登录/成员权限装饰器之后；vary 为返回附加因素（例如当天日期）的函数。
+    ETag在读取数据之前计算，读取期间发生写入时ETag只会偏旧，不会导致客户端保留过期数据。
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            etag = compute_etag(file_paths, vary)
+            if request.if_none_match.contains_weak(etag):
+                record_cache('etag', True)
+                response = current_app.response_class(status=304)
+            else:
+                record_cache('etag', False)
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            # 允许客户端缓存，但每次使用前都要重新验证
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import logging
+import os
+import threading
+import time
+import uuid
+
+# 请求级性能监控
+# 记录每个路由的延迟直方图、数据文件读写耗时与字节数、索引缓存命中率，
+# 通过 /metrics 以 Prometheus 文本格式输出；可按请求头开启 cProfile 采样
+
+logger = logging.getLogger('tapir_twins')
+
+# 延迟直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 按请求开启性能分析的请求头，仅在设置了环境变量 TAPIR_PROFILING=1 时生效
+PROFILE_HEADER = 'X-Profile'
+PROFILE_TOP_N = 30
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, labels, extra=None):
+    pairs = [(name, value) for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """单调递增计数器"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, labels=()):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}')
+        return lines
+
+
+class Gauge:
+    """可增可减的当前值"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+    def get(self, labels=()):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}')
+        return lines
+
+
+class Histogram:
+    """累积分桶直方图"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    # 返回 (总和, 次数)
+    def get(self, labels=()):
+        with self._lock:
+            state = self._values.get(labels)
+            return (state['sum'], state['count']) if state else (0.0, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state['buckets']):
+                    cumulative += count
+                    le = ('le', _format_number(bound))
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+                label_text = _format_labels(self.labelnames, labels)
+                lines.append(f'{self.name}_sum{label_text} {_format_number(state["sum"])}')
+                lines.append(f'{self.name}_count{label_text} {state["count"]}')
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    'tapir_http_request_duration_seconds', '每个路由的请求处理耗时', ('method', 'route', 'status'))
+STORAGE_LATENCY = Histogram(
+    'tapir_storage_operation_duration_seconds', '数据文件读写耗时', ('operation', 'collection'))
+STORAGE_BYTES = Counter(
+    'tapir_storage_bytes_total', '数据文件读写字节数', ('operation', 'collection'))
+CACHE_REQUESTS = Counter(
+    'tapir_cache_requests_total', '内存索引访问次数（hit为直接命中，miss为重建）', ('cache', 'result'))
+CACHE_BYTES = Gauge(
+    'tapir_cache_bytes', '有内存上限的缓存当前占用的字节数', ('cache',))
+CACHE_EVICTIONS = Counter(
+    'tapir_cache_evictions_total', '因超出内存上限而淘汰的缓存条目数', ('cache',))
+GENERATION_JOBS = Counter(
+    'tapir_generation_jobs_total', '生成任务数（created/deduplicated/memoized/done/failed）', ('kind', 'result'))
+COMPRESSION_LATENCY = Histogram(
+    'tapir_compression_duration_seconds', '响应压缩耗时', ('encoding',))
+COMPRESSION_BYTES = Counter(
+    'tapir_compression_bytes_total', '压缩前后的响应字节数', ('encoding', 'stage'))
+
+REGISTRY = [REQUEST_LATENCY, STORAGE_LATENCY, STORAGE_BYTES, CACHE_REQUESTS, CACHE_BYTES, CACHE_EVICTIONS,
+            GENERATION_JOBS, COMPRESSION_LATENCY, COMPRESSION_BYTES]
+
+
+# 记录一次数据文件读写
+def observe_storage(operation, collection, seconds, nbytes):
+    STORAGE_LATENCY.observe((operation, collection), seconds)
+    STORAGE_BYTES.inc((operation, collection), nbytes)
+
+# 记录一次响应压缩（命中压缩缓存时 seconds 为 None）
+def observe_compression(encoding, seconds, original_bytes, compressed_bytes):
+    if seconds is not None:
+        COMPRESSION_LATENCY.observe((encoding,), seconds)
+    COMPRESSION_BYTES.inc((encoding, 'original'), original_bytes)
+    COMPRESSION_BYTES.inc((encoding, 'compressed'), compressed_bytes)
+
+# 记录一次索引缓存访问
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc((cache, 'hit' if hit else 'miss'))
+
+# 计算缓存命中率，没有访问记录时返回None
+def cache_hit_ratio(cache):
+    hits = CACHE_REQUESTS.get((cache, 'hit'))
+    total = hits + CACHE_REQUESTS.get((cache, 'miss'))
+    return hits / total if total else None
+
+# 输出 Prometheus 文本格式
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    caches = sorted({labels[0] for labels in CACHE_REQUESTS._values})
+    if caches:
+        lines.append('# HELP tapir_cache_hit_ratio 内存索引命中率')
+        lines.append('# TYPE tapir_cache_hit_ratio gauge')
+        for cache in caches:
+            lines.append(f'tapir_cache_hit_ratio{{cache="{_escape(cache)}"}} {_format_number(cache_hit_ratio(cache))}')
+    return '\n'.join(lines) + '\n'
+
+
+def profiling_enabled():
+    return os.environ.get('TAPIR_PROFILING') == '1'
+
+def init_app(app, profile_dir=None):
+    """为Flask应用注册监控中间件和 /metrics 端点"""
+    from flask import request, g, Response
+
+    @app.before_request
+    def _start_request_timer():
+        g.request_started_at = time.perf_counter()
+        if profiling_enabled() and request.headers.get(PROFILE_HEADER):
+            import cProfile  # 只在开启性能分析时导入
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def _record_request(response):
+        started_at = g.pop('request_started_at', None)
+        if started_at is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            REQUEST_LATENCY.observe((request.method, route, str(response.status_code)),
+                                    time.perf_counter() - started_at)
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            profile_id = _save_profile(profiler, profile_dir)
+            response.headers['X-Profile-Id'] = profile_id
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def _save_profile(profiler, profile_dir):
+    import pstats
+    profile_id = str(uuid.uuid4())
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream).sort_stats('cumulative')
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        stats.dump_stats(os.path.join(profile_dir, f'{profile_id}.prof'))
+    stats.print_stats(PROFILE_TOP_N)
+    logger.info(f"请求性能分析 {profile_id}:\n{stream.getvalue()}")
+    return profile_id
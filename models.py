@@ -2,36 +2,137 @@
 # -*- coding: utf-8 -*-
 
 # 数据模型定义
+# 模型使用 __slots__ 存储字段，比同样内容的字典占用更少的内存；from_dict/to_dict/to_storage_dict 在定义类时按字段列表生成。
+# 数据文件中缺失的字段保持缺失（值为 MISSING，输出时跳过），未在模型中声明的字段原样保存在 _extra 中，
+# 因此 Model.from_dict(d).to_storage_dict() 与 d 内容一致（键的顺序可能不同）。
+# PRIVATE 中的字段（例如密码哈希）只在写入数据文件的 to_storage_dict 中输出，to_dict 不输出
+
+
+class _Missing:
+    """字段在数据中不存在的标记"""
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return 'MISSING'
+
+MISSING = _Missing()
+
+# 构造函数中必须传入的字段
+REQUIRED = object()
+
+
+class ModelMeta(type):
+    """根据 FIELDS 为模型生成 __slots__、__init__、from_dict、to_dict 和 to_storage_dict"""
+
+    def __new__(mcs, name, bases, namespace):
+        fields = namespace.get('FIELDS')
+        if fields is None:
+            return super().__new__(mcs, name, bases, namespace)
+        namespace['__slots__'] = tuple(field for field, _ in fields)
+        cls = super().__new__(mcs, name, bases, namespace)
+        cls.FIELD_NAMES = frozenset(field for field, _ in fields)
+        _generate_methods(cls, fields, namespace.get('NESTED', {}), frozenset(namespace.get('PRIVATE', ())))
+        return cls
+
+
+def _generate_methods(cls, fields, nested, private):
+    scope = {'MISSING': MISSING, 'cls': cls, 'FIELD_NAMES': cls.FIELD_NAMES}
+    for field, model in nested.items():
+        scope[f'_nested_{field}'] = model
+
+    # __init__：参数顺序与 FIELDS 一致，列表类型的默认值每次新建
+    params = []
+    body = []
+    for field, default in fields:
+        if default is REQUIRED:
+            params.append(field)
+            body.append(f'    self.{field} = {field}')
+        elif isinstance(default, list):
+            params.append(f'{field}=None')
+            body.append(f'    self.{field} = [] if {field} is None else {field}')
+        else:
+            scope[f'_default_{field}'] = default
+            params.append(f'{field}=_default_{field}')
+            body.append(f'    self.{field} = {field}')
+    body.append('    self._extra = None')
+    source = [f"def __init__(self, {', '.join(params)}):"] + body
+
+    # from_dict：一次 dict.get 读取每个字段，只有存在未声明的键时才构造 _extra
+    source.append('def from_dict(data):')
+    source.append('    self = cls.__new__(cls)')
+    source.append('    get = data.get')
+    for field, _ in fields:
+        if field in nested:
+            source.append(f'    value = get({field!r}, MISSING)')
+            source.append(f'    self.{field} = [_nested_{field}.from_dict(item) for item in value] '
+                          f'if isinstance(value, list) else value')
+        else:
+            source.append(f'    self.{field} = get({field!r}, MISSING)')
+    source.append('    self._extra = None if data.keys() <= FIELD_NAMES else '
+                  '{key: value for key, value in data.items() if key not in FIELD_NAMES}')
+    source.append('    return self')
+
+    # to_storage_dict / to_dict：跳过缺失的字段，最后合并未声明的字段；to_dict 另外跳过私有字段
+    for method, skipped in (('to_storage_dict', ()), ('to_dict', private)):
+        source.append(f'def {method}(self):')
+        source.append('    data = {}')
+        for field, _ in fields:
+            if field in skipped:
+                continue
+            source.append(f'    value = self.{field}')
+            if field in nested:
+                source.append(f'    if value is not MISSING: data[{field!r}] = '
+                              f'[item.{method}() for item in value] if isinstance(value, list) else value')
+            else:
+                source.append(f'    if value is not MISSING: data[{field!r}] = value')
+        source.append('    if self._extra: data.update(self._extra)')
+        source.append('    return data')
+
+    exec('\n'.join(source), scope)
+    cls.__init__ = scope['__init__']
+    cls.from_dict = staticmethod(scope['from_dict'])
+    cls.to_dict = scope['to_dict']
+    cls.to_storage_dict = scope['to_storage_dict']
+
+
+class Model(metaclass=ModelMeta):
+    """
+    模型基类，子类通过 FIELDS 声明 (字段名, 默认值)，NESTED 声明嵌套模型列表字段，
+    PRIVATE 声明不对外输出（to_dict 中不包含）的字段
+    """
+    __slots__ = ('_extra',)
+
+    # 与字典相同的读取方式，便于同时处理模型和原始字典
+    def get(self, key, default=None):
+        if key in self.FIELD_NAMES:
+            value = getattr(self, key)
+            return default if value is MISSING else value
+        if self._extra:
+            return self._extra.get(key, default)
+        return default
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_storage_dict() == other.to_storage_dict()
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
 
 # 用户模型
-class User:
-    def __init__(self, id, username, password_hash, email, created_at, updated_at):
-        self.id = id
-        self.username = username
-        self.password_hash = password_hash
-        self.email = email
-        self.created_at = created_at
-        self.updated_at = updated_at
-    
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'username': self.username,
-            'email': self.email,
-            'created_at': self.created_at,
-            'updated_at': self.updated_at
-        }
-    
-    @staticmethod
-    def from_dict(data):
-        return User(
-            id=data.get('id'),
-            username=data.get('username'),
-            password_hash=data.get('password_hash'),
-            email=data.get('email'),
-            created_at=data.get('created_at'),
-            updated_at=data.get('updated_at')
-        )
+class User(Model):
+    FIELDS = (
+        ('id', REQUIRED),
+        ('username', REQUIRED),
+        ('password_hash', REQUIRED),
+        ('email', REQUIRED),
+        ('created_at', REQUIRED),
+        ('updated_at', REQUIRED)
+    )
+    # 对外返回的用户信息不含密码哈希
+    PRIVATE = ('password_hash',)
 
 # 空间成员角色枚举
 class MemberRole:
@@ -40,196 +141,81 @@ class MemberRole:
     ADMIN = "admin"          # 管理员（创建者）
 
 # 空间成员模型
-class SpaceMember:
-    def __init__(self, user_id, role):
-        self.user_id = user_id
-        self.role = role
-    
-    def to_dict(self):
-        return {
-            'user_id': self.user_id,
-            'role': self.role
-        }
-    
-    @staticmethod
-    def from_dict(data):
-        return SpaceMember(
-            user_id=data.get('user_id'),
-            role=data.get('role')
-        )
+class SpaceMember(Model):
+    FIELDS = (
+        ('user_id', REQUIRED),
+        ('role', REQUIRED)
+    )
 
 # 空间模型
-class Space:
-    def __init__(self, id, name, description, creator_id, members, created_at, updated_at, invite_code=None):
-        self.id = id
-        self.name = name
-        self.description = description
-        self.creator_id = creator_id
-        self.members = members  # 成员列表，包含用户ID和角色（打卡者/审批者）
-        self.created_at = created_at
-        self.updated_at = updated_at
-        self.invite_code = invite_code  # 邀请码
-    
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'description': self.description,
-            'creator_id': self.creator_id,
-            'members': [member.to_dict() for member in self.members],
-            'created_at': self.created_at,
-            'updated_at': self.updated_at,
-            'invite_code': self.invite_code
-        }
-    
-    @staticmethod
-    def from_dict(data):
-        return Space(
-            id=data.get('id'),
-            name=data.get('name'),
-            description=data.get('description'),
-            creator_id=data.get('creator_id'),
-            members=[SpaceMember.from_dict(member) for member in data.get('members', [])],
-            created_at=data.get('created_at'),
-            updated_at=data.get('updated_at'),
-            invite_code=data.get('invite_code')
-        )
+class Space(Model):
+    FIELDS = (
+        ('id', REQUIRED),
+        ('name', REQUIRED),
+        ('description', REQUIRED),
+        ('creator_id', REQUIRED),
+        ('members', REQUIRED),  # 成员列表，包含用户ID和角色（打卡者/审批者）
+        ('created_at', REQUIRED),
+        ('updated_at', REQUIRED),
+        ('invite_code', None),  # 邀请码
+        ('timezone', MISSING)  # 空间的时区（IANA名称），未设置时使用默认时区
+    )
+    NESTED = {'members': SpaceMember}
 
 # 扩展任务模型
-class Task:
-    def __init__(self, id, space_id, title, description, due_date, created_at, updated_at, 
-                 completed_today, required_images, status="pending", submitter_id=None, 
-                 approver_id=None, missed_dates=None):
-        self.id = id
-        self.space_id = space_id
-        self.title = title
-        self.description = description
-        self.due_date = due_date
-        self.created_at = created_at
-        self.updated_at = updated_at
-        self.completed_today = completed_today
-        self.required_images = required_images
-        self.status = status  # pending, submitted, approved, rejected
-        self.submitter_id = submitter_id  # 打卡者ID
-        self.approver_id = approver_id    # 审批者ID
-        self.missed_dates = missed_dates or []  # 缺卡日期列表
-    
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'space_id': self.space_id,
-            'title': self.title,
-            'description': self.description,
-            'due_date': self.due_date,
-            'created_at': self.created_at,
-            'updated_at': self.updated_at,
-            'completed_today': self.completed_today,
-            'required_images': self.required_images,
-            'status': self.status,
-            'submitter_id': self.submitter_id,
-            'approver_id': self.approver_id,
-            'missed_dates': self.missed_dates
-        }
-    
-    @staticmethod
-    def from_dict(data):
-        return Task(
-            id=data.get('id'),
-            space_id=data.get('space_id'),
-            title=data.get('title'),
-            description=data.get('description'),
-            due_date=data.get('due_date'),
-            created_at=data.get('created_at'),
-            updated_at=data.get('updated_at'),
-            completed_today=data.get('completed_today', False),
-            required_images=data.get('required_images', 0),
-            status=data.get('status', 'pending'),
-            submitter_id=data.get('submitter_id'),
-            approver_id=data.get('approver_id'),
-            missed_dates=data.get('missed_dates', [])
-        )
+class Task(Model):
+    FIELDS = (
+        ('id', REQUIRED),
+        ('space_id', REQUIRED),
+        ('title', REQUIRED),
+        ('description', REQUIRED),
+        ('due_date', REQUIRED),
+        ('created_at', REQUIRED),
+        ('updated_at', REQUIRED),
+        ('completed_today', REQUIRED),
+        ('required_images', REQUIRED),
+        ('status', 'pending'),  # pending, submitted, approved, rejected
+        ('submitter_id', None),  # 打卡者ID
+        ('approver_id', None),  # 审批者ID
+        ('missed_dates', []),  # 缺卡日期列表
+        ('assigned_submitter_id', MISSING),
+        ('assigned_submitter_name', MISSING),
+        ('assigned_approver_ids', MISSING),
+        ('assigned_approver_names', MISSING)
+    )
 
 # 扩展任务记录模型
-class TaskRecord:
-    def __init__(self, id, task_id, date, created_at, images, submitter_id, 
-                 status="submitted", approver_id=None, approved_at=None, 
-                 rejection_reason=None, space_id=None):
-        self.id = id
-        self.task_id = task_id
-        self.date = date
-        self.created_at = created_at
-        self.images = images
-        self.submitter_id = submitter_id
-        self.status = status  # submitted, approved, rejected
-        self.approver_id = approver_id
-        self.approved_at = approved_at
-        self.rejection_reason = rejection_reason
-        self.space_id = space_id
-    
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'task_id': self.task_id,
-            'date': self.date,
-            'created_at': self.created_at,
-            'images': self.images,
-            'submitter_id': self.submitter_id,
-            'status': self.status,
-            'approver_id': self.approver_id,
-            'approved_at': self.approved_at,
-            'rejection_reason': self.rejection_reason,
-            'space_id': self.space_id
-        }
-    
-    @staticmethod
-    def from_dict(data):
-        return TaskRecord(
-            id=data.get('id'),
-            task_id=data.get('task_id'),
-            date=data.get('date'),
-            created_at=data.get('created_at'),
-            images=data.get('images', []),
-            submitter_id=data.get('submitter_id'),
-            status=data.get('status', 'submitted'),
-            approver_id=data.get('approver_id'),
-            approved_at=data.get('approved_at'),
-            rejection_reason=data.get('rejection_reason'),
-            space_id=data.get('space_id')
-        )
+class TaskRecord(Model):
+    FIELDS = (
+        ('id', REQUIRED),
+        ('task_id', REQUIRED),
+        ('date', REQUIRED),
+        ('created_at', REQUIRED),
+        ('images', REQUIRED),
+        ('submitter_id', REQUIRED),
+        ('status', 'submitted'),  # submitted, approved, rejected
+        ('approver_id', None),
+        ('approved_at', None),
+        ('rejection_reason', None),
+        ('space_id', None),
+        ('submitter_name', MISSING),
+        ('approver_name', MISSING),
+        ('approval_comment', MISSING),
+        ('assigned_approver_ids', MISSING),
+        ('assigned_approver_names', MISSING),
+        ('updated_at', MISSING)
+    )
 
 # 梦境模型扩展
-class Dream:
-    def __init__(self, id, title, content, date, created_at, updated_at=None, space_id=None, user_id=None):
-        self.id = id
-        self.title = title
-        self.content = content
-        self.date = date
-        self.created_at = created_at
-        self.updated_at = updated_at
-        self.space_id = space_id  # 新增：空间ID
-        self.user_id = user_id    # 新增：用户ID
-    
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'title': self.title,
-            'content': self.content,
-            'date': self.date,
-            'created_at': self.created_at,
-            'updated_at': self.updated_at,
-            'space_id': self.space_id,
-            'user_id': self.user_id
-        }
-    
-    @staticmethod
-    def from_dict(data):
-        return Dream(
-            id=data.get('id'),
-            title=data.get('title'),
-            content=data.get('content'),
-            date=data.get('date'),
-            created_at=data.get('created_at'),
-            updated_at=data.get('updated_at'),
-            space_id=data.get('space_id'),
-            user_id=data.get('user_id')
-        )
+class Dream(Model):
+    FIELDS = (
+        ('id', REQUIRED),
+        ('title', REQUIRED),
+        ('content', REQUIRED),
+        ('date', REQUIRED),
+        ('created_at', REQUIRED),
+        ('updated_at', None),
+        ('space_id', None),  # 空间ID
+        ('user_id', None),  # 用户ID
+        ('username', MISSING)  # 空间梦境的作者用户名
+    )
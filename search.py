@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import math
+import re
+import threading
+
+from dream_index import normalize_text
+from metrics import record_cache
+from storage import file_signature, synced_signature
+
+# 梦境全文检索
+# 倒排索引覆盖梦境标题/内容以及解梦、续写、预测文本，中文按字符二元组切分
+# 索引只保存词项权重和文档的归属信息，不保存正文；衍生内容记录在数据文件中的位置，摘要由调用方按位置读取正文生成
+
+# 文档类型
+DOC_DREAM = 'dream'
+DOC_INTERPRETATION = 'interpretation'
+DOC_CONTINUATION = 'continuation'
+DOC_PREDICTION = 'prediction'
+DOC_TYPES = (DOC_DREAM, DOC_INTERPRETATION, DOC_CONTINUATION, DOC_PREDICTION)
+
+# 标题命中的权重高于正文
+TITLE_WEIGHT = 2.0
+
+_CJK_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+_TOKEN_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[0-9a-z]+')
+
+
+# 分词：中文连续片段切分为二元组（单字保留原字），字母和数字按单词切分
+def tokenize(text):
+    tokens = []
+    for run in _TOKEN_RE.findall(normalize_text(text).lower()):
+        if _CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+# 生成检索摘要：截取第一个命中位置附近的文本
+def make_snippet(text, query, width=40):
+    text = text or ''
+    position = -1
+    for term in [query.strip()] + tokenize(query):
+        if term:
+            position = text.lower().find(term)
+            if position >= 0:
+                break
+    if position < 0:
+        return text[:width * 2]
+    start = max(0, position - width // 2)
+    end = min(len(text), start + width * 2)
+    return ('…' if start > 0 else '') + text[start:end] + ('…' if end < len(text) else '')
+
+
+class SearchIndex:
+    """梦境及其衍生内容的倒排索引，支持增量更新"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._signatures = {}
+        self._docs = {}
+        self._postings = {}
+        # 梦境ID -> 该ID下所有梦境文档，用于判断衍生内容的可见性
+        self._dream_docs = {}
+
+    # 如果任意数据文件在索引之外被修改，则从头重建索引
+    def ensure_fresh(self, sources):
+        """sources: {文档类型: (文件路径, 加载函数)}，加载函数返回 (记录, 在文件中的位置) 列表"""
+        with self._lock:
+            stale = any(file_signature(path) != self._signatures.get(path)
+                        for path, _ in sources.values())
+            record_cache('search', not stale)
+            if not stale:
+                return
+            self._docs = {}
+            self._postings = {}
+            self._dream_docs = {}
+            for doc_type, (path, loader) in sources.items():
+                for item, position in loader():
+                    self.add(doc_type, item, position)
+                self._signatures[path] = file_signature(path)
+
+    # 索引是否已经建立（首次检索时建立）
+    def is_built(self):
+        with self._lock:
+            return bool(self._signatures)
+
+    # 在写入一次数据文件并同步更新索引后记录新的文件签名
+    def mark_synced(self, file_path):
+        with self._lock:
+            self._signatures[file_path] = synced_signature(self._signatures.get(file_path), file_path)
+
+    @staticmethod
+    def doc_key(doc_type, item):
+        # 相同内容的梦境在不同用户之间共享ID，因此梦境文档需要带上归属信息
+        if doc_type == DOC_DREAM:
+            return (doc_type, item.get('id'), item.get('user_id'), item.get('space_id') or None)
+        return (doc_type, item.get('id'))
+
+    def add(self, doc_type, item, position=None):
+        """加入或替换一个文档；position 为衍生内容记录在数据文件中的 (偏移量, 长度)"""
+        key = self.doc_key(doc_type, item)
+        title = (item.get('title') or '') if doc_type == DOC_DREAM else ''
+        content = item.get('content') or ''
+        weights = {}
+        for token in tokenize(title):
+            weights[token] = weights.get(token, 0) + TITLE_WEIGHT
+        for token in tokenize(content):
+            weights[token] = weights.get(token, 0) + 1
+        with self._lock:
+            if key in self._docs:
+                self.remove(doc_type, item)
+            dream_id = item.get('id') if doc_type == DOC_DREAM else item.get('dream_id')
+            self._docs[key] = {
+                'type': doc_type,
+                'id': item.get('id'),
+                'dream_id': dream_id,
+                'user_id': item.get('user_id'),
+                'space_id': item.get('space_id') or None,
+                'title': title,
+                'position': position,
+                'created_at': item.get('created_at'),
+                'weights': weights,
+                'length': max(1, sum(weights.values()))
+            }
+            for token, weight in weights.items():
+                self._postings.setdefault(token, {})[key] = weight
+            if doc_type == DOC_DREAM:
+                self._dream_docs.setdefault(dream_id, set()).add(key)
+
+    def remove(self, doc_type, item):
+        key = self.doc_key(doc_type, item)
+        with self._lock:
+            doc = self._docs.pop(key, None)
+            if not doc:
+                return
+            for token in doc['weights']:
+                postings = self._postings.get(token)
+                if postings is not None:
+                    postings.pop(key, None)
+                    if not postings:
+                        del self._postings[token]
+            if doc_type == DOC_DREAM:
+                keys = self._dream_docs.get(doc['dream_id'])
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._dream_docs[doc['dream_id']]
+
+    def replace(self, doc_type, old_item, new_item):
+        with self._lock:
+            self.remove(doc_type, old_item)
+            self.add(doc_type, new_item)
+
+    # 查询词对应的索引词；单个汉字扩展为包含该字的所有二元组
+    def _expand(self, token):
+        if len(token) == 1 and _CJK_RE.match(token):
+            return [t for t in self._postings if token in t]
+        return [token]
+
+    def search(self, query, is_visible, doc_types=None, user_id=None, space_id=None):
+        """
+        返回按相关度排序的 (得分, 文档) 列表
+        is_visible: 判断梦境文档对当前用户是否可见的函数
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            total_docs = max(1, len(self._docs))
+            scores = None
+            # 所有查询词都必须命中（AND语义），按TF-IDF累加得分
+            for term in terms:
+                term_scores = {}
+                for token in self._expand(term):
+                    postings = self._postings.get(token, {})
+                    if not postings:
+                        continue
+                    idf = math.log(1 + total_docs / len(postings))
+                    for key, weight in postings.items():
+                        score = weight / math.sqrt(self._docs[key]['length']) * idf
+                        term_scores[key] = max(term_scores.get(key, 0), score)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {key: scores[key] + s for key, s in term_scores.items() if key in scores}
+                if not scores:
+                    return []
+
+            results = []
+            for key, score in scores.items():
+                doc = self._docs[key]
+                if doc_types and doc['type'] not in doc_types:
+                    continue
+                owners = [doc] if doc['type'] == DOC_DREAM else \
+                    [self._docs[k] for k in self._dream_docs.get(doc['dream_id'], ())]
+                owners = [o for o in owners if is_visible(o)]
+                if user_id:
+                    owners = [o for o in owners if o['user_id'] == user_id]
+                if space_id:
+                    owners = [o for o in owners if o['space_id'] == space_id]
+                if not owners:
+                    continue
+                results.append((score, doc, owners[0]))
+
+        results.sort(key=lambda r: (-r[0], r[1].get('created_at') or ''))
+        return results
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+
+import uvicorn
+
+from storage import init_storage
+
+# 生产环境入口：通过ASGI服务器（uvicorn）提供服务
+# 本地调试仍使用 python app.py 启动Flask调试服务器
+# 多进程部署：--workers N（或 gunicorn -c gunicorn.conf.py asgi:application），
+# 各进程通过数据文件锁协调写入，定时任务只在其中一个进程运行
+
+def main():
+    parser = argparse.ArgumentParser(description='TapirTwins 生产环境服务')
+    parser.add_argument('--host', default=os.environ.get('TAPIR_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('TAPIR_PORT', '8081')))
+    parser.add_argument('--log-level', default=os.environ.get('TAPIR_LOG_LEVEL', 'info'))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('TAPIR_WORKERS', '1')),
+                        help='工作进程数')
+    args = parser.parse_args()
+
+    # 在启动工作进程之前一次性初始化数据文件
+    init_storage()
+    uvicorn.run('asgi:application', host=args.host, port=args.port, log_level=args.log_level,
+                workers=args.workers, lifespan='on', proxy_headers=True)
+
+if __name__ == '__main__':
+    main()
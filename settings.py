@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import os
+import re
+import threading
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from metrics import record_cache
+from storage import SETTINGS_DIR, USER_SETTINGS_FILE, file_lock, file_signature, read_data, write_data
+
+# 用户设置
+# 按用户ID存取的键值存储：每个用户一个设置文件（data/settings/<user_id>.json），读写只涉及该用户自己的文件，
+# 不同用户的并发修改互不冲突。读取结果按文件签名缓存，文件未变化时不再读取。
+# 旧版本的 user_settings.json（所有用户的设置在一个字典中）只读，用户第一次修改设置时迁移到自己的文件
+
+# IANA时区名称是否有效（例如 Asia/Shanghai）
+def is_valid_timezone(name):
+    if not isinstance(name, str) or not name:
+        return False
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError, OSError):
+        return False
+
+# 设置项定义：键 -> (允许的类型, 默认值, 最大长度, 值的校验函数)
+SETTINGS_SCHEMA = {
+    'defaultShareSpaceId': ((str, type(None)), None, 64, None),  # 默认分享到的空间ID
+    'timezone': ((str, type(None)), None, 64, is_valid_timezone)  # 用户的时区，决定个人任务的打卡日期
+}
+
+_USER_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# 用户ID -> (文件签名, 设置, 最后修改时间)
+_cache = {}
+_cache_lock = threading.Lock()
+
+# 旧版设置文件：(文件签名, 全部用户的设置)
+_legacy = (None, {})
+
+
+def settings_path(user_id):
+    if not _USER_ID_RE.match(str(user_id)):
+        raise ValueError(f'无效的用户ID: {user_id}')
+    return os.path.join(SETTINGS_DIR, f'{user_id}.json')
+
+def default_settings():
+    return {key: default for key, (_, default, _, _) in SETTINGS_SCHEMA.items()}
+
+# 校验设置项，返回 (要更新的设置, 错误信息)
+def validate_settings(data):
+    if not isinstance(data, dict):
+        return None, '设置数据格式不正确'
+    unknown = sorted(key for key in data if key not in SETTINGS_SCHEMA)
+    if unknown:
+        return None, f"不支持的设置项: {', '.join(unknown)}"
+    for key, value in data.items():
+        types, _, max_length, validator = SETTINGS_SCHEMA[key]
+        if not isinstance(value, types):
+            return None, f'设置项 {key} 的类型不正确'
+        if isinstance(value, str) and len(value) > max_length:
+            return None, f'设置项 {key} 过长'
+        if value is not None and validator and not validator(value):
+            return None, f'设置项 {key} 的值无效'
+    return dict(data), None
+
+def _legacy_settings(user_id):
+    global _legacy
+    signature = file_signature(USER_SETTINGS_FILE)
+    if signature is None:
+        return {}
+    if signature != _legacy[0]:
+        all_settings = read_data(USER_SETTINGS_FILE)
+        _legacy = (signature, all_settings if isinstance(all_settings, dict) else {})
+    user_settings = _legacy[1].get(user_id)
+    return {key: value for key, value in user_settings.items() if key in SETTINGS_SCHEMA} \
+        if isinstance(user_settings, dict) else {}
+
+# 返回 (设置, 最后修改时间)；设置文件中除设置项外还保存最后修改时间（updated_at），用于同步
+def _load(user_id, path):
+    signature = file_signature(path)
+    with _cache_lock:
+        cached = _cache.get(user_id)
+    hit = cached is not None and cached[0] == signature
+    record_cache('settings', hit)
+    if hit:
+        return cached[1], cached[2]
+    if signature is None:
+        stored = _legacy_settings(user_id)
+    else:
+        stored = read_data(path)
+        stored = stored if isinstance(stored, dict) else {}
+    settings = default_settings()
+    settings.update((key, value) for key, value in stored.items() if key in SETTINGS_SCHEMA)
+    updated_at = stored.get('updated_at')
+    with _cache_lock:
+        _cache[user_id] = (signature, settings, updated_at)
+    return settings, updated_at
+
+def get_settings(user_id):
+    """读取用户的全部设置（未设置的项为默认值）"""
+    return dict(_load(user_id, settings_path(user_id))[0])
+
+def settings_updated_at(user_id):
+    """用户最后一次修改设置的时间，从未修改过时为 None"""
+    return _load(user_id, settings_path(user_id))[1]
+
+def put_settings(user_id, updates):
+    """更新用户的部分设置（调用前先用 validate_settings 校验），返回更新后的全部设置"""
+    path = settings_path(user_id)
+    with file_lock(path):
+        settings = dict(_load(user_id, path)[0])
+        settings.update(updates)
+        updated_at = datetime.datetime.now().isoformat()
+        write_data(path, dict(settings, updated_at=updated_at))
+        with _cache_lock:
+            _cache[user_id] = (file_signature(path), settings, updated_at)
+    return dict(settings)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from flask import Blueprint, request, jsonify, g
+from flask import Blueprint, Response, request, jsonify, g, stream_with_context
 from functools import wraps
 import json
 import os
@@ -10,11 +10,20 @@ import datetime
 import random
 import string
 from auth import login_required, read_spaces, write_spaces, read_users
+from storage import SPACES_FILE, USERS_FILE, file_lock
+from http_cache import conditional
 from models import Space, SpaceMember, MemberRole
+from cleanup import create_tombstone, ENTITY_SPACE
+from settings import is_valid_timezone
+import events
 
 # 创建空间蓝图
 space_bp = Blueprint('space', __name__)
 
+# 事件接口：每次最多返回的事件数和长轮询最长等待时间（秒）
+EVENTS_PAGE_SIZE = 200
+EVENTS_MAX_WAIT = 30
+
 # 生成随机邀请码
 def generate_invite_code(length=8):
     chars = string.ascii_uppercase + string.digits
@@ -56,6 +65,7 @@ def member_required(role=None):
             
             # 将空间ID和用户角色存储在g对象中
             g.space_id = space_id
+            g.space = space
             g.user_role = user_role
             
             return f(space_id, *args, **kwargs)
@@ -67,12 +77,15 @@ def member_required(role=None):
 # 创建新空间
 @space_bp.route('', methods=['POST'])
 @login_required
+@file_lock(SPACES_FILE)
 def create_space():
     data = request.get_json()
     
     # 验证请求数据
     if not data or not all(key in data for key in ['name']):
         return jsonify({'error': '缺少必要的空间信息'}), 400
+    if data.get('timezone') is not None and not is_valid_timezone(data['timezone']):
+        return jsonify({'error': '无效的时区'}), 400
     
     # 获取当前用户ID
     user_id = g.user_id
@@ -97,6 +110,8 @@ def create_space():
         'updated_at': now,
         'invite_code': invite_code
     }
+    if data.get('timezone'):
+        new_space['timezone'] = data['timezone']  # 空间的时区，决定空间任务的打卡日期
     
     # 保存空间
     spaces = read_spaces()
@@ -113,6 +128,7 @@ def create_space():
 # 通过邀请码加入空间
 @space_bp.route('/join', methods=['POST'])
 @login_required
+@file_lock(SPACES_FILE)
 def join_space():
     data = request.get_json()
     
@@ -150,6 +166,8 @@ def join_space():
     
     # 保存更新
     write_spaces(spaces)
+    events.record_event(space['id'], events.MEMBER_JOINED, user_id,
+                        {'user_id': user_id, 'role': MemberRole.SUBMITTER})
     
     # 添加成员的用户名
     space_with_usernames = space.copy()
@@ -160,6 +178,7 @@ def join_space():
 # 获取用户的所有空间
 @space_bp.route('', methods=['GET'])
 @login_required
+@conditional(SPACES_FILE, USERS_FILE)
 def get_user_spaces():
     # 获取当前用户ID
     user_id = g.user_id
@@ -183,6 +202,7 @@ def get_user_spaces():
 # 获取空间详情
 @space_bp.route('/<space_id>', methods=['GET'])
 @member_required()
+@conditional(SPACES_FILE, USERS_FILE)
 def get_space(space_id):
     # 获取空间
     spaces = read_spaces()
@@ -197,12 +217,15 @@ def get_space(space_id):
 # 更新空间信息
 @space_bp.route('/<space_id>', methods=['PUT'])
 @member_required(MemberRole.ADMIN)
+@file_lock(SPACES_FILE)
 def update_space(space_id):
     data = request.get_json()
     
     # 验证请求数据
     if not data:
         return jsonify({'error': '缺少更新信息'}), 400
+    if data.get('timezone') is not None and not is_valid_timezone(data['timezone']):
+        return jsonify({'error': '无效的时区'}), 400
     
     # 获取空间
     spaces = read_spaces()
@@ -217,6 +240,12 @@ def update_space(space_id):
         space['name'] = data['name']
     if 'description' in data:
         space['description'] = data['description']
+    if 'timezone' in data:
+        # 设为 null 时恢复使用默认时区
+        if data['timezone']:
+            space['timezone'] = data['timezone']
+        else:
+            space.pop('timezone', None)
     
     space['updated_at'] = datetime.datetime.utcnow().isoformat()
     
@@ -232,6 +261,7 @@ def update_space(space_id):
 # 邀请用户加入空间
 @space_bp.route('/<space_id>/members', methods=['POST'])
 @member_required(MemberRole.ADMIN)
+@file_lock(SPACES_FILE)
 def invite_member(space_id):
     data = request.get_json()
     
@@ -275,6 +305,8 @@ def invite_member(space_id):
     
     # 保存更新
     write_spaces(spaces)
+    events.record_event(space_id, events.MEMBER_JOINED, g.user_id,
+                        {'user_id': user['id'], 'role': role})
     
     # 添加成员的用户名
     space_with_usernames = space.copy()
@@ -285,6 +317,7 @@ def invite_member(space_id):
 # 移除空间成员
 @space_bp.route('/<space_id>/members/<user_id>', methods=['DELETE'])
 @member_required(MemberRole.ADMIN)
+@file_lock(SPACES_FILE)
 def remove_member(space_id, user_id):
     # 获取空间
     spaces = read_spaces()
@@ -310,6 +343,7 @@ def remove_member(space_id, user_id):
     
     # 保存更新
     write_spaces(spaces)
+    events.record_event(space_id, events.MEMBER_REMOVED, g.user_id, {'user_id': user_id})
     
     # 添加成员的用户名
     space_with_usernames = space.copy()
@@ -320,6 +354,7 @@ def remove_member(space_id, user_id):
 # 更新成员角色
 @space_bp.route('/<space_id>/members/<user_id>', methods=['PUT'])
 @member_required(MemberRole.ADMIN)
+@file_lock(SPACES_FILE)
 def update_member_role(space_id, user_id):
     data = request.get_json()
     
@@ -352,11 +387,14 @@ def update_member_role(space_id, user_id):
         return jsonify({'error': '不能更改空间创建者的角色'}), 400
     
     # 更新角色
+    previous_role = space['members'][member_index]['role']
     space['members'][member_index]['role'] = role
     space['updated_at'] = datetime.datetime.utcnow().isoformat()
     
     # 保存更新
     write_spaces(spaces)
+    events.record_event(space_id, events.MEMBER_ROLE_CHANGED, g.user_id,
+                        {'user_id': user_id, 'role': role, 'previous_role': previous_role})
     
     # 添加成员的用户名
     space_with_usernames = space.copy()
@@ -364,9 +402,49 @@ def update_member_role(space_id, user_id):
     
     return jsonify(space_with_usernames)
 
+# 空间事件流：只返回序号大于 since 的新事件
+# wait=N 时长轮询最多N秒；Accept: text/event-stream 时以SSE持续推送（支持 Last-Event-ID 断线续传）
+# 等待期间一直占用处理线程，ASGI入口在单独的线程池中执行（见 asgi.STREAM_ROUTES）
+@space_bp.route('/<space_id>/events', methods=['GET'])
+@member_required()
+def get_space_events(space_id):
+    try:
+        since = int(request.headers.get('Last-Event-ID') or request.args.get('since', 0))
+        limit = min(int(request.args.get('limit', EVENTS_PAGE_SIZE)), EVENTS_PAGE_SIZE)
+        wait = min(float(request.args.get('wait', 0)), EVENTS_MAX_WAIT)
+    except ValueError:
+        return jsonify({'error': 'since、limit 和 wait 必须是数字'}), 400
+    
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        return Response(stream_with_context(_stream_space_events(space_id, since)),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
+    new_events = events.wait_for_events(space_id, since, limit, timeout=wait)
+    last_seq = new_events[-1]['seq'] if new_events else max(since, 0)
+    return jsonify({
+        'events': new_events,
+        'last_seq': last_seq,
+        'has_more': last_seq < events.latest_seq(space_id)
+    })
+
+def _stream_space_events(space_id, since):
+    # 告知客户端断线后的重连间隔
+    yield f"retry: {events.STREAM_RETRY_MS}\n\n"
+    while True:
+        new_events = events.wait_for_events(space_id, since, EVENTS_PAGE_SIZE, timeout=events.STREAM_HEARTBEAT)
+        if not new_events:
+            # 心跳，保持连接并及时发现已断开的客户端
+            yield ": heartbeat\n\n"
+            continue
+        for event in new_events:
+            yield events.format_sse(event, event['seq'], event['type'])
+        since = new_events[-1]['seq']
+
 # 删除空间
 @space_bp.route('/<space_id>', methods=['DELETE'])
 @member_required(MemberRole.ADMIN)
+@file_lock(SPACES_FILE)
 def delete_space(space_id):
     # 获取当前用户ID
     user_id = g.user_id
@@ -389,11 +467,15 @@ def delete_space(space_id):
     # 保存更新
     write_spaces(spaces)
     
-    return jsonify({'message': '空间已删除'})
+    # 空间下的任务、打卡记录、历史记录、梦境和图片由后台级联清理；删除前的成员通过同步得知空间已删除
+    tombstone = create_tombstone(ENTITY_SPACE, space_id, user_id, space_id,
+                                 audience=[member['user_id'] for member in space.get('members', [])])
+    
+    return jsonify({'message': '空间已删除', 'cleanup_job_id': tombstone['id']})
 
 # 辅助函数：获取带有用户名的成员列表
-def get_members_with_username(members):
-    users = read_users()
+def get_members_with_username(members, users=None):
+    users = read_users() if users is None else users
     members_with_username = []
     
     for member in members:
@@ -0,0 +1,587 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import base64
+import copy
+import datetime
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import fcntl
+except ImportError:  # Windows 下只有进程内的锁
+    fcntl = None
+
+from metrics import observe_storage
+
+# 数据存储：数据文件路径、JSON文件的读写以及多进程部署所需的文件锁和代数计数器
+#
+# 用法:
+#   python storage.py migrate [--dry-run]   按当前配置迁移任务、打卡记录和梦境的分片布局（启动时也会自动执行）
+#   python storage.py layout                查看数据目录布局
+
+
+class StorageConfig:
+    """
+    数据目录布局：数据目录、图片目录，以及任务、打卡记录和梦境是否按空间分片存储
+    （每个空间的数据在 <数据目录>/spaces/<空间ID>/ 下单独成文件，个人数据仍在数据目录下的主文件中）
+    """
+
+    def __init__(self, data_dir, images_dir=None, shard_by_space=True):
+        self.data_dir = data_dir
+        self.images_dir = images_dir or os.path.join(data_dir, 'images')
+        self.shard_by_space = shard_by_space
+
+    # 从环境变量读取：TAPIR_DATA_DIR（例如基准测试使用临时目录）、TAPIR_IMAGES_DIR、TAPIR_SHARD_BY_SPACE（为0时不分片）
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(environ.get('TAPIR_DATA_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'),
+                   images_dir=environ.get('TAPIR_IMAGES_DIR'),
+                   shard_by_space=environ.get('TAPIR_SHARD_BY_SPACE', '1').lower() not in ('0', 'false', 'no'))
+
+    def __eq__(self, other):
+        return isinstance(other, StorageConfig) and vars(self) == vars(other)
+
+    def path(self, *parts):
+        return os.path.join(self.data_dir, *parts)
+
+    @property
+    def spaces_dir(self):
+        return self.path('spaces')
+
+
+# 当前进程的数据目录布局，下面的路径都由它计算
+# 导入时不创建任何目录或文件，由 init_storage / ensure_storage 负责
+config = StorageConfig.from_env()
+
+# 数据目录
+DATA_DIR = config.data_dir
+
+# 图片目录
+IMAGES_DIR = config.images_dir
+
+# 按空间分片的数据文件所在目录
+SPACES_DATA_DIR = config.spaces_dir
+
+# 数据文件路径
+DREAMS_FILE = config.path('dreams.json')
+TASKS_FILE = config.path('tasks.json')
+TASK_RECORDS_FILE = config.path('task_records.json')
+USER_SETTINGS_FILE = config.path('user_settings.json')
+USERS_FILE = config.path('users.json')
+SPACES_FILE = config.path('spaces.json')
+HISTORY_RECORDS_FILE = config.path('history_records.json')
+
+# 新增数据文件路径
+DREAM_INTERPRETATIONS_FILE = config.path('dream_interpretations.json')
+DREAM_CONTINUATIONS_FILE = config.path('dream_continuations.json')
+DREAM_PREDICTIONS_FILE = config.path('dream_predictions.json')
+TASK_STATS_FILE = config.path('task_stats.json')
+
+# 按行存储的数据文件：仍是合法的JSON数组，但每条记录单独占一行，
+# 可以按偏移量读取单条记录而不解析整个文件（见 derived_store.py）
+LINE_DELIMITED_FILES = (DREAM_INTERPRETATIONS_FILE, DREAM_CONTINUATIONS_FILE, DREAM_PREDICTIONS_FILE)
+
+# 按空间分片的集合：主文件只保存个人数据，空间的数据在各空间的分片文件中（见 shard_file）
+SHARDED_FILES = (DREAMS_FILE, TASKS_FILE, TASK_RECORDS_FILE)
+
+# 新的统计设置文件
+SPACES_STATISTICS_FILE = config.path('spaces_statistics.json')
+
+# 删除墓碑及级联清理任务
+TOMBSTONES_FILE = config.path('tombstones.json')
+
+# 服务端生成解梦、续写、预测的任务队列（见 generation.py）
+GENERATION_JOBS_FILE = config.path('generation_jobs.json')
+
+# 按请求开启的性能分析结果
+PROFILES_DIR = config.path('profiles')
+
+# 空间事件日志（每个空间一个只追加的 JSON Lines 文件）
+EVENTS_DIR = config.path('events')
+
+# 用户设置（每个用户一个文件，按用户单独读写，见 settings.py）
+SETTINGS_DIR = config.path('settings')
+
+# 按月封存的历史打卡记录（列式归档，见 archive.py）
+RECORDS_ARCHIVE_DIR = config.path('archive', 'task_records')
+
+# 多进程共享的集合代数计数器（mmap），每次写入集合时递增，用于各进程之间的缓存失效
+GENERATIONS_FILE = config.path('.generations')
+GENERATION_SLOTS = 4096
+
+# 定时任务只在持有该锁的一个进程中运行
+SCHEDULER_LOCK_FILE = config.path('.scheduler.lock')
+
+# 各数据文件的初始内容
+DATA_FILE_DEFAULTS = {
+    DREAMS_FILE: [],
+    TASKS_FILE: [],
+    TASK_RECORDS_FILE: [],
+    USER_SETTINGS_FILE: {},
+    USERS_FILE: [],
+    SPACES_FILE: [],
+    HISTORY_RECORDS_FILE: [],
+    DREAM_INTERPRETATIONS_FILE: [],
+    DREAM_CONTINUATIONS_FILE: [],
+    DREAM_PREDICTIONS_FILE: [],
+    TASK_STATS_FILE: {"monthly_stats": {}},
+    SPACES_STATISTICS_FILE: {"spaces": {}},
+    TOMBSTONES_FILE: [],
+    GENERATION_JOBS_FILE: []
+}
+
+# 有界I/O线程池：图片解码与读写等阻塞操作在此执行，限制其占用的线程数
+IO_WORKERS = int(os.environ.get('TAPIR_IO_WORKERS', '8'))
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='tapir-io')
+
+# 数据文件对应的集合名称，用于监控指标；每个用户的设置文件都归入 user_settings
+def collection_name(file_path):
+    if os.path.dirname(file_path) == SETTINGS_DIR:
+        return 'user_settings'
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+# 初始化数据文件
+def init_data_file(file_path, initial_data=None):
+    if not os.path.exists(file_path):
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(initial_data or [], f, ensure_ascii=False, indent=2)
+
+def init_storage():
+    """一次性初始化数据目录和全部数据文件（部署时或启动服务前执行，而不是在导入时）"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    os.makedirs(IMAGES_DIR, exist_ok=True)
+    os.makedirs(EVENTS_DIR, exist_ok=True)
+    os.makedirs(RECORDS_ARCHIVE_DIR, exist_ok=True)
+    os.makedirs(SETTINGS_DIR, exist_ok=True)
+    for file_path, initial_data in DATA_FILE_DEFAULTS.items():
+        if not os.path.exists(file_path):
+            write_data(file_path, initial_data)
+    _generation_map()
+    # 旧版本以缩进格式写入的按行存储文件，转换为每条记录一行
+    for file_path in LINE_DELIMITED_FILES:
+        with file_lock(file_path):
+            with open(file_path, 'rb') as f:
+                if not is_line_delimited(f.read()):
+                    write_data(file_path, read_data(file_path))
+    # 按当前配置迁移分片集合（旧版本的数据全部在主文件中）
+    migrate_shards()
+
+_storage_ready = False
+_storage_guard = threading.Lock()
+
+def ensure_storage():
+    """按需初始化存储，每个进程只执行一次（首个请求或后台任务开始时调用），之后只检查一个标志"""
+    global _storage_ready
+    if not _storage_ready:
+        with _storage_guard:
+            if not _storage_ready:
+                init_storage()
+                _storage_ready = True
+
+
+# 进程内每个数据文件一把可重入锁；跨进程使用 flock 锁住对应的 .lock 文件
+_process_locks = {}
+_process_locks_guard = threading.Lock()
+_held_locks = threading.local()
+
+def _acquire_file_lock(file_path):
+    held = _held_locks.__dict__.setdefault('files', {})
+    if file_path in held:
+        held[file_path][1] += 1
+        return
+    with _process_locks_guard:
+        process_lock = _process_locks.setdefault(file_path, threading.Lock())
+    process_lock.acquire()
+    fd = None
+    if fcntl is not None:
+        if shard_root(file_path) is not None:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        fd = os.open(file_path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    held[file_path] = [fd, 1]
+
+def _release_file_lock(file_path):
+    held = _held_locks.__dict__.setdefault('files', {})
+    entry = held[file_path]
+    entry[1] -= 1
+    if entry[1] > 0:
+        return
+    del held[file_path]
+    if entry[0] is not None:
+        fcntl.flock(entry[0], fcntl.LOCK_UN)
+        os.close(entry[0])
+    _process_locks[file_path].release()
+
+@contextmanager
+def file_lock(*file_paths):
+    """
+    锁住一个或多个数据文件以完成一次读-改-写，对同一进程的其他线程和其他进程都生效。
+    可作为上下文管理器或视图函数的装饰器使用；按固定顺序加锁以避免死锁（见 _lock_order），同一线程可重入。
+    """
+    acquired = []
+    try:
+        for file_path in sorted(set(file_paths), key=_lock_order):
+            _acquire_file_lock(file_path)
+            acquired.append(file_path)
+        yield
+    finally:
+        for file_path in reversed(acquired):
+            _release_file_lock(file_path)
+
+
+# 加锁顺序：先主文件（各数据文件），后空间分片，各自按路径排序
+def _lock_order(file_path):
+    return (shard_root(file_path) is not None, file_path)
+
+
+# 按空间分片
+# 同一空间的写入只重写该空间的分片，并只锁住该分片；写入分片时同时递增主文件的代数，
+# 基于主文件签名的内存索引和ETag因此仍能感知整个集合的变化。
+# 新分片只在同时持有主文件锁时创建（见 shard_lock），持有主文件锁时列出的分片就是集合的全部分片（见 collection_lock）
+
+def shard_file(file_path, space_id):
+    """集合中某个空间的数据文件；个人数据、不分片的集合或关闭分片时为主文件本身"""
+    name = os.path.basename(space_id or '')
+    if not config.shard_by_space or file_path not in SHARDED_FILES or name in ('', '.', '..'):
+        return file_path
+    return os.path.join(SPACES_DATA_DIR, name, os.path.basename(file_path))
+
+# 分片文件对应的主文件，不是分片时返回 None
+def shard_root(file_path):
+    if os.path.dirname(os.path.dirname(file_path)) != SPACES_DATA_DIR:
+        return None
+    root = config.path(os.path.basename(file_path))
+    return root if root in SHARDED_FILES else None
+
+def collection_files(file_path):
+    """集合的全部数据文件：主文件及已存在的各空间分片（按空间ID排序）；关闭分片后尚未合并的分片也包括在内"""
+    if file_path not in SHARDED_FILES:
+        return [file_path]
+    try:
+        space_dirs = sorted(os.listdir(SPACES_DATA_DIR))
+    except FileNotFoundError:
+        space_dirs = []
+    shards = (os.path.join(SPACES_DATA_DIR, name, os.path.basename(file_path)) for name in space_dirs)
+    return [file_path] + [shard for shard in shards if os.path.exists(shard)]
+
+def read_collection(file_path):
+    """读取整个集合：主文件中的个人数据在前，之后按空间ID依次为各分片；不分片的数据文件照常读取"""
+    if file_path not in SHARDED_FILES:
+        return read_data(file_path)
+    items = []
+    for path in collection_files(file_path):
+        items.extend(read_data(path))
+    return items
+
+def write_collection(file_path, items):
+    """
+    写回整个集合（调用方持有 collection_lock）：按条目的空间ID拆分到各分片，只重写内容有变化的文件。
+    条目变多的文件先写、变少的后写，中途失败时最多出现重复的条目而不会丢失
+    """
+    shards = {path: [] for path in collection_files(file_path)}
+    for item in items:
+        shards.setdefault(shard_file(file_path, item.get('space_id')), []).append(item)
+    changed = []
+    for path, shard_items in shards.items():
+        current = read_data(path) if os.path.exists(path) else None
+        if shard_items != current:
+            changed.append((len(shard_items) < len(current or []), path, shard_items))
+    for _, path, shard_items in sorted(changed, key=lambda change: change[0]):
+        write_data(path, shard_items)
+
+# 集合的签名：主文件及各分片的签名
+def collection_signature(file_path):
+    return tuple(file_signature(path) for path in collection_files(file_path))
+
+@contextmanager
+def collection_lock(*file_paths):
+    """锁住整个集合（主文件及全部分片）以完成跨空间的读-改-写，可作为装饰器使用；不分片的数据文件照常加锁"""
+    with file_lock(*file_paths):
+        with file_lock(*(shard for file_path in file_paths for shard in collection_files(file_path)[1:])):
+            yield
+
+# 锁住空间分片所需的文件：分片还不存在（需要创建）时同时锁住主文件
+def _shard_lock_paths(space_ids, file_paths):
+    paths = set()
+    for space_id in space_ids:
+        for file_path in file_paths:
+            shard = shard_file(file_path, space_id)
+            paths.add(shard)
+            if shard != file_path and not os.path.exists(shard):
+                paths.add(file_path)
+    return paths
+
+@contextmanager
+def shards_lock(space_ids, *file_paths):
+    """锁住若干空间（None 为个人数据，即主文件）在各集合中的分片，不影响其他空间的读写；不分片的数据文件照常加锁"""
+    space_ids = list(space_ids)
+    while True:
+        paths = _shard_lock_paths(space_ids, file_paths)
+        with file_lock(*paths):
+            # 等待期间分片被移除（空间已删除）时重新加锁
+            if _shard_lock_paths(space_ids, file_paths) <= paths:
+                yield
+                return
+
+# 锁住一个空间的分片
+def shard_lock(space_id, *file_paths):
+    return shards_lock([space_id], *file_paths)
+
+def space_lock(*file_paths):
+    """视图装饰器：锁住路径参数 space_id 对应空间的分片（放在 member_required 之后）"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(space_id, *args, **kwargs):
+            with shard_lock(space_id, *file_paths):
+                return f(space_id, *args, **kwargs)
+        return decorated_function
+    return decorator
+
+def remove_space_shards(space_id):
+    """移除已删除空间的分片数据文件（已被清空的）；锁文件保留，其他进程可能仍在等待它"""
+    shards = [shard_file(file_path, space_id) for file_path in SHARDED_FILES]
+    with file_lock(*SHARDED_FILES, *shards):
+        for shard in shards:
+            if shard not in SHARDED_FILES and os.path.exists(shard) and not read_data(shard):
+                os.remove(shard)
+
+def migrate_shards(dry_run=False):
+    """
+    按当前配置迁移分片集合的存储布局：开启分片时把主文件中属于空间的条目移到各空间的分片，
+    关闭分片时把各分片合并回主文件并移除分片。返回 {集合名称: 需要移动的条目数}
+    """
+    moved = {}
+    for file_path in SHARDED_FILES:
+        with collection_lock(file_path):
+            shards = collection_files(file_path)[1:]
+            if config.shard_by_space:
+                count = sum(1 for item in read_data(file_path)
+                            if shard_file(file_path, item.get('space_id')) != file_path)
+            else:
+                count = sum(len(read_data(shard)) for shard in shards)
+            if not dry_run:
+                if count:
+                    write_collection(file_path, read_collection(file_path))
+                if not config.shard_by_space:
+                    for shard in shards:
+                        os.remove(shard)
+        moved[collection_name(file_path)] = count
+    return moved
+
+
+# 集合代数计数器：mmap中按数据文件（相对数据目录的路径）哈希分配的8字节槽位，哈希冲突只会导致多余的缓存失效
+_generations = None
+_generations_guard = threading.Lock()
+_local_generations = {}
+
+def _generation_map():
+    global _generations
+    if _generations is None and fcntl is not None:
+        with _generations_guard:
+            if _generations is None:
+                fd = os.open(GENERATIONS_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+                if os.fstat(fd).st_size < GENERATION_SLOTS * 8:
+                    os.ftruncate(fd, GENERATION_SLOTS * 8)
+                _generations = (fd, mmap.mmap(fd, GENERATION_SLOTS * 8))
+    return _generations
+
+def _generation_slot(file_path):
+    return zlib.crc32(os.path.relpath(file_path, DATA_DIR).encode('utf-8')) % GENERATION_SLOTS * 8
+
+# 获取集合当前的代数
+def generation(file_path):
+    shared = _generation_map()
+    if shared is None:
+        return _local_generations.get(file_path, 0)
+    return struct.unpack_from('<Q', shared[1], _generation_slot(file_path))[0]
+
+def bump_generation(file_path):
+    shared = _generation_map()
+    if shared is None:
+        _local_generations[file_path] = _local_generations.get(file_path, 0) + 1
+        return
+    fd, mm = shared
+    offset = _generation_slot(file_path)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        struct.pack_into('<Q', mm, offset, struct.unpack_from('<Q', mm, offset)[0] + 1)
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+# 数据文件签名（代数+修改时间+大小），内存索引据此判断是否需要重建
+def file_signature(file_path):
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (generation(file_path), stat.st_mtime_ns, stat.st_size)
+
+def synced_signature(previous, file_path):
+    """
+    调用方刚写入一次数据文件后的新签名；上次的签名之后还有其他写入（例如其他空间的分片或其他进程）时返回 None，
+    由索引在下次访问时重新加载，而不是把别人的写入当作已同步
+    """
+    signature = file_signature(file_path)
+    if previous is None or signature is None or signature[0] != previous[0] + 1:
+        return None
+    return signature
+
+
+# 当前进程是否负责运行定时任务
+_scheduler_lock_fd = None
+
+def wait_for_scheduler_leadership():
+    """阻塞直到当前进程成为唯一运行定时任务的进程（持有锁的进程退出后由其他进程接替）"""
+    global _scheduler_lock_fd
+    if _scheduler_lock_fd is not None:
+        return
+    fd = os.open(SCHEDULER_LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+    _scheduler_lock_fd = fd
+
+# 读取数据
+def read_data(file_path):
+    started_at = time.perf_counter()
+    raw = b''
+    try:
+        with open(file_path, 'rb') as f:
+            raw = f.read()
+        return json.loads(raw.decode('utf-8'))
+    except (json.JSONDecodeError, UnicodeDecodeError, FileNotFoundError):
+        # 根据文件路径返回不同的默认值
+        if isinstance(DATA_FILE_DEFAULTS.get(file_path), dict):
+            return copy.deepcopy(DATA_FILE_DEFAULTS[file_path])
+        return []
+    finally:
+        observe_storage('read', collection_name(file_path), time.perf_counter() - started_at, len(raw))
+
+# 按行存储的编码：'[' 与 ']' 各占一行，其间每行一条紧凑的JSON记录（行尾的逗号不属于记录）
+def encode_lines(items):
+    lines = [json.dumps(item, ensure_ascii=False, separators=(',', ':')) for item in items]
+    return ('[\n' + ''.join(line + ',\n' for line in lines[:-1]) + (lines[-1] + '\n' if lines else '') +
+            ']\n').encode('utf-8')
+
+def is_line_delimited(raw):
+    if not raw.startswith(b'[\n') or not raw.endswith(b'\n]\n'):
+        return False
+    return all(line.startswith(b'{') for line in raw[2:-2].splitlines())
+
+# 一致快照的乐观读取次数，超过后加锁读取
+SNAPSHOT_ATTEMPTS = 3
+
+def read_snapshot(*file_paths):
+    """
+    读取多个数据文件并保证它们来自同一时刻：读取前后各文件签名都没有变化才返回，
+    期间有写入时重新读取，多次不成功时锁住这些文件再读取。分片集合的主文件代表整个集合（包括全部分片）。
+    返回 文件路径 -> 数据
+    """
+    file_paths = list(dict.fromkeys(file_paths))
+    for _ in range(SNAPSHOT_ATTEMPTS):
+        before = [collection_signature(file_path) for file_path in file_paths]
+        snapshot = {file_path: read_collection(file_path) for file_path in file_paths}
+        if [collection_signature(file_path) for file_path in file_paths] == before:
+            return snapshot
+    with collection_lock(*file_paths):
+        return {file_path: read_collection(file_path) for file_path in file_paths}
+
+def stamp_updated(items, created=False):
+    """
+    记录修改时间（created 为真时同时记录创建时间），返回该时间。写入方在持有数据文件的锁、即将写入时调用，
+    使同一数据文件中 updated_at 的先后与写入顺序一致：增量同步按 (updated_at, ID) 记录水位，
+    在锁外先取时间、后写入的条目可能落在其他请求已经返回的水位之前而被漏掉
+    """
+    now = datetime.datetime.now().isoformat()
+    for item in items:
+        if created:
+            item['created_at'] = now
+        item['updated_at'] = now
+    return now
+
+# 写入数据：先写临时文件再原子替换，其他进程不会读到写了一半的文件
+def write_data(file_path, data):
+    if file_path in LINE_DELIMITED_FILES and isinstance(data, list):
+        write_bytes(file_path, encode_lines(data))
+    else:
+        write_bytes(file_path, json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'))
+
+# 复制原文件前缀时每次读取的字节数
+COPY_CHUNK_BYTES = 1024 * 1024
+
+# 原子写入已编码的文件内容；写入空间分片时同时递增主文件的代数
+# keep 大于0时新文件先写入原文件的前 keep 个字节（分块复制，不整个读入内存），再写入 raw，用于在文件末尾追加
+def write_bytes(file_path, raw, keep=0):
+    started_at = time.perf_counter()
+    root = shard_root(file_path)
+    if root is not None:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if keep:
+                with open(file_path, 'rb') as source:
+                    remaining = keep
+                    while remaining > 0:
+                        chunk = source.read(min(COPY_CHUNK_BYTES, remaining))
+                        if not chunk:
+                            raise IOError(f'{file_path} 在写入期间被截断')
+                        f.write(chunk)
+                        remaining -= len(chunk)
+            f.write(raw)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    bump_generation(file_path)
+    if root is not None:
+        bump_generation(root)
+    observe_storage('write', collection_name(file_path), time.perf_counter() - started_at, keep + len(raw))
+
+# 解码并保存一张base64编码的图片，返回文件名
+def save_base64_image(image_data):
+    if ',' in image_data:
+        # 处理 data URL 前缀
+        image_data = image_data.split(',')[1]
+    
+    # 生成唯一文件名
+    filename = f"{uuid.uuid4()}.jpg"
+    with open(os.path.join(IMAGES_DIR, filename), 'wb') as f:
+        f.write(base64.b64decode(image_data))
+    return filename
+
+# 在I/O线程池中并行保存多张图片，按原顺序返回文件名
+def save_base64_images(images):
+    return list(io_executor.map(save_base64_image, images))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='TapirTwins 数据目录布局')
+    parser.add_argument('command', choices=['migrate', 'layout'])
+    parser.add_argument('--dry-run', action='store_true', help='只统计需要移动的条目数，不修改数据文件')
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        os.makedirs(DATA_DIR, exist_ok=True)
+        moved = migrate_shards(dry_run=args.dry_run)
+        print(json.dumps({'dry_run': args.dry_run, 'moved': moved}, ensure_ascii=False, indent=2))
+    print(json.dumps({
+        'data_dir': DATA_DIR,
+        'images_dir': IMAGES_DIR,
+        'shard_by_space': config.shard_by_space,
+        'files': {collection_name(file_path): len(collection_files(file_path)) for file_path in SHARDED_FILES}
+    }, ensure_ascii=False, indent=2))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from flask import Blueprint, request, jsonify, g
+import base64
+import binascii
+import json
+
+from auth import login_required
+from settings import get_settings, settings_updated_at
+from storage import (DREAMS_FILE, TASKS_FILE, TASK_RECORDS_FILE, SPACES_FILE, TOMBSTONES_FILE,
+                     read_snapshot)
+from cleanup import ENTITY_DREAM, ENTITY_TASK, ENTITY_SPACE
+
+# 增量同步
+# 客户端带上次同步返回的游标，只取回此后新建、修改和删除的数据（空间、梦境、任务、打卡记录和用户设置）。
+# 游标中按集合和范围（个人数据或某个空间）记录水位 (updated_at, id)，新加入的空间没有水位，其数据全部返回；
+# 删除来自墓碑，按 (deleted_at, id) 单独记录水位；空间被删除时其下的数据、任务被删除时其打卡记录也随之删除。
+# 每次返回的条目数有上限，has_more 为真时用新游标继续请求。
+# 已封存月份的打卡记录不在同步范围内（通过任务历史接口按月份读取）
+
+# 每次同步默认及最多返回的条目数
+SYNC_PAGE_SIZE = 500
+SYNC_MAX_PAGE_SIZE = 2000
+
+# 同步的集合 -> (数据文件, 个人数据的归属字段)
+SYNC_COLLECTIONS = {
+    'dreams': (DREAMS_FILE, 'user_id'),
+    'tasks': (TASKS_FILE, 'submitter_id'),
+    'records': (TASK_RECORDS_FILE, 'submitter_id')
+}
+
+# 墓碑类型 -> 集合
+TOMBSTONE_COLLECTIONS = {
+    ENTITY_SPACE: 'spaces',
+    ENTITY_DREAM: 'dreams',
+    ENTITY_TASK: 'tasks'
+}
+
+# 个人数据的范围名称
+PERSONAL_SCOPE = ''
+
+sync_bp = Blueprint('sync', __name__)
+
+
+# 条目的变更位置：(最后修改时间, ID)，旧数据没有 updated_at 时使用创建时间
+def change_key(item):
+    return (item.get('updated_at') or item.get('created_at') or '', item.get('id') or '')
+
+def tombstone_key(tombstone):
+    return (tombstone.get('deleted_at') or '', tombstone.get('id') or '')
+
+def encode_cursor(cursor):
+    raw = json.dumps(cursor, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+# 解析游标，返回 (游标, 错误信息)；没有游标时为首次同步
+def decode_cursor(text):
+    if not text:
+        return None, None
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(text + '=' * (-len(text) % 4)).decode('utf-8'))
+    except (binascii.Error, ValueError):
+        return None, '无效的同步游标'
+    marks = cursor.get('w', {}) if isinstance(cursor, dict) else None
+    if not isinstance(marks, dict) or not all(
+            isinstance(scopes, dict) and all(_is_mark(mark) for mark in scopes.values()) for scopes in marks.values()) \
+            or not (cursor.get('t') is None or _is_mark(cursor['t'])) \
+            or not (cursor.get('s') is None or isinstance(cursor['s'], str)):
+        return None, '无效的同步游标'
+    return cursor, None
+
+def _is_mark(mark):
+    return isinstance(mark, list) and len(mark) == 2 and all(isinstance(part, str) for part in mark)
+
+def _after(key, watermark):
+    return watermark is None or key > tuple(watermark)
+
+def _tombstone_visible(tombstone, user_id, space_ids):
+    return (tombstone.get('user_id') == user_id or user_id in tombstone.get('audience', []) or
+            tombstone.get('space_id') in space_ids)
+
+def collect_changes(user_id, cursor, limit):
+    """计算用户自游标以来的变更，返回 (变更, 当前所在的空间ID, 新游标, 是否还有更多)"""
+    snapshot = read_snapshot(SPACES_FILE, TOMBSTONES_FILE,
+                             *(file_path for file_path, _ in SYNC_COLLECTIONS.values()))
+    first_sync = cursor is None
+    cursor = cursor or {}
+    watermarks = cursor.get('w', {})
+
+    spaces = [space for space in snapshot[SPACES_FILE]
+              if any(member.get('user_id') == user_id for member in space.get('members', []))]
+    space_ids = {space['id'] for space in spaces}
+
+    # 候选变更：(变更位置, 集合, 范围, 条目)；删除的范围为 None
+    pending = []
+    visible_ids = {'spaces': space_ids}
+    spaces_mark = watermarks.get('spaces', {}).get(PERSONAL_SCOPE)
+    pending.extend((change_key(space), 'spaces', PERSONAL_SCOPE, space)
+                   for space in spaces if _after(change_key(space), spaces_mark))
+    for collection, (file_path, owner_field) in SYNC_COLLECTIONS.items():
+        marks = watermarks.get(collection, {})
+        ids = visible_ids[collection] = set()
+        for item in snapshot[file_path]:
+            space_id = item.get('space_id')
+            if space_id:
+                if space_id not in space_ids:
+                    continue
+                scope = space_id
+            elif item.get(owner_field) == user_id:
+                scope = PERSONAL_SCOPE
+            else:
+                continue
+            ids.add(item.get('id'))
+            if _after(change_key(item), marks.get(scope)):
+                pending.append((change_key(item), collection, scope, item))
+
+    # 首次同步不需要删除记录，从最新的墓碑之后开始
+    tombstones = [tombstone for tombstone in snapshot[TOMBSTONES_FILE]
+                  if tombstone.get('entity_type') in TOMBSTONE_COLLECTIONS]
+    tombstone_mark = cursor.get('t')
+    if first_sync:
+        tombstone_mark = max((tombstone_key(tombstone) for tombstone in tombstones), default=None)
+    for tombstone in tombstones:
+        if _after(tombstone_key(tombstone), tombstone_mark) and _tombstone_visible(tombstone, user_id, space_ids):
+            pending.append((tombstone_key(tombstone), None, None, tombstone))
+
+    pending.sort(key=lambda change: change[0])
+    has_more = len(pending) > limit
+    changes = {collection: {'updated': [], 'deleted': []} for collection in ('spaces',) + tuple(SYNC_COLLECTIONS)}
+    new_marks = {collection: {scope: mark for scope, mark in watermarks.get(collection, {}).items()
+                              if scope == PERSONAL_SCOPE or scope in space_ids}
+                 for collection in changes}
+    for key, collection, scope, item in pending[:limit]:
+        if collection is None:
+            tombstone_mark = key
+            collection = TOMBSTONE_COLLECTIONS[item['entity_type']]
+            # 相同ID的其他条目仍然可见时（内容相同的梦境共享ID）不算删除
+            if item.get('entity_id') not in visible_ids[collection]:
+                changes[collection]['deleted'].append(item.get('entity_id'))
+            continue
+        changes[collection]['updated'].append(item)
+        new_marks[collection][scope] = key
+
+    # 用户设置是单个文档，修改过即整体返回
+    settings_mark = settings_updated_at(user_id)
+    changes['settings'] = get_settings(user_id) if first_sync or settings_mark != cursor.get('s') else None
+
+    new_cursor = {'w': new_marks, 't': tombstone_mark, 's': settings_mark}
+    return changes, sorted(space_ids), new_cursor, has_more
+
+
+# 增量同步：cursor 为上次返回的游标（首次同步不传），limit 为最多返回的条目数
+@sync_bp.route('', methods=['GET'])
+@login_required
+def sync():
+    cursor, error = decode_cursor(request.args.get('cursor'))
+    if error:
+        return jsonify({'error': error}), 400
+    try:
+        limit = min(SYNC_MAX_PAGE_SIZE, max(1, int(request.args.get('limit', SYNC_PAGE_SIZE))))
+    except ValueError:
+        return jsonify({'error': '无效的 limit 参数'}), 400
+
+    changes, space_ids, new_cursor, has_more = collect_changes(g.user_id, cursor, limit)
+    return jsonify({
+        'changes': changes,
+        'space_ids': space_ids,  # 当前所在的全部空间，客户端据此移除已退出空间的数据
+        'cursor': encode_cursor(new_cursor),
+        'has_more': has_more
+    })
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import unittest
+
+# 打卡记录归档测试：封存到按列存储的归档文件后，历史记录接口返回的记录不变
+#
+# 运行: python -m pytest test_archive.py  或  python test_archive.py
+
+from apitest import ApiTestCase
+import archive
+from storage import TASK_RECORDS_FILE, read_collection
+
+
+class SealedMonthTest(ApiTestCase):
+
+    def create_task(self, headers, space_id, title):
+        response = self.client.post(f'/api/spaces/{space_id}/tasks', json={'title': title, 'required_images': 0},
+                                    headers=headers)
+        self.assertEqual(response.status_code, 201)
+        task_id = response.get_json()['id']
+        response = self.client.post(f'/api/tasks/{task_id}/complete', json={'images': []}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return task_id
+
+    def test_round_trip(self):
+        _, headers = self.register()
+        space_id = self.create_space(headers)
+        approved_id = self.create_task(headers, space_id, '已审批的任务')
+        pending_id = self.create_task(headers, space_id, '待审批的任务')
+        # 只有部分记录有审批字段（归档中存为稀疏列）
+        record_id = self.client.get(f'/api/tasks/{approved_id}/records', headers=headers).get_json()[0]['id']
+        response = self.client.post(f'/api/spaces/{space_id}/tasks/records/{record_id}/approve',
+                                    json={'comment': '很好'}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+        before = self.client.get(f'/api/spaces/{space_id}/tasks/records', headers=headers).get_json()
+        self.assertEqual(len(before), 2)
+        month = before[0]['date'][:7]
+
+        # 三个月之后，本月已不在热分区中
+        sealed = archive.seal_partitions(datetime.date.today() + datetime.timedelta(days=92))
+        self.assertGreaterEqual(sealed[month], 2)
+        self.assertIn(month, archive.archived_months())
+        hot_ids = {record.get('id') for record in read_collection(TASK_RECORDS_FILE)}
+        self.assertFalse(hot_ids & {record['id'] for record in before})
+
+        after = self.client.get(f'/api/spaces/{space_id}/tasks/records', headers=headers).get_json()
+        self.assertEqual(after, before)
+        by_month = self.client.get(f'/api/spaces/{space_id}/tasks/records', query_string={'month': month},
+                                   headers=headers).get_json()
+        self.assertEqual(by_month, before)
+        for task_id in (approved_id, pending_id):
+            records = self.client.get(f'/api/tasks/{task_id}/records', headers=headers).get_json()
+            self.assertEqual(records, [record for record in before if record['task_id'] == task_id])
+
+
+if __name__ == '__main__':
+    unittest.main()
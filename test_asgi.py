@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+# ASGI入口测试：Flask视图在请求线程池中并发执行，事件推送等长连接不占用请求线程
+# 测试直接调用ASGI应用，不需要启动服务器
+#
+# 运行: python -m pytest test_asgi.py  或  python test_asgi.py
+
+os.environ.setdefault('TAPIR_DATA_DIR', os.path.join(tempfile.mkdtemp(prefix='tapir_test_asgi_'), 'data'))
+
+from flask import Flask
+
+import asgi
+import events
+
+
+# 以ASGI方式发送一个请求，返回 (状态码, 响应体)；disconnect 被设置时模拟客户端断开
+async def call(application, path, method='GET', headers=(), body=b'', disconnect=None):
+    if body:
+        headers = list(headers) + [('Content-Length', str(len(body)))]
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+             'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+             'query_string': query.encode(), 'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+             'client': ('127.0.0.1', 12345), 'server': ('testserver', 80)}
+    disconnect = disconnect or asyncio.Event()
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    response = {'status': None, 'body': b''}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        else:
+            response['body'] += message.get('body', b'')
+
+    await application(scope, receive, send)
+    return response['status'], response['body']
+
+
+class ConcurrencyTest(unittest.TestCase):
+
+    def test_views_run_concurrently(self):
+        flask_app = Flask(__name__)
+
+        @flask_app.route('/slow')
+        def slow():
+            time.sleep(0.5)
+            return threading.current_thread().name
+
+        application = asgi.TapirASGI(flask_app)
+
+        async def run():
+            return await asyncio.gather(*(call(application, '/slow') for _ in range(4)))
+
+        started_at = time.perf_counter()
+        results = asyncio.run(run())
+        elapsed = time.perf_counter() - started_at
+
+        self.assertEqual([status for status, _ in results], [200] * 4)
+        self.assertLess(elapsed, 1.5)
+        self.assertEqual(len({body for _, body in results}), 4)
+        self.assertTrue(all(body.startswith(b'tapir-request') for _, body in results))
+
+
+class StreamTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.heartbeat = events.STREAM_HEARTBEAT
+        # 心跳间隔缩短，客户端断开后尽快结束事件流
+        events.STREAM_HEARTBEAT = 0.2
+
+    @classmethod
+    def tearDownClass(cls):
+        events.STREAM_HEARTBEAT = cls.heartbeat
+
+    # 发送一个JSON请求，返回 (状态码, 响应数据)
+    def post(self, path, data, headers=()):
+        status, raw = asyncio.run(call(asgi.application, path, 'POST', [('Content-Type', 'application/json'), *headers],
+                                       json.dumps(data).encode()))
+        return status, json.loads(raw)
+
+    # 注册一个用户，返回请求头
+    def register(self, username):
+        status, data = self.post('/api/auth/register', {'username': username, 'password': 'password123',
+                                                        'email': f'{username}@example.com'})
+        self.assertEqual(status, 201)
+        return [('Authorization', 'Bearer ' + data['token'])]
+
+    def probe_while_waiting(self, headers, probe, streams=(), polls=(), wakeup=None):
+        """
+        在长连接都保持打开时请求 probe：streams 为SSE连接（(路径, 额外请求头) 列表），之后断开；
+        polls 为长轮询的路径，之后调用 wakeup 产生新事件使其返回。
+        返回 (探测请求的 (状态码, 响应体, 耗时), 各SSE连接的响应, 各长轮询的响应)
+        """
+        async def run():
+            disconnect = asyncio.Event()
+            pending_streams = [asyncio.ensure_future(call(asgi.application, path, headers=headers + extra,
+                                                          disconnect=disconnect))
+                               for path, extra in streams]
+            pending_polls = [asyncio.ensure_future(call(asgi.application, path, headers=headers)) for path in polls]
+            await asyncio.sleep(0.3)
+            started_at = time.perf_counter()
+            status, body = await asyncio.wait_for(call(asgi.application, probe, headers=headers), 5)
+            elapsed = time.perf_counter() - started_at
+            disconnect.set()
+            if wakeup:
+                wakeup()
+            return ((status, body, elapsed), await asyncio.wait_for(asyncio.gather(*pending_streams), 5),
+                    await asyncio.wait_for(asyncio.gather(*pending_polls), 5))
+        return asyncio.run(run())
+
+    def test_user_streams_do_not_block_requests(self):
+        headers = self.register('stream_user')
+        # 比请求线程更多的推送连接
+        (status, _, elapsed), streams, _ = self.probe_while_waiting(
+            headers, '/api/dreams', streams=[('/api/events/stream', [])] * (asgi.REQUEST_THREADS + 1))
+        self.assertEqual(status, 200)
+        self.assertLess(elapsed, 2)
+        # 客户端断开后事件流结束
+        self.assertTrue(all(body.startswith(b'retry:') for _, body in streams))
+
+
+    def test_space_event_waits_do_not_block_requests(self):
+        headers = self.register('space_stream_user')
+        status, space = self.post('/api/spaces', {'name': 'stream'}, headers)
+        self.assertEqual(status, 201)
+        path = f"/api/spaces/{space['id']}/events"
+        # 长轮询和SSE连接合计多于请求线程
+        count = asgi.REQUEST_THREADS // 2 + 1
+        (status, _, elapsed), streams, polls = self.probe_while_waiting(
+            headers, '/api/dreams', streams=[(path, [('Accept', 'text/event-stream')])] * count,
+            polls=[path + '?wait=30'] * count,
+            wakeup=lambda: events.record_event(space['id'], events.TASK_CREATED, 'tester'))
+        self.assertEqual(status, 200)
+        self.assertLess(elapsed, 2)
+        self.assertTrue(all(body.startswith(b'retry:') for _, body in streams))
+        self.assertTrue(all(json.loads(body)['events'] for _, body in polls))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+# 生成任务测试：只能为自己可见的梦境提交生成任务
+#
+# 运行: python -m pytest test_generation.py  或  python test_generation.py
+
+from apitest import ApiTestCase
+
+
+class GenerationVisibilityTest(ApiTestCase):
+
+    def submit(self, dream_id, headers):
+        return self.client.post('/api/generation_jobs', json={'kind': 'prediction', 'dream_id': dream_id}, headers=headers)
+
+    def test_personal_dream_only_owner(self):
+        _, alice = self.register('alice')
+        _, bob = self.register('bob')
+        dream_id = self.client.post('/api/dreams', json={'title': '个人的梦', 'content': '走进一座旧图书馆'},
+                                    headers=alice).get_json()['id']
+
+        self.assertEqual(self.submit(dream_id, bob).status_code, 404)
+        self.assertIn(self.submit(dream_id, alice).status_code, (200, 202))
+
+    def test_space_dream_only_members(self):
+        _, owner = self.register('owner')
+        _, member = self.register('member')
+        _, outsider = self.register('outsider')
+        space_id = self.create_space(owner)
+        self.join_space(space_id, owner, member)
+        dream_id = self.client.post(f'/api/spaces/{space_id}/dreams', json={'title': '空间的梦', 'content': '在雪地里追一只狐狸'},
+                                    headers=owner).get_json()['id']
+
+        self.assertEqual(self.submit(dream_id, outsider).status_code, 404)
+        self.assertIn(self.submit(dream_id, member).status_code, (200, 202))
+
+    def test_unknown_dream(self):
+        _, headers = self.register()
+        self.assertEqual(self.submit('no-such-dream', headers).status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
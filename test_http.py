@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gzip
+import unittest
+
+# HTTP层测试：条件请求（ETag / If-None-Match）和响应压缩（Accept-Encoding）
+#
+# 运行: python -m pytest test_http.py  或  python test_http.py
+
+from apitest import ApiTestCase
+import compress
+
+
+class ConditionalRequestTest(ApiTestCase):
+
+    def test_not_modified_until_write(self):
+        _, headers = self.register()
+        self.client.post('/api/dreams', json={'title': '缓存', 'content': '第一条梦境'}, headers=headers)
+        response = self.client.get('/api/dreams', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+
+        response = self.client.get('/api/dreams', headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+
+        # 写入后ETag变化，旧的ETag不再命中
+        self.client.post('/api/dreams', json={'title': '缓存', 'content': '第二条梦境'}, headers=headers)
+        response = self.client.get('/api/dreams', headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_etag_depends_on_user(self):
+        _, alice = self.register('alice')
+        _, bob = self.register('bob')
+        etag = self.client.get('/api/dreams', headers=alice).headers['ETag']
+
+        response = self.client.get('/api/dreams', headers=dict(bob, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+
+
+class CompressionTest(ApiTestCase):
+
+    def setUp(self):
+        # 足够大的响应才会压缩
+        _, self.headers = self.register()
+        for i in range(10):
+            self.client.post('/api/dreams', json={'title': f'长梦{i}', 'content': '在没有尽头的走廊里奔跑。' * 20},
+                             headers=self.headers)
+        self.plain = self.client.get('/api/dreams', headers=self.headers)
+        self.assertGreater(len(self.plain.data), compress.MIN_SIZE)
+
+    def get(self, accept_encoding):
+        return self.client.get('/api/dreams', headers=dict(self.headers, **{'Accept-Encoding': accept_encoding}))
+
+    def test_gzip(self):
+        response = self.get('gzip')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gzip.decompress(response.data), self.plain.data)
+
+    def test_uncompressed_without_accept_encoding(self):
+        self.assertNotIn('Content-Encoding', self.plain.headers)
+        self.assertNotIn('Content-Encoding', self.get('identity').headers)
+        self.assertNotIn('Content-Encoding', self.get('gzip;q=0').headers)
+
+    def test_prefers_brotli_when_available(self):
+        response = self.get('gzip;q=0.5, br')
+        if compress.brotli is None:
+            # 未安装 brotli 时退回 gzip
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        else:
+            self.assertEqual(response.headers['Content-Encoding'], 'br')
+            self.assertEqual(compress.brotli.decompress(response.data), self.plain.data)
+        # 客户端更偏好 gzip 时使用 gzip
+        self.assertEqual(self.get('gzip, br;q=0.5').headers['Content-Encoding'], 'gzip')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+# 全文检索测试：中文按二元组匹配，只返回当前用户可见的梦境，索引在首次检索时建立
+#
+# 运行: python -m pytest test_search.py  或  python test_search.py
+
+from apitest import ApiTestCase, tapir_app
+from search import SearchIndex
+
+
+class SearchTest(ApiTestCase):
+
+    def setUp(self):
+        # 每个测试使用尚未建立的索引
+        tapir_app.search_index = SearchIndex()
+
+    def add_dream(self, headers, title, content, space_id=None):
+        path = f'/api/spaces/{space_id}/dreams' if space_id else '/api/dreams'
+        response = self.client.post(path, json={'title': title, 'content': content}, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()['id']
+
+    def search(self, headers, query, **params):
+        response = self.client.get('/api/search', query_string=dict(params, q=query), headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return {item['dream_id'] for item in response.get_json()['results']}
+
+    def test_cjk_matching(self):
+        _, headers = self.register()
+        dream_id = self.add_dream(headers, '海边的灯塔', '梦见自己在灯塔顶上看日出')
+
+        self.assertIn(dream_id, self.search(headers, '灯塔'))
+        self.assertIn(dream_id, self.search(headers, '日出'))
+        # 单个汉字匹配包含该字的词
+        self.assertIn(dream_id, self.search(headers, '塔'))
+        # 所有查询词都必须命中
+        self.assertNotIn(dream_id, self.search(headers, '灯塔 沙漠'))
+
+    def test_visibility(self):
+        _, alice = self.register('alice')
+        _, bob = self.register('bob')
+        _, member = self.register('member')
+        space_id = self.create_space(alice)
+        self.join_space(space_id, alice, member)
+        personal_id = self.add_dream(alice, '独角兽', '独角兽在森林里奔跑')
+        space_dream_id = self.add_dream(alice, '独角兽的空间梦', '和大家一起追独角兽', space_id)
+
+        self.assertEqual(self.search(alice, '独角兽'), {personal_id, space_dream_id})
+        self.assertEqual(self.search(member, '独角兽'), {space_dream_id})
+        self.assertEqual(self.search(bob, '独角兽'), set())
+        response = self.client.get('/api/search', query_string={'q': '独角兽', 'space_id': space_id}, headers=bob)
+        self.assertEqual(response.status_code, 403)
+
+    def test_derived_snippet(self):
+        _, headers = self.register()
+        dream_id = self.add_dream(headers, '迷宫', '在镜子做的迷宫里迷路')
+        self.search(headers, '迷宫')
+        for style in ('周公', '弗洛伊德'):
+            response = self.client.post('/api/dream_interpretations', json={
+                'dream_id': dream_id, 'style': style, 'content': f'{style}解梦：迷宫象征内心的困惑'}, headers=headers)
+            self.assertEqual(response.status_code, 201)
+
+        response = self.client.get('/api/search', query_string={'q': '困惑', 'types': 'interpretation'}, headers=headers)
+        results = response.get_json()['results']
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all('迷宫象征内心的困惑' in item['snippet'] for item in results))
+        # 索引中不保存正文
+        self.assertTrue(all('content' not in doc for doc in tapir_app.search_index._docs.values()))
+
+    def test_writes_do_not_build_index(self):
+        _, headers = self.register()
+        first_id = self.add_dream(headers, '第一个梦', '骑着鲸鱼穿过云层')
+        self.assertFalse(tapir_app.search_index.is_built())
+
+        self.assertIn(first_id, self.search(headers, '鲸鱼'))
+        self.assertTrue(tapir_app.search_index.is_built())
+        # 索引建立后写入增量更新索引
+        second_id = self.add_dream(headers, '第二个梦', '鲸鱼在沙漠里唱歌')
+        self.assertEqual(self.search(headers, '鲸鱼'), {first_id, second_id})
+
+
+if __name__ == '__main__':
+    unittest.main()
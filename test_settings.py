@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+
+# 用户设置测试：每个用户的设置单独保存，修改一个用户的设置不影响其他用户
+#
+# 运行: python -m pytest test_settings.py  或  python test_settings.py
+
+from apitest import ApiTestCase
+import settings
+from storage import USER_SETTINGS_FILE, read_data, write_data
+
+
+class SettingsIsolationTest(ApiTestCase):
+
+    def get(self, headers):
+        response = self.client.get('/api/user/settings', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def put(self, headers, data):
+        return self.client.put('/api/user/settings', json=data, headers=headers)
+
+    def test_users_do_not_share_settings(self):
+        alice_id, alice = self.register('alice')
+        bob_id, bob = self.register('bob')
+
+        self.assertEqual(self.put(alice, {'timezone': 'Asia/Tokyo'}).status_code, 200)
+        self.assertEqual(self.put(bob, {'defaultShareSpaceId': 'space-1'}).status_code, 200)
+
+        self.assertEqual(self.get(alice), {'timezone': 'Asia/Tokyo', 'defaultShareSpaceId': None})
+        self.assertEqual(self.get(bob), {'timezone': None, 'defaultShareSpaceId': 'space-1'})
+        # 每个用户一个设置文件
+        self.assertNotEqual(settings.settings_path(alice_id), settings.settings_path(bob_id))
+        self.assertTrue(os.path.exists(settings.settings_path(alice_id)))
+        self.assertEqual(read_data(settings.settings_path(bob_id)).get('timezone'), None)
+
+    def test_legacy_settings_are_per_user(self):
+        alice_id, alice = self.register('alice')
+        bob_id, bob = self.register('bob')
+        legacy = read_data(USER_SETTINGS_FILE)
+        legacy[alice_id] = {'timezone': 'Europe/Paris'}
+        legacy[bob_id] = {'timezone': 'America/New_York'}
+        write_data(USER_SETTINGS_FILE, legacy)
+
+        # 修改一个用户的设置只写该用户的新文件，另一个用户仍读取旧版设置
+        self.assertEqual(self.put(alice, {'defaultShareSpaceId': 'space-2'}).status_code, 200)
+        self.assertEqual(self.get(alice), {'timezone': 'Europe/Paris', 'defaultShareSpaceId': 'space-2'})
+        self.assertEqual(self.get(bob), {'timezone': 'America/New_York', 'defaultShareSpaceId': None})
+        self.assertFalse(os.path.exists(settings.settings_path(bob_id)))
+
+    def test_invalid_settings_rejected(self):
+        _, headers = self.register()
+        self.assertEqual(self.put(headers, {'unknown': 1}).status_code, 400)
+        self.assertEqual(self.put(headers, {'timezone': 'Not/AZone'}).status_code, 400)
+        self.assertEqual(self.get(headers), settings.default_settings())
+
+
+if __name__ == '__main__':
+    unittest.main()
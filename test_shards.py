@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+# 按空间分片存储的测试：相同内容的梦境共享ID时，修改和删除只作用于调用者自己的记录；create_app 核对数据目录布局
+#
+# 运行: python -m pytest test_shards.py  或  python test_shards.py
+
+from apitest import ApiTestCase, tapir_app
+import storage
+from storage import DREAMS_FILE, StorageConfig, read_collection
+
+
+class SharedDreamIdTest(ApiTestCase):
+
+    def test_update_and_delete_own_dream(self):
+        alice_id, alice = self.register('alice')
+        bob_id, bob = self.register('bob')
+        space_id = self.create_space(bob)
+        # 相同内容：个人梦境和空间梦境共享ID
+        own = self.client.post('/api/dreams', json={'title': '同一个梦', 'content': '飞过海面'}, headers=alice).get_json()
+        shared = self.client.post(f'/api/spaces/{space_id}/dreams', json={'title': '同一个梦', 'content': '飞过海面'},
+                                  headers=bob).get_json()
+        self.assertEqual(own['id'], shared['id'])
+        dream_id = own['id']
+
+        response = self.client.put(f'/api/dreams/{dream_id}', json={'title': '同一个梦', 'content': '飞过海面', 'mood': 1},
+                                   headers=alice)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['user_id'], alice_id)
+        # 修改后该ID下记录的顺序不变
+        self.assertEqual(tapir_app.get_dream_index().get(dream_id).get('user_id'), alice_id)
+
+        response = self.client.delete(f'/api/dreams/{dream_id}', headers=alice)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['user_id'], alice_id)
+        remaining = [dream for dream in read_collection(DREAMS_FILE) if dream.get('id') == dream_id]
+        self.assertEqual([(dream.get('user_id'), dream.get('space_id')) for dream in remaining], [(bob_id, space_id)])
+
+
+class StorageConfigTest(ApiTestCase):
+
+    def test_create_app_checks_storage_layout(self):
+        # 与导入时相同的布局可以传入；布局只能由环境变量确定，不同的布局直接报错
+        tapir_app.create_app({'BACKGROUND_JOBS': False, 'STORAGE': StorageConfig.from_env()})
+        with self.assertRaises(ValueError):
+            tapir_app.create_app({'BACKGROUND_JOBS': False,
+                                  'STORAGE': StorageConfig(storage.DATA_DIR + '_other')})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+# 启动测试：导入应用模块的耗时预算，以及导入和 create_app 不产生副作用（不创建数据文件、不启动线程）
+# 每个检查在新的Python进程中运行，不受其他已导入模块的影响
+#
+# 运行: python -m pytest test_startup.py  或  python test_startup.py
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 导入应用模块（不含 flask 等第三方依赖）的耗时预算
+IMPORT_BUDGET_MS = float(os.environ.get('TAPIR_IMPORT_BUDGET_MS', '150'))
+
+# 导入应用时不应加载的模块（只在个别请求或命令行工具中使用）
+DEFERRED_MODULES = ('jwt', 'cProfile', 'pstats', 'argparse')
+
+CHILD_SCRIPT = '''
+import json, os, sys, threading, time
+import flask, flask_cors
+started_at = time.perf_counter()
+import app
+import_ms = (time.perf_counter() - started_at) * 1000
+result = {
+    'import_ms': import_ms,
+    'threads_after_import': threading.active_count(),
+    'data_dir_after_import': os.path.exists(os.environ['TAPIR_DATA_DIR']),
+    'loaded_deferred': [name for name in %r if name in sys.modules]
+}
+application = app.create_app({'BACKGROUND_JOBS': False})
+result['threads_after_create'] = threading.active_count()
+result['data_dir_after_create'] = os.path.exists(os.environ['TAPIR_DATA_DIR'])
+application.test_client().get('/api/dreams')
+result['users_file_after_request'] = os.path.exists(os.path.join(os.environ['TAPIR_DATA_DIR'], 'users.json'))
+print(json.dumps(result))
+''' % (DEFERRED_MODULES,)
+
+
+def run_child():
+    with tempfile.TemporaryDirectory(prefix='tapir_test_startup_') as tmp_dir:
+        env = dict(os.environ, TAPIR_DATA_DIR=os.path.join(tmp_dir, 'data'))
+        output = subprocess.run([sys.executable, '-c', CHILD_SCRIPT], cwd=PACKAGE_DIR, env=env,
+                                check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+class StartupTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # 第一次运行可能需要编译字节码，取第二次的结果
+        run_child()
+        cls.result = run_child()
+
+    def test_import_within_budget(self):
+        self.assertLess(self.result['import_ms'], IMPORT_BUDGET_MS)
+
+    def test_import_has_no_side_effects(self):
+        self.assertEqual(self.result['threads_after_import'], 1)
+        self.assertFalse(self.result['data_dir_after_import'])
+
+    def test_heavy_modules_are_deferred(self):
+        self.assertEqual(self.result['loaded_deferred'], [])
+
+    def test_storage_initialized_on_first_request(self):
+        self.assertEqual(self.result['threads_after_create'], 1)
+        self.assertFalse(self.result['data_dir_after_create'])
+        self.assertTrue(self.result['users_file_after_request'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+# 增量同步测试：按水位分页取回全部变更，删除通过墓碑同步
+#
+# 运行: python -m pytest test_sync.py  或  python test_sync.py
+
+from apitest import ApiTestCase
+
+
+class SyncTest(ApiTestCase):
+
+    def sync(self, headers, cursor=None, limit=None):
+        params = {key: value for key, value in (('cursor', cursor), ('limit', limit)) if value is not None}
+        response = self.client.get('/api/sync', query_string=params, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    # 按页同步直到没有更多变更，返回 (每页的数据, 最后的游标)
+    def sync_all(self, headers, cursor=None, limit=None):
+        pages = []
+        while True:
+            page = self.sync(headers, cursor, limit)
+            pages.append(page)
+            cursor = page['cursor']
+            if not page['has_more']:
+                return pages, cursor
+
+    def create_task(self, headers, title, space_id=None):
+        path = f'/api/spaces/{space_id}/tasks' if space_id else '/api/tasks'
+        response = self.client.post(path, json={'title': title, 'required_images': 0}, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()['id']
+
+    @staticmethod
+    def updated_ids(pages, collection):
+        return [item['id'] for page in pages for item in page['changes'][collection]['updated']]
+
+    def test_watermark_paging(self):
+        _, headers = self.register()
+        task_ids = [self.create_task(headers, f'任务{i}') for i in range(5)]
+
+        pages, cursor = self.sync_all(headers, limit=2)
+        self.assertEqual(len(pages), 3)
+        self.assertTrue(all(page['has_more'] for page in pages[:-1]))
+        # 每个任务恰好返回一次，设置只在首次同步时返回
+        self.assertEqual(sorted(self.updated_ids(pages, 'tasks')), sorted(task_ids))
+        self.assertIsNotNone(pages[0]['changes']['settings'])
+        self.assertTrue(all(page['changes']['settings'] is None for page in pages[1:]))
+
+        # 没有新变更
+        page = self.sync(headers, cursor)
+        self.assertFalse(page['has_more'])
+        self.assertEqual(self.updated_ids([page], 'tasks'), [])
+
+        # 修改过的任务和新任务在下次同步中返回
+        response = self.client.put(f'/api/tasks/{task_ids[0]}', json={'title': '改过的任务'}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        new_id = self.create_task(headers, '新任务')
+        pages, _ = self.sync_all(headers, cursor, limit=1)
+        self.assertEqual(self.updated_ids(pages, 'tasks'), [task_ids[0], new_id])
+
+    def test_tombstones(self):
+        _, owner = self.register('owner')
+        _, member = self.register('member')
+        space_id = self.create_space(owner)
+        self.join_space(space_id, owner, member)
+        personal_id = self.create_task(member, '个人任务')
+        space_task_id = self.create_task(owner, '空间任务', space_id)
+        _, cursor = self.sync_all(member)
+
+        self.assertEqual(self.client.delete(f'/api/tasks/{personal_id}', headers=member).status_code, 200)
+        self.assertEqual(self.client.delete(f'/api/tasks/{space_task_id}', headers=owner).status_code, 200)
+        pages, cursor = self.sync_all(member, cursor, limit=1)
+        self.assertEqual([task_id for page in pages for task_id in page['changes']['tasks']['deleted']],
+                         [personal_id, space_task_id])
+
+        # 空间被删除后，成员同步到空间的删除，不再属于该空间
+        self.assertEqual(self.client.delete(f'/api/spaces/{space_id}', headers=owner).status_code, 200)
+        page = self.sync(member, cursor)
+        self.assertEqual(page['changes']['spaces']['deleted'], [space_id])
+        self.assertNotIn(space_id, page['space_ids'])
+
+        # 首次同步不返回删除记录
+        _, other = self.register('other')
+        pages, _ = self.sync_all(other)
+        self.assertTrue(all(not page['changes'][collection]['deleted']
+                            for page in pages for collection in ('spaces', 'dreams', 'tasks', 'records')))
+
+
+if __name__ == '__main__':
+    unittest.main()
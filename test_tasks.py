@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import time
+import unittest
+
+# 任务测试：换日时缺卡记录（missed_dates）的判定，以及批量审批
+# 测试使用临时数据目录和Flask测试客户端，不需要启动服务器
+#
+# 运行: python -m pytest test_tasks.py  或  python test_tasks.py
+
+os.environ.setdefault('TAPIR_DATA_DIR', os.path.join(tempfile.mkdtemp(prefix='tapir_test_tasks_'), 'data'))
+
+import app as tapir_app
+import events
+from storage import TASKS_FILE, TASK_RECORDS_FILE, HISTORY_RECORDS_FILE, read_collection, read_data
+
+
+class TaskTestCase(unittest.TestCase):
+    """注册一个测试用户，提供创建和完成任务的辅助方法"""
+
+    username = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = tapir_app.create_app({'BACKGROUND_JOBS': False}).test_client()
+        response = cls.client.post('/api/auth/register', json={
+            'username': cls.username, 'password': 'password123', 'email': f'{cls.username}@example.com'})
+        cls.headers = {'Authorization': 'Bearer ' + response.get_json()['token']}
+
+    def create_task(self, path, title):
+        response = self.client.post(path, json={'title': title, 'required_images': 0}, headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()['id']
+
+    def complete(self, task_id):
+        response = self.client.post(f'/api/tasks/{task_id}/complete', json={'images': []}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+
+
+class RolloverTest(TaskTestCase):
+
+    username = 'rollover_user'
+
+    def test_personal_checkin_counts_without_approval(self):
+        space_id = self.client.post('/api/spaces', json={'name': 'rollover'}, headers=self.headers).get_json()['id']
+        personal_id = self.create_task('/api/tasks', '个人任务')
+        space_task_id = self.create_task(f'/api/spaces/{space_id}/tasks', '空间任务')
+        unchecked_id = self.create_task('/api/tasks', '未打卡的个人任务')
+        # 两个任务今天都已打卡，空间任务的打卡尚未审核
+        self.complete(personal_id)
+        self.complete(space_task_id)
+
+        # 换到明天：今天成为需要检查的日期
+        tapir_app.roll_over_tasks(time.time() + 86400)
+        missed = {task['id']: task.get('missed_dates') or [] for task in read_collection(TASKS_FILE)}
+
+        self.assertEqual(missed[personal_id], [])
+        self.assertEqual(len(missed[space_task_id]), 1)
+        self.assertEqual(len(missed[unchecked_id]), 1)
+
+
+class BatchReviewTest(TaskTestCase):
+
+    username = 'review_user'
+
+    def test_duplicate_record_ids_are_reviewed_once(self):
+        space_id = self.client.post('/api/spaces', json={'name': 'review'}, headers=self.headers).get_json()['id']
+        task_id = self.create_task(f'/api/spaces/{space_id}/tasks', '待审批的任务')
+        self.complete(task_id)
+        record_id = next(record['id'] for record in read_collection(TASK_RECORDS_FILE) if record['task_id'] == task_id)
+        histories = len(read_data(HISTORY_RECORDS_FILE))
+
+        response = self.client.post(f'/api/spaces/{space_id}/tasks/records/batch/approve',
+                                    json={'record_ids': [record_id, record_id], 'comment': '好'}, headers=self.headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['record_id'] for result in response.get_json()['results']], [record_id])
+        self.assertEqual(len(read_data(HISTORY_RECORDS_FILE)), histories + 1)
+        approvals = [event for event in events.events_since(space_id) if event['type'] == events.CHECKIN_APPROVED]
+        self.assertEqual(len(approvals), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()